@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""Measure conversion of note content received and sent by sync.
+
+Compares BeautifulSoup parsing (before) with provider/enml.py one pass
+converter, on note with given count of paragraphs.
+
+    python benchmarks/enml_convert.py [paragraphs count]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from BeautifulSoup import BeautifulSoup
+from everpad.provider.enml import enml_to_html, html_to_enml
+from everpad.tools import sanitize
+
+PARAGRAPH = (
+    '<div>Paragraph with <b>bold</b>, <i>italic</i> and '
+    '<a href="http://example.com/?a=1&amp;b=2">link</a> &amp; '
+    'text&nbsp;here.</div>\n<ul><li>item</li><li><en-todo checked="true">'
+    '</en-todo>task</li></ul>\n'
+)
+
+
+def soup_to_html(content):
+    """Note content from ENML, as before"""
+    soup = BeautifulSoup(content.decode('utf8'))
+    return reduce(
+        lambda txt, cur: txt + unicode(cur),
+        soup.find('en-note').contents, u'',
+    )
+
+
+def soup_to_enml(content):
+    """ENML from note content, as before"""
+    enml_content = (u"""
+        <!DOCTYPE en-note SYSTEM "http://xml.evernote.com/pub/enml2.dtd">
+        <en-note>{}</en-note>
+    """.format(sanitize(html=content))).strip().encode('utf8')
+    return str(BeautifulSoup(enml_content, selfClosingTags=[
+        'img', 'en-todo', 'en-media', 'br', 'hr',
+    ]))
+
+
+def run(convert, content):
+    """Convert content, return time"""
+    started = time.time()
+    convert(content)
+    return time.time() - started
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    enml = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<!DOCTYPE en-note SYSTEM "http://xml.evernote.com/pub/enml2.dtd">\n'
+        '<en-note>%s</en-note>' % (PARAGRAPH * count)
+    )
+    html = enml_to_html(enml)
+    assert html == soup_to_html(enml)
+    assert html_to_enml(html) == soup_to_enml(html)
+    print('%d paragraphs, content %.1f KB' % (count, len(enml) / 1024.0))
+    print('%-24s %10s %10s' % ('conversion', 'time, ms', 'KB/s'))
+    for title, convert, content in (
+        ('pull BeautifulSoup', soup_to_html, enml),
+        ('pull enml_to_html', enml_to_html, enml),
+        ('push BeautifulSoup', soup_to_enml, html),
+        ('push html_to_enml', html_to_enml, html),
+    ):
+        elapsed = min(run(convert, content) for _ in range(3))
+        print('%-24s %10.1f %10.0f' % (
+            title, elapsed * 1000, len(content) / 1024.0 / elapsed,
+        ))
+
+
+if __name__ == '__main__':
+    main()
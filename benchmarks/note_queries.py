@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Measure queries and time of notes list serialization.
+
+Notes with notebook, place, two tags and conflict children are found
+like find_notes does, with relations loaded lazily per note (before)
+and eagerly with conflict items loaded at once (current).
+
+    python benchmarks/note_queries.py [notes count]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from sqlalchemy import event
+from everpad import const, basetypes as btype
+from everpad.provider import models
+from everpad.provider.service import NoteFilterer
+from everpad.provider.tools import get_db_session
+
+NOTEBOOKS = 20
+TAGS = 200
+PLACES = 50
+CONFLICT_EVERY = 20
+
+
+def fill(session, count):
+    """Create notes with relations"""
+    notebooks = [
+        models.Notebook(name='notebook%d' % num, default=not num,
+                        action=const.ACTION_NONE)
+        for num in range(NOTEBOOKS)
+    ]
+    tags = [
+        models.Tag(name='tag%d' % num, action=const.ACTION_NONE)
+        for num in range(TAGS)
+    ]
+    places = [models.Place(name='place%d' % num) for num in range(PLACES)]
+    session.add_all(notebooks + tags + places)
+    for num in range(count):
+        note = models.Note(
+            title='title%d' % num, content='content', action=const.ACTION_NONE,
+            created=num, updated=num, notebook=notebooks[num % NOTEBOOKS],
+            place=places[num % PLACES],
+            tags=[tags[num % TAGS], tags[(num + 1) % TAGS]],
+        )
+        session.add(note)
+        if not num % CONFLICT_EVERY:
+            session.flush()
+            session.add(models.Note(
+                title='conflict%d' % num, action=const.ACTION_CONFLICT,
+                conflict_parent_id=note.id,
+            ))
+    session.commit()
+
+
+def lazy(session, count):
+    """Notes list as before"""
+    filterer = NoteFilterer(session).order_by(const.ORDER_UPDATED)
+    return btype.Note.list >> filterer._filter(
+        session.query(models.Note),
+    ).limit(count)
+
+
+def eager(session, count):
+    """Notes list as find_notes does"""
+    notes = NoteFilterer(session).order_by(const.ORDER_UPDATED)\
+        .all().limit(count).all()
+    return btype.Note.list >> models.load_conflict_items(session, notes)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    path = tempfile.mkdtemp()
+    try:
+        session = get_db_session(os.path.join(path, 'everpad.db'))
+        fill(session, count)
+        queries = []
+        event.listen(
+            session.bind, 'before_cursor_execute',
+            lambda *args: queries.append(args[2]),
+        )
+        print('%d notes' % count)
+        print('%-8s %10s %10s' % ('loading', 'queries', 'time, ms'))
+        results = []
+        for title, serialize in (('lazy', lazy), ('eager', eager)):
+            session.expunge_all()
+            del queries[:]
+            started = time.time()
+            with models.unit_of_work(session):
+                results.append(serialize(session, count))
+            elapsed = time.time() - started
+            print('%-8s %10d %10.1f' % (title, len(queries), elapsed * 1000))
+        assert results[0] == results[1]
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
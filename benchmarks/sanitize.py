@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Measure sanitizing of note content on synthetic notes.
+
+Compares sanitize() from before (attributes removed one by one,
+content joined by reduce) with current tools.sanitize, both on parsed
+soup like the editor calls them, and html_to_enml used by sync, which
+parses content itself, on 1 KB, 100 KB, 1 MB and 5 MB notes.
+
+    python benchmarks/sanitize.py [max size, KB]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from BeautifulSoup import BeautifulSoup
+from everpad.provider.enml import html_to_enml
+from everpad.tools import (
+    sanitize, clean, allowed_href, ALLOWED_TAGS, DISALLOWED_ATTRS,
+)
+
+SIZES = (1, 100, 1024, 5 * 1024)
+# reduce copies content for every node, skipped on large notes
+REDUCE_MAX_SIZE = 1024
+PARAGRAPH = (
+    u'<div class="line" id="l">Paragraph with <b>bold</b>, '
+    u'<a href="http://example.com/?a=1&amp;b=2" onclick="go()">link</a>, '
+    u'<a href="javascript:void(0)">script</a> &amp; text&nbsp;here.'
+    u'<custom>unknown <i>tag</i></custom></div>\n'
+)
+
+
+def reduce_sanitize(soup):
+    """sanitize() as before"""
+    for tag in soup.findAll(True):
+        if tag.name in ALLOWED_TAGS:
+            for attr in DISALLOWED_ATTRS:
+                try:
+                    del tag[attr]
+                except KeyError:
+                    pass
+            try:
+                if not allowed_href(tag['href']):
+                    del tag['href']
+            except KeyError:
+                pass
+        else:
+            tag.hidden = True
+    return clean(reduce(
+        lambda txt, cur: txt + unicode(cur), soup.contents, u'',
+    ))
+
+
+def run(convert, html, parse):
+    """Convert content, return time"""
+    content = BeautifulSoup(html) if parse else html
+    started = time.time()
+    convert(content)
+    return time.time() - started
+
+
+def main():
+    max_size = int(sys.argv[1]) if len(sys.argv) > 1 else SIZES[-1]
+    print('%-8s %-18s %10s %10s' % ('note', 'sanitizer', 'time, ms', 'KB/s'))
+    for size in SIZES:
+        if size > max_size:
+            break
+        html = PARAGRAPH * (size * 1024 / len(PARAGRAPH) + 1)
+        cases = [
+            ('sanitize', lambda soup: sanitize(soup=soup), True),
+            ('html_to_enml', html_to_enml, False),
+        ]
+        if size <= REDUCE_MAX_SIZE:
+            assert reduce_sanitize(BeautifulSoup(html)) == sanitize(html=html)
+            cases.insert(0, ('sanitize, before', reduce_sanitize, True))
+        for title, convert, parse in cases:
+            elapsed = min(
+                run(convert, html, parse)
+                for _ in range(1 if size > 1000 else 3)
+            )
+            print('%-8s %-18s %10.1f %10.0f' % (
+                '%d KB' % size, title, elapsed * 1000,
+                len(html) / 1024.0 / elapsed,
+            ))
+
+
+if __name__ == '__main__':
+    main()
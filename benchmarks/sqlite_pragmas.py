@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""Measure sqlite pragmas impact on sync writes and concurrent reads.
+
+Writer inserts notes like sync thread does (commit per note and in
+batches), reader queries notes list like the service does meanwhile.
+
+    python benchmarks/sqlite_pragmas.py [notes count]
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from everpad.const import DEFAULT_DB_PRAGMAS
+
+
+SCHEMA = """
+CREATE TABLE notes (
+    id INTEGER PRIMARY KEY,
+    guid VARCHAR,
+    title VARCHAR,
+    content VARCHAR,
+    updated BIGINT,
+    action INTEGER
+)
+"""
+CONTENT = 'x' * 2048
+
+
+def connect(path, pragmas):
+    """Open connection with pragmas"""
+    connection = sqlite3.connect(path, timeout=30)
+    for name, value in pragmas:
+        connection.execute('PRAGMA %s = %s' % (name, value))
+    return connection
+
+
+def write(path, pragmas, count, batch):
+    """Insert notes, commit every batch notes"""
+    connection = connect(path, pragmas)
+    started = time.time()
+    for num in range(count):
+        connection.execute(
+            'INSERT INTO notes (guid, title, content, updated, action) '
+            'VALUES (?, ?, ?, ?, 0)',
+            ('guid%d' % num, 'title%d' % num, CONTENT, num),
+        )
+        if not (num + 1) % batch:
+            connection.commit()
+    connection.commit()
+    connection.close()
+    return time.time() - started
+
+
+def read(path, pragmas, stop, latencies):
+    """Query notes list until stopped"""
+    connection = connect(path, pragmas)
+    while not stop.is_set():
+        started = time.time()
+        connection.execute(
+            'SELECT id, title FROM notes WHERE action != 2 '
+            'ORDER BY updated DESC LIMIT 100',
+        ).fetchall()
+        latencies.append(time.time() - started)
+        time.sleep(0.001)
+    connection.close()
+
+
+def run(pragmas, count, batch):
+    """Run writer with concurrent reader on fresh database"""
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'bench.db')
+        connection = connect(path, pragmas)
+        connection.execute(SCHEMA)
+        connection.commit()
+        connection.close()
+
+        stop = threading.Event()
+        latencies = []
+        reader = threading.Thread(
+            target=read, args=(path, pragmas, stop, latencies),
+        )
+        reader.start()
+        elapsed = write(path, pragmas, count, batch)
+        stop.set()
+        reader.join()
+    finally:
+        shutil.rmtree(directory)
+
+    latencies.sort()
+    return (
+        elapsed, count / elapsed, len(latencies),
+        latencies[len(latencies) // 2] * 1000,
+        latencies[-1] * 1000,
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print('sqlite %s, %d notes' % (sqlite3.sqlite_version, count))
+    print('%-8s %6s %9s %10s %7s %14s %14s' % (
+        'pragmas', 'batch', 'time, s', 'notes/s', 'reads',
+        'read p50, ms', 'read max, ms',
+    ))
+    for title, pragmas in (
+        ('default', ()),
+        ('tuned', DEFAULT_DB_PRAGMAS),
+    ):
+        for batch in (1, 100):
+            print('%-8s %6d %9.2f %10.0f %7d %14.2f %14.2f' % (
+                (title, batch) + run(pragmas, count, batch)
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""Measure decoding of large findNotesMetadata reply.
+
+Reply goes through NoteStore.Client and THttpClient with fake http
+connection, like sync does. Compares unbuffered transport with pure
+python codec (before), buffered THttpClient with pure python codec and
+with fastbinary when it's built (python setup.py build_ext --inplace).
+
+    python benchmarks/thrift_codec.py [notes count]
+"""
+import os
+import sys
+import time
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from thrift.Thrift import TMessageType
+from thrift.protocol import TBinaryProtocol
+from thrift.transport import THttpClient, TTransport
+from evernote.edam.notestore import NoteStore
+from evernote.edam.type import ttypes
+try:
+    from thrift.protocol import fastbinary
+except ImportError:
+    fastbinary = None
+
+
+class FakeHttp(object):
+    """Legacy httplib.HTTP replying with prepared body"""
+
+    def __init__(self, body):
+        self.file = StringIO(body)
+
+    def putrequest(self, *args, **kwargs):
+        pass
+
+    def putheader(self, *args):
+        pass
+
+    def endheaders(self):
+        pass
+
+    def send(self, data):
+        pass
+
+    def getreply(self):
+        return 200, 'OK', {}
+
+    def close(self):
+        pass
+
+
+class UnbufferedClient(THttpClient.THttpClient):
+    """THttpClient reading from response file directly, as before"""
+
+    def read(self, sz):
+        return self._THttpClient__http.file.read(sz)
+
+
+def create_reply(count):
+    """Serialize findNotesMetadata reply with count notes"""
+    notes = NoteStore.NotesMetadataList(
+        startIndex=0, totalNotes=count, notes=[
+            NoteStore.NoteMetadata(
+                guid='%036d' % num,
+                title='Note title number %d' % num,
+                contentLength=2048,
+                created=1400000000000 + num,
+                updated=1400000000000 + num,
+                updateSequenceNum=num,
+                notebookGuid='%036d' % 0,
+                tagGuids=['%036d' % tag for tag in range(3)],
+                attributes=ttypes.NoteAttributes(
+                    source='desktop.linux', author='everpad',
+                ),
+            ) for num in range(count)
+        ],
+    )
+    buf = TTransport.TMemoryBuffer()
+    protocol = TBinaryProtocol.TBinaryProtocol(buf)
+    protocol.writeMessageBegin(
+        'findNotesMetadata', TMessageType.REPLY, 0,
+    )
+    NoteStore.findNotesMetadata_result(success=notes).write(protocol)
+    protocol.writeMessageEnd()
+    return buf.getvalue()
+
+
+def run(client_cls, protocol_cls, reply):
+    """Call findNotesMetadata, return time of call"""
+    client = client_cls('https://www.evernote.com/shard/s1/notestore')
+    client.open = lambda: setattr(
+        client, '_THttpClient__http', FakeHttp(reply),
+    )
+    note_store = NoteStore.Client(protocol_cls(client))
+    started = time.time()
+    result = note_store.findNotesMetadata(
+        'token', NoteStore.NoteFilter(), 0, 250,
+        NoteStore.NotesMetadataResultSpec(),
+    )
+    elapsed = time.time() - started
+    assert result.totalNotes == len(result.notes)
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    reply = create_reply(count)
+    print('%d notes, reply %.1f MB, fastbinary %s' % (
+        count, len(reply) / 1024.0 / 1024, 'built' if fastbinary else 'missing',
+    ))
+    print('%-36s %9s %10s' % ('transport / protocol', 'time, s', 'notes/s'))
+    cases = [
+        ('unbuffered / TBinaryProtocol',
+         UnbufferedClient, TBinaryProtocol.TBinaryProtocol),
+        ('THttpClient / TBinaryProtocol',
+         THttpClient.THttpClient, TBinaryProtocol.TBinaryProtocol),
+    ]
+    if fastbinary:
+        cases.append((
+            'THttpClient / Accelerated', THttpClient.THttpClient,
+            TBinaryProtocol.TBinaryProtocolAccelerated,
+        ))
+    for title, client_cls, protocol_cls in cases:
+        elapsed = min(run(client_cls, protocol_cls, reply) for _ in range(3))
+        print('%-36s %9.3f %10.0f' % (title, elapsed, count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""Measure reading of multi-MB getResourceData reply over http.
+
+Local keep-alive server replies with resource body, THttpClient reads
+it like sync does: unbuffered (read straight from response, as before),
+with read-ahead buffer only and with large reads going to response
+directly (current).
+
+    python benchmarks/thrift_http_read.py [body size, MB]
+"""
+import os
+import sys
+import threading
+import time
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from thrift.Thrift import TMessageType
+from thrift.protocol import TBinaryProtocol
+from thrift.transport import THttpClient, TTransport
+from evernote.edam.notestore import NoteStore
+try:
+    from thrift.protocol import fastbinary
+except ImportError:
+    fastbinary = None
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Reply with prepared body"""
+    protocol_version = 'HTTP/1.1'
+    reply = ''
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.reply)))
+        self.end_headers()
+        self.wfile.write(self.reply)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class UnbufferedClient(THttpClient.THttpClient):
+    """Reads straight from response, as before"""
+
+    def read(self, sz):
+        return self._THttpClient__file.read(sz)
+
+    def readAll(self, sz):
+        return TTransport.TTransportBase.readAll(self, sz)
+
+
+class ReadAheadClient(THttpClient.THttpClient):
+    """Large reads are copied through read-ahead buffer"""
+
+    def readAll(self, sz):
+        return TTransport.TTransportBase.readAll(self, sz)
+
+
+def create_reply(size):
+    """Serialize getResourceData reply with body of size bytes"""
+    buf = TTransport.TMemoryBuffer()
+    protocol = TBinaryProtocol.TBinaryProtocol(buf)
+    protocol.writeMessageBegin('getResourceData', TMessageType.REPLY, 0)
+    NoteStore.getResourceData_result(success='x' * size).write(protocol)
+    protocol.writeMessageEnd()
+    return buf.getvalue()
+
+
+def run(uri, pool, client_cls, protocol_cls, size):
+    """Get resource data few times, return best time"""
+    note_store = NoteStore.Client(protocol_cls(client_cls(uri, pool=pool)))
+    times = []
+    for _ in range(5):
+        started = time.time()
+        data = note_store.getResourceData('token', 'guid')
+        times.append(time.time() - started)
+        assert len(data) == size
+    return min(times)
+
+
+def main():
+    size = int(sys.argv[1] if len(sys.argv) > 1 else 16) * 1024 * 1024
+    Handler.reply = create_reply(size)
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    uri = 'http://127.0.0.1:%d/edam/note' % server.server_port
+    pool = THttpClient.THttpConnectionPool()
+
+    protocols = [('pure', TBinaryProtocol.TBinaryProtocol)]
+    if fastbinary:
+        protocols.append((
+            'fastbinary', TBinaryProtocol.TBinaryProtocolAccelerated,
+        ))
+    print('resource %d MB' % (size / 1024 / 1024))
+    print('%-12s %-12s %9s %8s' % ('client', 'protocol', 'time, ms', 'MB/s'))
+    for title, client_cls in (
+        ('unbuffered', UnbufferedClient),
+        ('read-ahead', ReadAheadClient),
+        ('current', THttpClient.THttpClient),
+    ):
+        for protocol_title, protocol_cls in protocols:
+            if client_cls is UnbufferedClient and fastbinary\
+                    and protocol_title == 'fastbinary':
+                continue
+            elapsed = run(uri, pool, client_cls, protocol_cls, size)
+            print('%-12s %-12s %9.1f %8.0f' % (
+                title, protocol_title, elapsed * 1000,
+                size / 1024.0 / 1024 / elapsed,
+            ))
+    pool.clear()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -109,6 +109,7 @@ class Note(DbusSendable):
     ORDER_UPDATED = 1
     ORDER_TITLE_DESC = 2
     ORDER_UPDATED_DESC = 3
+    ORDER_RELEVANCE = 4
 
     fields = (
         ('id', 'i'),
@@ -127,6 +128,18 @@ class Note(DbusSendable):
     )
 
 
+class NoteSummary(DbusSendable):
+    fields = (
+        ('id', 'i'),
+        ('title', 's'),
+        ('updated', 'x'),
+        ('created', 'x'),
+        ('notebook', 'i'),
+        ('pinnded', 'b'),
+        ('snippet', 's'),
+    )
+
+
 class Notebook(DbusSendable):
     fields = (
         ('id', 'i'),
@@ -10,6 +10,23 @@ STATUS_NONE = 0
 STATUS_SYNC = 1
 
 DEFAULT_SYNC_DELAY = 30000 * 60
+SYNC_CHUNK_MAX_ENTRIES = 100
+DEFAULT_SYNC_WORKERS = 4
+DEFAULT_SYNC_BATCH_SIZE = 100
+DEFAULT_SYNC_BATCH_INTERVAL = 1000
+# api calls budget, see provider/sync/scheduler.py
+DEFAULT_SYNC_CALLS_PER_HOUR = 3600
+DEFAULT_SYNC_CALLS_BURST = 300
+RATE_LIMIT_MAX_WAIT = 120  # seconds rate limit is waited in sync
+DEFAULT_GEOCODE_TIMEOUT = 10  # seconds, see provider/geocode.py
+DEFAULT_SERVICE_READERS = 4  # threads answering service queries
+# phases of interrupted sync stored in Sync.checkpoint_phase
+CHECKPOINT_NONE = 0
+CHECKPOINT_CHUNKS = 1  # incremental sync after checkpoint_usn
+CHECKPOINT_NOTES = 2  # full sync notes from checkpoint_offset
+CHECKPOINT_OVERLAP = 50  # notes pulled again on resume
+HTTP_POOL_SIZE = DEFAULT_SYNC_WORKERS + 2  # idle connections per host
+HTTP_COMPRESSION = True  # accept gzip and deflate responses
 SYNC_STATE_START = 0
 SYNC_STATE_NOTEBOOKS_LOCAL = 1
 SYNC_STATE_TAGS_LOCAL = 2
@@ -35,10 +52,23 @@ DEFAULT_INDICATOR_LAYOUT = [
 ]
 
 # EDAM_VERSION = EDAM_VERSION_MAJOR + "." + EDAM_VERSION_MINOR
-SCHEMA_VERSION = 5
-API_VERSION = 6
+# databases since version 5 are upgraded in place, see
+# provider/migrations.py, so path keeps the old version
+SCHEMA_VERSION = 12
+API_VERSION = 8
 VERSION = '2.5'
-DB_PATH = "~/.everpad/everpad.%s.db" % SCHEMA_VERSION
+DB_PATH = "~/.everpad/everpad.5.db"
+DATA_PATH = "~/.everpad/data/"
+GEOCODE_CACHE_PATH = "~/.everpad/geocode.db"
+# sqlite pragmas applied on every connection, each can be
+# overridden with db_<name> setting
+DEFAULT_DB_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 64 * 1024 * 1024),
+    ('cache_size', -16 * 1024),  # negative is size in KiB
+    ('temp_store', 'MEMORY'),
+)
 
 ACTION_NONE = 0
 ACTION_CREATE = 1
@@ -62,6 +92,7 @@ ORDER_TITLE = 0
 ORDER_UPDATED = 1
 ORDER_TITLE_DESC = 2
 ORDER_UPDATED_DESC = 3
+ORDER_RELEVANCE = 4  # best full text matches first
 
 DEFAULT_LIMIT = 100
 NOT_PINNDED = -1
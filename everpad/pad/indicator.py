@@ -3,7 +3,7 @@ sys.path.insert(0, '../..')
 from PySide.QtCore import Slot, QTranslator, QLocale, Signal, QSettings, QT_TRANSLATE_NOOP, QLibraryInfo
 from PySide.QtGui import QApplication, QSystemTrayIcon, QMenu, QCursor
 from PySide.QtNetwork import QNetworkProxyFactory
-from everpad.basetypes import Note, NONE_ID, NONE_VAL, Notebook
+from everpad.basetypes import Note, NoteSummary, NONE_ID, NONE_VAL, Notebook
 from everpad.tools import get_provider, get_pad, print_version, resource_filename
 from everpad.pad.editor import Editor
 from everpad.pad.management import Management
@@ -53,7 +53,7 @@ class Indicator(QSystemTrayIcon):
             self.menu.popup(QCursor().pos())
 
     def _add_note(self, menu, struct):
-        note = Note.from_tuple(struct)
+        note = NoteSummary.from_tuple(struct)
         title = note.title[:40].replace('&', '&&')
         menu.addAction(title, Slot()(
             partial(self.open, note=note)
@@ -83,7 +83,7 @@ class Indicator(QSystemTrayIcon):
             )
             return
         if self.app.provider.is_authenticated():
-            pin_notes = self.app.provider.find_notes(
+            pin_notes = self.app.provider.find_note_summaries(
                 '', dbus.Array([], signature='i'),
                 dbus.Array([], signature='i'), 0,
                 20, Note.ORDER_UPDATED_DESC, 1,
@@ -92,7 +92,7 @@ class Indicator(QSystemTrayIcon):
                 self.app.provider.get_settings_value('sort-by-notebook') or 0))
             has_notes = False
             if not sort_by_notebook:
-                notes = self.app.provider.find_notes(
+                notes = self.app.provider.find_note_summaries(
                     '', dbus.Array([], signature='i'),
                     dbus.Array([], signature='i'), 0,
                     20 - len(pin_notes), Note.ORDER_UPDATED_DESC, 0,
@@ -103,7 +103,7 @@ class Indicator(QSystemTrayIcon):
                 notes = {}
                 for notebook_struct in notebooks:
                     notebook = Notebook.from_tuple(notebook_struct)
-                    _notes = self.app.provider.find_notes('', [notebook.id],
+                    _notes = self.app.provider.find_note_summaries('', [notebook.id],
                          dbus.Array([], signature='i'), 0,
                          20 - len(pin_notes), Note.ORDER_UPDATED_DESC, 0,
                     )
@@ -179,6 +179,8 @@ class Indicator(QSystemTrayIcon):
             editor.hide()
             editor.show()
         else:
+            if isinstance(note, NoteSummary):
+                note = Note.from_tuple(self.app.provider.get_note(note.id))
             editor = Editor(note)
             editor.show()
             self.opened_notes[note.id] = editor
@@ -7,10 +7,10 @@ from PySide.QtGui import (
     QStandardItemModel, QStandardItem,
     QItemSelection, QKeySequence, QShortcut,
 )
-from PySide.QtCore import Slot, Qt, QPoint
+from PySide.QtCore import Slot, Qt, QPoint, QModelIndex
 from everpad.interface.list import Ui_List
 from everpad.pad.tools import get_icon
-from everpad.basetypes import Notebook, Note, Tag, NONE_ID
+from everpad.basetypes import Notebook, Note, NoteSummary, Tag, NONE_ID
 import dbus
 import datetime
 
@@ -65,7 +65,7 @@ class List(QMainWindow):
 
     def _init_notes(self):
         self._current_note = None
-        self.notesModel = QStandardItemModel()
+        self.notesModel = QNotesModel(self.app.provider)
         self.notesModel.setHorizontalHeaderLabels(
             [self.tr('Title'), self.tr('Last Updated')])
 
@@ -134,8 +134,6 @@ class List(QMainWindow):
         self._current_note = index
 
     def notebook_selected(self, index):
-        self.notesModel.setRowCount(0)
-
         item = self.notebooksModel.itemFromIndex(index)
         if hasattr(item, 'notebook'):
             notebook_id = item.notebook.id
@@ -154,14 +152,7 @@ class List(QMainWindow):
                 if(notebook.stack == item.stack):
                     notebook_filter.append(notebook.id)
 
-        notes = self.app.provider.find_notes(
-            '', notebook_filter, dbus.Array([], signature='i'),
-            0, 2 ** 31 - 1, Note.ORDER_TITLE, -1,
-        )  # fails with sys.maxint in 64
-
-        for note_struct in notes:
-            note = Note.from_tuple(note_struct)
-            self.notesModel.appendRow(QNoteItemFactory(note).make_items())
+        self.notesModel.load(notebook_filter, dbus.Array([], signature='i'))
 
         sort_order = self.sort_order
         if sort_order is None:
@@ -173,8 +164,6 @@ class List(QMainWindow):
             self.ui.notesList.sortByColumn(int(logicalIndex), order)
 
     def tag_selected(self, index):
-        self.notesModel.setRowCount(0)
-
         item = self.tagsModel.itemFromIndex(index)
         if hasattr(item, 'tag'):
             tag_id = item.tag.id
@@ -185,13 +174,7 @@ class List(QMainWindow):
         self._current_tag = tag_id
 
         tag_filter = [tag_id] if tag_id > 0 else dbus.Array([], signature='i')
-        notes = self.app.provider.find_notes(
-            '', dbus.Array([], signature='i'), tag_filter,
-            0, 2 ** 31 - 1, Note.ORDER_TITLE, -1,
-        )  # fails with sys.maxint in 64
-        for note_struct in notes:
-            note = Note.from_tuple(note_struct)
-            self.notesModel.appendRow(QNoteItemFactory(note).make_items())
+        self.notesModel.load(dbus.Array([], signature='i'), tag_filter)
 
         sort_order = self.sort_order
         if sort_order is None:
@@ -462,6 +445,62 @@ class QTagItem(QStandardItem):
         self.tag = tag
 
 
+class QNotesModel(QStandardItemModel):
+    """Notes model, loads pages of notes while view scrolls"""
+    PAGE_SIZE = 200
+
+    def __init__(self, provider, *args, **kwargs):
+        QStandardItemModel.__init__(self, *args, **kwargs)
+        self.provider = provider
+        self._filters = None
+        self._order = Note.ORDER_TITLE
+        self._token = ''
+        self._has_more = False
+
+    def load(self, notebooks, tags):
+        """Show notes from notebooks and with tags"""
+        self._filters = (notebooks, tags)
+        self.reload()
+
+    def reload(self):
+        """Drop loaded notes and load first page"""
+        self.setRowCount(0)
+        self._token = ''
+        self._has_more = self._filters is not None
+        self.fetchMore(QModelIndex())
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self._has_more
+
+    def fetchMore(self, parent):
+        if not self.canFetchMore(parent):
+            return
+        notebooks, tags = self._filters
+        summaries, self._token = self.provider.find_note_summaries_page(
+            '', notebooks, tags, 0, self.PAGE_SIZE, self._order, -1,
+            self._token,
+        )
+        self._has_more = bool(self._token)
+        for struct in summaries:
+            note = NoteSummary.from_tuple(struct)
+            self.appendRow(QNoteItemFactory(note).make_items())
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        # only part of notes loaded, so provider sorts them
+        if column == 1:
+            if order == Qt.AscendingOrder:
+                sort_order = Note.ORDER_UPDATED
+            else:
+                sort_order = Note.ORDER_UPDATED_DESC
+        elif order == Qt.AscendingOrder:
+            sort_order = Note.ORDER_TITLE
+        else:
+            sort_order = Note.ORDER_TITLE_DESC
+        if sort_order != self._order:
+            self._order = sort_order
+            self.reload()
+
+
 class QNoteItemFactory(object):
     def __init__(self, note):
         self.note = note
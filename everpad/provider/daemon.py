@@ -97,7 +97,7 @@ class ProviderApp(AppClass):
 
         # get_db_sesson everpad/provider/tools.py
         set_auth_token('')
-        session = get_db_session()
+        session = get_db_session(settings=self.settings)
         
         session.query(models.Note).delete(
             synchronize_session='fetch',
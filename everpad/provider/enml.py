@@ -0,0 +1,323 @@
+from HTMLParser import HTMLParser
+from ..tools import (
+    clean, allowed_href, ALLOWED_TAGS, DISALLOWED_ATTRS,
+)
+import re
+
+
+# ****** Contains:
+#        enml_to_html - note content from ENML received from server
+#        html_to_enml - ENML document to send from note content
+#
+# Content is converted in one pass: HTMLParser events are written to
+# output while parsing, without building a tree. Broken nesting is
+# fixed with the rules of BeautifulSoup 3, which was used before, so
+# output is the same (see tests/provider/test_enml.py), except that
+# <en-media/> and <en-todo/> in received notes don't swallow content
+# following them anymore.
+ENML_DOCTYPE = \
+    '<!DOCTYPE en-note SYSTEM "http://xml.evernote.com/pub/enml2.dtd">'
+
+SELF_CLOSING_TAGS = frozenset((
+    'br', 'hr', 'input', 'img', 'meta', 'spacer', 'link', 'frame',
+    'base', 'col',
+))
+# en-media and en-todo are empty in ENML
+ENML_SELF_CLOSING_TAGS = SELF_CLOSING_TAGS | frozenset((
+    'en-media', 'en-todo',
+))
+PRESERVE_WHITESPACE_TAGS = frozenset(('pre', 'textarea'))
+
+# **************** Nesting Rules ****************
+#
+# From BeautifulSoup 3. Tag not in NESTABLE_TAGS closes open tag of
+# the same name. Nestable tag closes open tag of the same name only
+# when one of its reset triggers isn't between them.
+_NESTABLE_INLINE_TAGS = (
+    'span', 'font', 'q', 'object', 'bdo', 'sub', 'sup', 'center',
+)
+_NESTABLE_BLOCK_TAGS = ('blockquote', 'div', 'fieldset', 'ins', 'del')
+_NESTABLE_LIST_TAGS = {
+    'ol': [], 'ul': [], 'li': ['ul', 'ol'],
+    'dl': [], 'dd': ['dl'], 'dt': ['dl'],
+}
+_NESTABLE_TABLE_TAGS = {
+    'table': [], 'tr': ['table', 'tbody', 'tfoot', 'thead'],
+    'td': ['tr'], 'th': ['tr'],
+    'thead': ['table'], 'tbody': ['table'], 'tfoot': ['table'],
+}
+_NON_NESTABLE_BLOCK_TAGS = ('address', 'form', 'p', 'pre')
+
+NESTABLE_TAGS = dict(
+    [(name, []) for name in _NESTABLE_INLINE_TAGS + _NESTABLE_BLOCK_TAGS]
+    + _NESTABLE_LIST_TAGS.items() + _NESTABLE_TABLE_TAGS.items()
+)
+RESET_NESTING_TAGS = frozenset(
+    _NESTABLE_BLOCK_TAGS + ('noscript',) + _NON_NESTABLE_BLOCK_TAGS
+    + tuple(_NESTABLE_LIST_TAGS) + tuple(_NESTABLE_TABLE_TAGS)
+)
+
+# **************** Escaping ****************
+#
+# Entity references are kept as they are, only bare ampersands and
+# brackets are escaped
+_BARE_AMPERSAND_OR_BRACKET = re.compile(
+    r'([<>]|&(?!#\d+;|#x[0-9a-fA-F]+;|\w+;))',
+)
+_ENTITIES = {'<': '&lt;', '>': '&gt;', '&': '&amp;'}
+# references replaced in attribute values, by sgmllib and then by
+# BeautifulSoup
+_ATTRIBUTE_REF = re.compile(r'&(?:([a-zA-Z][-.a-zA-Z0-9]*)|#([0-9]+))(;?)')
+_ATTRIBUTE_ENTITIES = {
+    'lt': '<', 'gt': '>', 'amp': '&', 'quot': '"', 'apos': "'",
+}
+_ATTRIBUTE_CHARREF = re.compile(r'&#(\d+|x[0-9a-fA-F]+);')
+_WHITESPACE = u'\t\n\x0c\r '
+
+
+def _escape(text):
+    """Escape bare ampersands and brackets"""
+    return _BARE_AMPERSAND_OR_BRACKET.sub(
+        lambda match: _ENTITIES[match.group()[0]], text,
+    )
+
+
+def _attribute_ref(match):
+    """Replace entity or ascii character reference"""
+    name, number, end = match.groups()
+    if number is not None:
+        if int(number) < 128:
+            return unichr(int(number))
+    elif name in _ATTRIBUTE_ENTITIES:
+        return _ATTRIBUTE_ENTITIES[name]
+    return match.group()
+
+
+def _attribute_charref(match):
+    """Replace character reference"""
+    number = match.group(1)
+    try:
+        if number[0] == 'x':
+            return unichr(int(number[1:], 16))
+        return unichr(int(number))
+    except ValueError:
+        return match.group()
+
+
+def _format_attribute(name, value):
+    """Format attribute of start tag"""
+    if value is None:
+        value = name
+    if '"' in value and "'" not in value:
+        return u" %s='%s'" % (name, _escape(value))
+    return u' %s="%s"' % (name, _escape(value).replace('"', '&quot;'))
+
+
+def _collapse(text, preserve):
+    """Collapse whitespace only text, like BeautifulSoup"""
+    if preserve or text.strip(_WHITESPACE):
+        return text
+    if '\n' in text:
+        return u'\n'
+    return u' '
+
+
+# *************************************************
+# ****************    Converter    ****************
+# *************************************************
+class _Converter(HTMLParser):
+    """Parse content and write it back with fixed nesting.
+
+    With root only content of first root tag is written, with sanitize
+    not allowed tags are skipped keeping their content."""
+
+    def __init__(self, self_closing_tags, root=None, sanitize=False):
+        HTMLParser.__init__(self)
+        self._self_closing_tags = self_closing_tags
+        self._root = root
+        self._sanitize = sanitize
+        # open tags as (name, written) pairs
+        self._stack = []
+        self._preserve = 0
+        # depth of root tag in stack
+        self._root_depth = None
+        self.found = not root
+        self._writing = not root
+        self._data = []
+        self._pieces = []
+        self._result = []
+
+    def convert(self, content):
+        """Get converted content"""
+        self.feed(content)
+        self.close()
+        if self.rawdata:
+            self.handle_data(self.rawdata)
+            self.rawdata = ''
+        self._end_data()
+        self._pop(0)
+        return u''.join(self._result)
+
+    def error(self, message):
+        # broken markup left as text
+        pass
+
+    def unescape(self, value):
+        return _ATTRIBUTE_CHARREF.sub(
+            _attribute_charref, _ATTRIBUTE_REF.sub(_attribute_ref, value),
+        )
+
+    def _write(self, data):
+        if self._writing:
+            self._result.append(data)
+
+    # **************** Text ****************
+    #
+    # Text between written tags is one text node. Skipped tags split
+    # it too, as sanitized content was parsed twice before.
+    def _end_piece(self):
+        """Finish text between skipped tags"""
+        if self._data:
+            self._pieces.append(_collapse(
+                u''.join(self._data), self._preserve,
+            ))
+            self._data = []
+
+    def _end_data(self):
+        """Write text"""
+        self._end_piece()
+        if len(self._pieces) == 1:
+            self._write(_escape(self._pieces[0]))
+        elif self._pieces:
+            self._write(_escape(_collapse(
+                u''.join(self._pieces), self._preserve,
+            )))
+        self._pieces = []
+
+    def handle_data(self, data):
+        self._data.append(data)
+
+    def handle_entityref(self, name):
+        self._data.append(u'&%s;' % name)
+
+    def handle_charref(self, name):
+        self._data.append(u'&#%s;' % name)
+
+    def _handle_markup(self, markup, data):
+        self._end_data()
+        self._write(markup % _escape(data))
+
+    def handle_comment(self, data):
+        self._handle_markup(u'<!--%s-->', data)
+
+    def handle_decl(self, data):
+        self._handle_markup(u'<!%s>', data)
+
+    def handle_pi(self, data):
+        self._handle_markup(u'<?%s>', data)
+
+    def unknown_decl(self, data):
+        if data.startswith('CDATA['):
+            self._handle_markup(u'<![CDATA[%s]]>', data[6:])
+
+    # **************** Tags ****************
+    #
+    def _shown(self, name, attrs):
+        """Check tag is written, remove not allowed attributes"""
+        if not self._sanitize:
+            return True, attrs
+        if name not in ALLOWED_TAGS:
+            self._end_piece()
+            return False, attrs
+        return True, [
+            (attr, value) for attr, value in attrs
+            if attr not in DISALLOWED_ATTRS
+            and not (attr == 'href' and not allowed_href(value or ''))
+        ]
+
+    def _write_tag(self, name, attrs, close):
+        self._end_data()
+        self._write(u'<%s%s%s>' % (name, u''.join(
+            _format_attribute(attr, value) for attr, value in attrs
+        ), close))
+
+    def handle_starttag(self, name, attrs):
+        shown, attrs = self._shown(name, attrs)
+        if name in self._self_closing_tags:
+            if shown:
+                self._write_tag(name, attrs, u' /')
+            return
+        self._smart_pop(name)
+        if shown:
+            self._write_tag(name, attrs, u'')
+        self._stack.append((name, shown))
+        if name in PRESERVE_WHITESPACE_TAGS:
+            self._preserve += 1
+        if name == self._root and not self.found:
+            self.found = self._writing = True
+            self._root_depth = len(self._stack)
+
+    def handle_startendtag(self, name, attrs):
+        self.handle_starttag(name, attrs)
+        if name not in self._self_closing_tags:
+            self.handle_endtag(name)
+
+    def handle_endtag(self, name):
+        for position in range(len(self._stack) - 1, -1, -1):
+            if self._stack[position][0] == name:
+                self._pop(position)
+                return
+
+    def _pop(self, position):
+        """Close open tags from position"""
+        if position >= len(self._stack):
+            return
+        self._end_piece()
+        while len(self._stack) > position:
+            if self._stack[-1][1]:
+                self._end_data()
+            if len(self._stack) == self._root_depth:
+                # root content is finished
+                self._writing = False
+            name, shown = self._stack.pop()
+            if shown:
+                self._write(u'</%s>' % name)
+            if name in PRESERVE_WHITESPACE_TAGS:
+                self._preserve -= 1
+
+    def _smart_pop(self, name):
+        """Close tags which can't contain tag, see nesting rules"""
+        triggers = NESTABLE_TAGS.get(name)
+        reset = name in RESET_NESTING_TAGS
+        for position in range(len(self._stack) - 1, -1, -1):
+            parent = self._stack[position][0]
+            if triggers is None and parent == name:
+                self._pop(position)
+                return
+            if triggers is not None and parent in triggers or (
+                triggers is None and reset
+                and parent in RESET_NESTING_TAGS
+            ):
+                self._pop(position + 1)
+                return
+
+
+def enml_to_html(content):
+    """Get content of en-note from ENML"""
+    if isinstance(content, str):
+        content = content.decode('utf8')
+    converter = _Converter(SELF_CLOSING_TAGS, root='en-note')
+    result = converter.convert(content)
+    if not converter.found:
+        raise ValueError('No en-note in content')
+    return result
+
+
+def html_to_enml(html):
+    """Get sanitized ENML document from content, utf8 encoded"""
+    if isinstance(html, str):
+        html = html.decode('utf8')
+    content = _Converter(ENML_SELF_CLOSING_TAGS, sanitize=True).convert(html)
+    return (u'%s\n<en-note>%s</en-note>' % (
+        ENML_DOCTYPE, clean(content),
+    )).encode('utf8')
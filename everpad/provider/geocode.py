@@ -0,0 +1,159 @@
+from collections import deque
+from Queue import Queue
+import json
+import os
+import socket
+import sqlite3
+import threading
+import urllib2
+
+
+# ****** Contains:
+#        Geocoder - background reverse geocoding of note coordinates
+#        google_resolver - place name from google geocode api
+#
+# Notes with coordinates but without place get place name from
+# geocoding. It's done in a worker thread, every sync submits such notes
+# and takes resolved names on next run, so it never waits for network.
+# Names are cached on disk by coordinates rounded to CACHE_PRECISION
+# digits (~100 m), coordinates without name are cached too.
+GOOGLE_GEOCODE_URL = 'http://maps.googleapis.com/maps/api/geocode/json'\
+    '?latlng=%.4f,%.4f&sensor=false'
+CACHE_PRECISION = 3
+
+
+def google_resolver(latitude, longitude, timeout):
+    """Get formatted address of coordinates or None"""
+    data = json.loads(urllib2.urlopen(
+        GOOGLE_GEOCODE_URL % (latitude, longitude), timeout=timeout,
+    ).read())
+    try:
+        return data['results'][0]['formatted_address']
+    except (IndexError, KeyError):
+        return None
+
+
+class GeocodeCache(object):
+    """Place names by rounded coordinates in sqlite file.
+
+    Used only from geocoder worker thread."""
+
+    def __init__(self, path):
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS places '
+            '(latitude REAL, longitude REAL, name TEXT, '
+            'PRIMARY KEY (latitude, longitude))'
+        )
+
+    def _key(self, latitude, longitude):
+        return (
+            round(latitude, CACHE_PRECISION),
+            round(longitude, CACHE_PRECISION),
+        )
+
+    def get(self, latitude, longitude):
+        """Get (found, name)"""
+        row = self._connection.execute(
+            'SELECT name FROM places WHERE latitude = ? AND longitude = ?',
+            self._key(latitude, longitude),
+        ).fetchone()
+        if row is None:
+            return False, None
+        return True, row[0]
+
+    def set(self, latitude, longitude, name):
+        """Cache name, None when coordinates have no name"""
+        self._connection.execute(
+            'INSERT OR REPLACE INTO places VALUES (?, ?, ?)',
+            self._key(latitude, longitude) + (name,),
+        )
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+
+# *************************************************
+# ****************    Geocoder     ****************
+# *************************************************
+class Geocoder(object):
+    """Queue of notes to geocode with single worker"""
+
+    def __init__(self, cache_path, timeout, log, resolver=google_resolver):
+        self.cache_path = cache_path
+        self.timeout = timeout
+        self.resolver = resolver
+        self._log = log
+        self._queue = Queue()
+        self._results = deque()
+        self._pending = set()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def submit(self, guid, latitude, longitude):
+        """Schedule geocoding of note, not already scheduled one"""
+        with self._lock:
+            if guid in self._pending:
+                return
+            self._pending.add(guid)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._work)
+                self._worker.daemon = True
+                self._worker.start()
+        self._queue.put((guid, latitude, longitude))
+
+    def results(self):
+        """Take resolved (note guid, place name) pairs"""
+        results = []
+        while self._results:
+            results.append(self._results.popleft())
+        return results
+
+    def join(self):
+        """Wait for submitted notes"""
+        self._queue.join()
+
+    def close(self):
+        """Stop worker"""
+        with self._lock:
+            if self._worker is not None:
+                self._queue.put(None)
+                self._worker = None
+
+    def _work(self):
+        """Worker loop"""
+        cache_dir = os.path.dirname(self.cache_path)
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        cache = GeocodeCache(self.cache_path)
+        try:
+            while True:
+                item = self._queue.get()
+                try:
+                    if item is None:
+                        return
+                    name = self._resolve(cache, *item[1:])
+                    if name:
+                        self._results.append((item[0], name))
+                finally:
+                    if item is not None:
+                        with self._lock:
+                            self._pending.discard(item[0])
+                    self._queue.task_done()
+        finally:
+            cache.close()
+
+    def _resolve(self, cache, latitude, longitude):
+        """Get name from cache or resolver"""
+        found, name = cache.get(latitude, longitude)
+        if found:
+            return name
+        try:
+            name = self.resolver(latitude, longitude, self.timeout)
+        except (socket.error, urllib2.URLError, ValueError) as e:
+            # not cached, tried again for next note there
+            self._log('Geocoding failed: %s' % e)
+            return None
+        cache.set(latitude, longitude, name)
+        return name
@@ -0,0 +1,94 @@
+from .models import Base
+from .. import const
+from . import search
+
+
+# ****** Contains:
+#        migrate - upgrade existing database to const.SCHEMA_VERSION
+#
+# Schema version is stored in sqlite user_version. Databases created
+# before migrations have user_version 0 and schema version 5, new
+# databases go through all steps too.
+LEGACY_SCHEMA_VERSION = 5
+
+
+# **************** Migrate ****************
+#
+# New tables are created by create_all, steps change existing ones.
+# Steps must be safe to run again, pysqlite commits before every DDL
+# statement so failed migration can be partially applied.
+def migrate(engine):
+    """Create or upgrade database schema"""
+    connection = engine.connect()
+    try:
+        version = connection.execute('PRAGMA user_version').scalar()
+        if not version:
+            version = LEGACY_SCHEMA_VERSION
+
+        Base.metadata.create_all(connection)
+
+        for step_version, step in STEPS:
+            if version < step_version:
+                step(connection)
+
+        connection.execute('PRAGMA user_version = %d' % const.SCHEMA_VERSION)
+    finally:
+        connection.close()
+
+
+# Indexes of columns not added yet are skipped, the step adding the
+# columns creates them, so models can index new columns.
+def _create_missing_indexes(connection):
+    """Create indexes declared in models but not in database"""
+    exists = set(name for name, in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index'",
+    ))
+    for table in Base.metadata.sorted_tables:
+        columns = _get_columns(connection, table)
+        for index in table.indexes:
+            if index.name not in exists and all(
+                column.name in columns for column in index.columns
+            ):
+                index.create(connection)
+
+
+def _get_columns(connection, table):
+    """Get names of table columns in database"""
+    return set(row[1] for row in connection.execute(
+        'PRAGMA table_info(%s)' % table.name,
+    ))
+
+
+def _add_missing_columns(connection):
+    """Add columns declared in models but not in database"""
+    for table in Base.metadata.sorted_tables:
+        exists = _get_columns(connection, table)
+        for column in table.columns:
+            if column.name not in exists:
+                connection.execute('ALTER TABLE %s ADD COLUMN %s %s' % (
+                    table.name, column.name,
+                    column.type.compile(dialect=connection.dialect),
+                ))
+
+
+def _add_sync_generation(connection):
+    """Add generation of full pull to notes, notebooks and tags"""
+    _add_missing_columns(connection)
+    for table in ('notes', 'notebooks', 'tags'):
+        connection.execute(
+            'UPDATE %s SET sync_generation = 0 '
+            'WHERE sync_generation IS NULL' % table,
+        )
+    _create_missing_indexes(connection)
+
+
+# (version, step) pairs, step upgrades schema from version - 1
+STEPS = (
+    (6, _create_missing_indexes),
+    (7, search.create_index),
+    (8, _add_missing_columns),
+    (9, _add_sync_generation),
+    (10, _add_missing_columns),
+    (11, _add_missing_columns),
+    (12, _add_missing_columns),
+)
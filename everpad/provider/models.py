@@ -1,19 +1,17 @@
-try:
-    from BeautifulSoup import BeautifulSoup
-except:
-    from bs4 import BeautifulSoup
-from sqlalchemy import Table, Column, Integer, ForeignKey, String, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy import (
+    Table, Column, Integer, ForeignKey, String, Boolean, Index, Float,
+)
+from sqlalchemy.orm import relationship, object_session
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm.exc import NoResultFound
 from ..tools import prepare_file_path
 from .. import const
+from .enml import enml_to_html
+from contextlib import contextmanager
 import binascii
 import os
-import urllib
-import json
+import threading
 import dbus
-import socket
 
 
 # The declarative_base() callable returns a new base class from 
@@ -22,13 +20,64 @@ import socket
 # http://docs.sqlalchemy.org/en/rel_0_9/orm/extensions/declarative.html
 Base = declarative_base()
 
+
+# **************** Unit of Work ****************
+#
+# *_dbus properties used by DbusSendable.from_obj and give_to_obj
+# query session of object. Fresh object isn't in session yet, it uses
+# session of current unit of work: service request or sync batch,
+# each thread has own. Conflict items of listed notes are loaded for
+# unit of work at once, see load_conflict_items.
+_unit = threading.local()
+# ids in one IN clause, sqlite limits query variables to 999
+CONFLICT_ITEMS_CHUNK = 500
+
+
+@contextmanager
+def unit_of_work(session):
+    """Set session for objects not in session yet"""
+    previous = (
+        getattr(_unit, 'session', None),
+        getattr(_unit, 'conflict_items', None),
+    )
+    _unit.session = session
+    _unit.conflict_items = {}
+    try:
+        yield session
+    finally:
+        _unit.session, _unit.conflict_items = previous
+
+
+def load_conflict_items(session, notes):
+    """Load conflict items of notes for current unit of work"""
+    ids = [note.id for note in notes]
+    items = dict((note_id, []) for note_id in ids)
+    for start in range(0, len(ids), CONFLICT_ITEMS_CHUNK):
+        for parent_id, note_id in session.query(
+            Note.conflict_parent_id, Note.id,
+        ).filter(Note.conflict_parent_id.in_(
+            ids[start:start + CONFLICT_ITEMS_CHUNK],
+        )).order_by(Note.id):
+            items[parent_id].append(note_id)
+    if getattr(_unit, 'conflict_items', None) is not None:
+        _unit.conflict_items.update(items)
+    return notes
+
+
+def get_session(obj):
+    """Get session of object or current unit of work"""
+    session = object_session(obj) or getattr(_unit, 'session', None)
+    if session is None:
+        raise RuntimeError('No unit of work for %r' % obj)
+    return session
+
 # engine = create_engine('sqlite:///%s' % db_path)
 # in tools.py
 
 notetags_table = Table(
     'notetags', Base.metadata,
-    Column('note', Integer, ForeignKey('notes.id')),
-    Column('tag', Integer, ForeignKey('tags.id'))
+    Column('note', Integer, ForeignKey('notes.id'), index=True),
+    Column('tag', Integer, ForeignKey('tags.id'), index=True)
 )
 
 
@@ -36,17 +85,24 @@ notetags_table = Table(
 # Note ORM class to save note specific data to the database
 class Note(Base):
     __tablename__ = 'notes'
+    # composite indexes match NoteFilterer access paths, action and
+    # notebook_id lookups use them as prefix
+    __table_args__ = (
+        Index('ix_notes_action_updated', 'action', 'updated'),
+        Index('ix_notes_notebook_id_action', 'notebook_id', 'action'),
+    )
     id = Column(Integer, primary_key=True)
-    guid = Column(String)
+    guid = Column(String, index=True)
     title = Column(String)
     content = Column(String)
     
-    # MKG added for playing
-    contentHash = Column(String)   
+    # server content hash (hex) and length, content is received
+    # again only when hash changed
+    contentHash = Column(String)
     contentLength = Column(Integer)
     
     created = Column(Integer)
-    updated = Column(Integer)
+    updated = Column(Integer, index=True)
     
     
     #deleted
@@ -64,10 +120,15 @@ class Note(Base):
     resources = relationship("Resource")
     place_id = Column(Integer, ForeignKey('places.id'))
     place = relationship("Place", backref='note')
+    # notes without place are geocoded by them, see sync/agent.py
+    latitude = Column(Float)
+    longitude = Column(Float)
     action = Column(Integer)
+    # full pull which received the note, see sync/base.py
+    sync_generation = Column(Integer, default=0, index=True)
     conflict_parent = relationship("Note", post_update=False)
     conflict_parent_id = Column(
-        Integer, ForeignKey('notes.id'), nullable=True,
+        Integer, ForeignKey('notes.id'), nullable=True, index=True,
     )
 
     # sharing data:
@@ -76,6 +137,10 @@ class Note(Base):
     share_url = Column(String)
 
 
+    @property
+    def session(self):
+        return get_session(self)
+
     # not real good with @property in python
     # following are getters/setters
 
@@ -87,18 +152,22 @@ class Note(Base):
 
     @tags_dbus.setter
     def tags_dbus(self, val):
+        names = [tag for tag in val if tag and tag != ' ']  # for blank array and other
+        # existing tags in one query
+        exists = {}
+        if names:
+            exists = dict((tag.name, tag) for tag in self.session.query(
+                Tag,
+            ).filter(
+                Tag.name.in_(names)
+                & (Tag.action != const.ACTION_DELETE)
+            ))
         tags = []
-        for tag in val:
-            if tag and tag != ' ':  # for blank array and other
-                try:
-                    tags.append(self.session.query(Tag).filter(
-                        (Tag.name == tag)
-                        & (Tag.action != const.ACTION_DELETE)
-                    ).one())
-                except NoResultFound:
-                    tg = Tag(name=tag, action=const.ACTION_CREATE)
-                    self.session.add(tg)
-                    tags.append(tg)
+        for name in names:
+            if name not in exists:
+                exists[name] = Tag(name=name, action=const.ACTION_CREATE)
+                self.session.add(exists[name])
+            tags.append(exists[name])
         self.tags = tags
 
     # -- get/set note's notebook id
@@ -148,12 +217,17 @@ class Note(Base):
     # -- get/set note's conflict item???
     @property
     def conflict_items_dbus(self):
-        return map(
-            lambda item: item.id,
-            self.session.query(Note).filter(
-                Note.conflict_parent_id == self.id,
-            ).all(),
-        ) or dbus.Array([], signature='i')
+        loaded = getattr(_unit, 'conflict_items', None) or {}
+        if self.id in loaded:
+            items = list(loaded[self.id])
+        else:
+            items = map(
+                lambda item: item.id,
+                self.session.query(Note).filter(
+                    Note.conflict_parent_id == self.id,
+                ).all(),
+            )
+        return items or dbus.Array([], signature='i')
 
     @conflict_items_dbus.setter
     def conflict_items_dbus(self, val):
@@ -178,35 +252,35 @@ class Note(Base):
         pass
     
     # stuff the database with the note values
-    # passed note and database session
-    def from_api(self, note, session):
+    # passed note and database session, notebooks, tags and places
+    # are looked up in identities when pull has them cached
+    def from_api(self, note, session, identities=None):
         """Fill data from api"""
+        if identities is None:
+            identities = IdentityCache(session)
         
-        # handle note content 
-        soup = BeautifulSoup(note.content.decode('utf8'))
-        content = reduce(
-            lambda txt, cur: txt + unicode(cur),
-            soup.find('en-note').contents, u'',
-        )
-        
+        # handle note content, note received without content
+        # has the same content as local one
+        if note.content is not None:
+            self.content = enml_to_html(note.content)
+        if note.contentHash is not None:
+            self.contentHash = binascii.b2a_hex(note.contentHash)
+        if note.contentLength is not None:
+            self.contentLength = note.contentLength
+
         # record stuffing ...
         self.title = note.title.decode('utf8')
-        self.content = content
         self.created = note.created
         self.updated = note.updated
         self.action = const.ACTION_NONE
         
         # shouldn't there always be a notebook guid????
         if note.notebookGuid:
-            self.notebook = session.query(Notebook).filter(
-                Notebook.guid == note.notebookGuid,
-            ).one()
+            self.notebook = identities.notebook(note.notebookGuid)
             
         # note tags    
         if note.tagGuids:
-            self.tags = session.query(Tag).filter(
-                Tag.guid.in_(note.tagGuids),
-            ).all()
+            self.tags = identities.tags(note.tagGuids)
         
         # handle places ....
         #
@@ -217,39 +291,18 @@ class Note(Base):
         # NOT automatically add place name values based on geolocation without confirmation from the 
         # user; that is, the value in this field should be more useful than a simple automated lookup 
         # based on the note's latitude and longitude. 
-        place_name = None
-        if getattr(note, 'attributes'):
-            if note.attributes.placeName:
-                place_name = note.attributes.placeName.decode('utf8')
-            elif note.attributes.longitude:
-                try:
-                    data = json.loads(urllib.urlopen(
-                        'http://maps.googleapis.com/maps/api/geocode/json?latlng=%.4f,%.4f&sensor=false' % (
-                            note.attributes.latitude,
-                            note.attributes.longitude,
-                        ),
-                    ).read())
-                    try:
-                        place_name = data['results'][0]['formatted_address']
-                    except (IndexError, KeyError):
-                        pass
-                except socket.error:
-                    pass
-        if place_name:
-            self.set_place(place_name, session)
+        # Coordinates without name are geocoded in background, see
+        # geocode.py
+        if getattr(note, 'attributes') and note.attributes.placeName:
+            self.place = identities.place(
+                note.attributes.placeName.decode('utf8'),
+            )
         
         # end of stuffin :)
         
     # just a local to set places
     def set_place(self, name, session):
-        try:
-            place = session.query(Place).filter(
-                Place.name == name,
-            ).one()
-        except NoResultFound:
-            place = Place(name=name)
-            session.add(place)
-        self.place = place
+        self.place = IdentityCache(session).place(name)
 
 
 # *************************************************************
@@ -264,6 +317,7 @@ class Notebook(Base):
     service_created = Column(Integer)
     service_updated = Column(Integer)
     action = Column(Integer)
+    sync_generation = Column(Integer, default=0, index=True)
     stack = Column(String)
 
     def from_api(self, notebook):
@@ -294,10 +348,11 @@ class Notebook(Base):
 class Tag(Base):
     __tablename__ = 'tags'
     id = Column(Integer, primary_key=True)
-    guid = Column(String)
-    name = Column(String)
+    guid = Column(String, index=True)
+    name = Column(String, index=True)
     parentGuid = Column(String)
     action = Column(Integer)
+    sync_generation = Column(Integer, default=0, index=True)
 
     def from_api(self, tag):
         """Fill data from api"""
@@ -312,10 +367,10 @@ class Tag(Base):
 class Resource(Base):
     __tablename__ = 'resources'
     id = Column(Integer, primary_key=True)
-    note_id = Column(Integer, ForeignKey('notes.id'))
+    note_id = Column(Integer, ForeignKey('notes.id'), index=True)
     file_name = Column(String)
     file_path = Column(String)
-    guid = Column(String)
+    guid = Column(String, index=True)
     hash = Column(String)
     mime = Column(String)
     action = Column(Integer)
@@ -356,6 +411,86 @@ class Place(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String)
 
+# *************************************************************
+# Notebooks and tags by guid, places by name, filled at start of pull
+# with one query per table, so notes are filled without queries.
+# Items created during pull are cached on first lookup, objects
+# removed from session (rolled back, deleted) are looked up again.
+class IdentityCache(object):
+    """Notebooks, tags and places of session"""
+
+    def __init__(self, session):
+        self.session = session
+        self._notebooks = {}
+        self._tags = {}
+        self._places = {}
+
+    def load(self):
+        """Load all notebooks, tags and places"""
+        self._notebooks = dict(
+            (notebook.guid, notebook)
+            for notebook in self.session.query(Notebook)
+        )
+        self._tags = dict(
+            (tag.guid, tag) for tag in self.session.query(Tag)
+        )
+        self._places = dict(
+            (place.name, place) for place in self.session.query(Place)
+        )
+
+    def _get(self, cache, key):
+        """Get cached item still in session"""
+        item = cache.get(key)
+        if item is None or object_session(item) is not self.session\
+                or item in self.session.deleted:
+            return None
+        return item
+
+    def notebook(self, guid):
+        """Get notebook by guid"""
+        notebook = self._get(self._notebooks, guid)
+        if notebook is None:
+            notebook = self.session.query(Notebook).filter(
+                Notebook.guid == guid,
+            ).one()
+            self._notebooks[guid] = notebook
+        return notebook
+
+    def tags(self, guids):
+        """Get existing tags by guids"""
+        tags = {}
+        missing = []
+        for guid in guids:
+            tag = self._get(self._tags, guid)
+            if tag is None:
+                missing.append(guid)
+            else:
+                tags[guid] = tag
+        if missing:
+            for tag in self.session.query(Tag).filter(Tag.guid.in_(missing)):
+                tags[tag.guid] = self._tags[tag.guid] = tag
+        result = []
+        for guid in guids:
+            tag = tags.pop(guid, None)
+            if tag is not None:
+                result.append(tag)
+        return result
+
+    def place(self, name):
+        """Get place by name, create new one"""
+        place = self._get(self._places, name)
+        if place is None:
+            try:
+                place = self.session.query(Place).filter(
+                    Place.name == name,
+                ).one()
+            except NoResultFound:
+                place = Place(name=name)
+                self.session.add(place)
+            self._places[name] = place
+        return place
+
+
 # *************************************************************
 # Notebook ORM class to save sync specific data to the database
 class Sync(Base):
@@ -369,6 +504,12 @@ class Sync(Base):
     rate_limit = Column(Integer)
     rate_limit_time = Column(Integer)
     connect_error_count = Column(Integer)
+    # progress of interrupted sync, see sync/base.py Checkpoint
+    checkpoint_phase = Column(Integer)
+    checkpoint_usn = Column(Integer)
+    checkpoint_offset = Column(Integer)
+    checkpoint_updated = Column(Integer)
+    checkpoint_generation = Column(Integer)
  
 # *************************************************************
 # Me playing - future
@@ -0,0 +1,260 @@
+from sqlalchemy import event, text, literal_column, select, bindparam
+from sqlalchemy.sql import table, column
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import attributes
+from HTMLParser import HTMLParser
+from array import array
+from . import models
+import re
+
+
+# ****** Contains:
+#        full text index of notes used by NoteFilterer.by_words
+#
+# notes_fts virtual table has rowid equal to note id and plain text of
+# title, content, tag and notebook names. FTS5 is used when sqlite has
+# it, FTS4 otherwise, without both search falls back to LIKE.
+# unicode61 tokenizer folds case of all unicode letters.
+FTS_TABLE = 'notes_fts'
+FTS_COLUMNS = 'title, content, tags, notebook'
+FTS_MODULES = (
+    ('fts5', "tokenize = 'unicode61 remove_diacritics 2'"),
+    ('fts4', 'tokenize=unicode61'),
+)
+SNIPPET_LENGTH = 200
+# sqlite function ranking fts4 matches, registered by get_db_engine
+RANK_FUNCTION = 'fts_rank'
+# sync marks every pulled object, it's not in index
+NOT_INDEXED = frozenset(['sync_generation'])
+
+# for joins with notes, content column is plain text
+index_table = table(FTS_TABLE, column('rowid'), column('content'))
+
+_tags_re = re.compile(r'<[^>]*>')
+_spaces_re = re.compile(r'\s+', re.UNICODE)
+_word_re = re.compile(r'\w+', re.UNICODE)
+_html_parser = HTMLParser()
+
+
+# **************** Create Index ****************
+#
+# Called from migrations, creates and fills table once
+def create_index(connection):
+    """Create full text index if sqlite supports it"""
+    if get_fts_version(connection):
+        return
+
+    for module, tokenizer in FTS_MODULES:
+        try:
+            connection.execute('CREATE VIRTUAL TABLE %s USING %s(%s, %s)' % (
+                FTS_TABLE, module, FTS_COLUMNS, tokenizer,
+            ))
+            break
+        except OperationalError:
+            continue
+    else:
+        return
+
+    index_notes(connection, [
+        note_id for note_id, in connection.execute(
+            select([models.Note.id]),
+        )
+    ])
+
+
+def get_fts_version(connection):
+    """Get fts module of index table, None when not exists"""
+    sql = connection.execute(
+        "SELECT sql FROM sqlite_master WHERE name = '%s'" % FTS_TABLE,
+    ).scalar()
+    if not sql:
+        return None
+    return 'fts5' if 'fts5' in sql.lower() else 'fts4'
+
+
+# **************** Index Notes ****************
+#
+# Index rows are replaced, not updated, it works same in fts4 and fts5
+def index_notes(connection, ids):
+    """Put notes to full text index"""
+    ids = list(set(ids))
+    for offset in range(0, len(ids), 500):
+        chunk = ids[offset:offset + 500]
+        remove_notes(connection, chunk)
+
+        notes = connection.execute(select([
+            models.Note.id, models.Note.title, models.Note.content,
+            models.Notebook.name,
+        ], from_obj=models.Note.__table__.outerjoin(
+            models.Notebook.__table__,
+            models.Note.notebook_id == models.Notebook.id,
+        )).where(models.Note.id.in_(chunk))).fetchall()
+
+        tags = {}
+        for note_id, name in connection.execute(select([
+            models.notetags_table.c.note, models.Tag.name,
+        ]).where(
+            (models.notetags_table.c.tag == models.Tag.id)
+            & models.notetags_table.c.note.in_(chunk)
+        )):
+            tags.setdefault(note_id, []).append(name or '')
+
+        if notes:
+            connection.execute(
+                'INSERT INTO %s (rowid, %s) VALUES (?, ?, ?, ?, ?)' % (
+                    FTS_TABLE, FTS_COLUMNS,
+                ), [(
+                    note_id, title or '', get_plain_text(content),
+                    ' '.join(tags.get(note_id, [])), notebook or '',
+                ) for note_id, title, content, notebook in notes],
+            )
+
+
+def remove_notes(connection, ids):
+    """Remove notes from full text index"""
+    if ids:
+        connection.execute('DELETE FROM %s WHERE rowid IN (%s)' % (
+            FTS_TABLE, ', '.join('%d' % note_id for note_id in ids),
+        ))
+
+
+def get_plain_text(html):
+    """Get text from note html"""
+    if not html:
+        return u''
+    return _spaces_re.sub(u' ', _html_parser.unescape(
+        _tags_re.sub(u' ', html),
+    )).strip()
+
+
+# **************** Search ****************
+#
+# Every word is a prefix, all of them should be in note. fts4 treats
+# quoted word as exact token, so there words aren't quoted, they have
+# no punctuation and are lower case, so they can't be OR operator.
+def get_match_query(words, fts_version):
+    """Create MATCH query from user input"""
+    words = _word_re.findall(words)
+    if fts_version == 'fts5':
+        return u' '.join(u'"%s"*' % word for word in words)
+    return u' '.join(u'%s*' % word.lower() for word in words)
+
+
+def get_matches(match, fts_version):
+    """Get selectable with id and rank of matched notes"""
+    # ascending is best first, bm25 in fts5, share of hits in fts4
+    if fts_version == 'fts5':
+        rank = literal_column('rank')
+    else:
+        rank = literal_column("%s(matchinfo(%s, 'pcx'))" % (
+            RANK_FUNCTION, FTS_TABLE,
+        ))
+    return select([
+        literal_column('rowid').label('id'), rank.label('rank'),
+    ], from_obj=text(FTS_TABLE)).where(text(
+        '%s MATCH :match' % FTS_TABLE,
+        bindparams=[bindparam('match', match)],
+    )).alias('matches')
+
+
+def get_rank(matchinfo):
+    """Rank fts4 match by matchinfo 'pcx', negative like bm25"""
+    info = array('I', str(matchinfo))
+    phrases, columns = info[0], info[1]
+    rank = 0.0
+    # hits in row and in all rows for each phrase and column
+    for offset in range(2, 2 + phrases * columns * 3, 3):
+        if info[offset]:
+            rank -= float(info[offset]) / info[offset + 1]
+    return rank
+
+
+# **************** Keep Index Actual ****************
+#
+# Changes of notes, tags and notebooks are indexed after every flush,
+# bulk deletes of notes remove orphan index rows, of tags and notebooks
+# reindex notes left with links to removed ones. Objects changed only in
+# not indexed attributes are skipped, full sync touches all of them.
+def watch(session_cls):
+    """Keep index in sync with session changes"""
+    event.listen(session_cls, 'after_flush', _after_flush)
+    event.listen(session_cls, 'after_bulk_delete', _after_bulk_delete)
+
+
+def _after_flush(session, flush_context):
+    connection = session.connection()
+    if not get_fts_version(connection):
+        return
+
+    changed = set()
+    removed = set()
+    for obj in list(session.new) + filter(
+        _is_indexed_changed, session.dirty,
+    ):
+        if isinstance(obj, models.Note):
+            changed.add(obj.id)
+        elif isinstance(obj, models.Tag) and obj.id:
+            changed.update(note_id for note_id, in connection.execute(
+                select([models.notetags_table.c.note]).where(
+                    models.notetags_table.c.tag == obj.id,
+                ),
+            ))
+        elif isinstance(obj, models.Notebook) and obj.id:
+            changed.update(note_id for note_id, in connection.execute(
+                select([models.Note.id]).where(
+                    models.Note.notebook_id == obj.id,
+                ),
+            ))
+    for obj in session.deleted:
+        if isinstance(obj, models.Note):
+            removed.add(obj.id)
+
+    remove_notes(connection, list(removed - changed))
+    index_notes(connection, changed - removed)
+
+
+def _is_indexed_changed(obj):
+    """Check object has changes of indexed attributes"""
+    state = attributes.instance_state(obj)
+    return any(
+        attributes.get_history(
+            obj, key, passive=attributes.PASSIVE_NO_INITIALIZE,
+        ).has_changes()
+        for key in state.committed_state if key not in NOT_INDEXED
+    )
+
+
+def _after_bulk_delete(session, query, query_context, result):
+    removed = query.column_descriptions[0]['type']
+    if removed not in (models.Note, models.Tag, models.Notebook):
+        return
+    connection = session.connection()
+    if not get_fts_version(connection):
+        return
+
+    if removed is models.Note:
+        connection.execute(
+            'DELETE FROM %s WHERE rowid NOT IN (SELECT id FROM notes)'
+            % FTS_TABLE,
+        )
+    elif removed is models.Tag:
+        index_notes(connection, [
+            note_id for note_id, in connection.execute(
+                select([models.notetags_table.c.note]).where(
+                    ~models.notetags_table.c.tag.in_(
+                        select([models.Tag.id]),
+                    ),
+                ),
+            )
+        ])
+    else:
+        index_notes(connection, [
+            note_id for note_id, in connection.execute(
+                select([models.Note.id]).where(
+                    (models.Note.notebook_id != None)
+                    & ~models.Note.notebook_id.in_(
+                        select([models.Notebook.id]),
+                    ),
+                ),
+            )
+        ])
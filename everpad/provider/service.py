@@ -1,27 +1,64 @@
-from PySide.QtCore import Signal, QObject
-from sqlalchemy import or_, and_, func
+from PySide.QtCore import Signal, Slot, QObject
+from sqlalchemy import or_, and_, func, select, literal
+from sqlalchemy.orm import joinedload, subqueryload
 from sqlalchemy.orm.exc import NoResultFound
 from dbus.exceptions import DBusException
 from .. import const, basetypes as btype
 from ..specific import AppClass
-from . import models
-from .tools import get_db_session, get_auth_token
+from . import models, search
+from .tools import (
+    get_db_session, get_db_readers, get_auth_token, get_number_setting,
+)
+from .workers import SessionWorkers
 import dbus
 import dbus.service
+import base64
+import json
 import time
 
 
+# dbus passes reply and error callbacks of methods with these names,
+# called directly methods run inline and return result
+ASYNC_CALLBACKS = ('reply_handler', 'error_handler')
+
+# loaded with listed notes in constant number of queries, conflict
+# items are loaded by models.load_conflict_items
+NOTE_RELATIONS = (
+    subqueryload(models.Note.tags),
+    joinedload(models.Note.notebook),
+    joinedload(models.Note.place),
+)
+
+
 class NoteFilterer(object):
     """Create list with wiltered and sorted notes"""
 
     def __init__(self, session):
         self._filters = []
         self._order = None
+        self._matches = None
+        self._fts_version = False
         self.session = session
 
+    @property
+    def fts_version(self):
+        """Full text index module, None when sqlite has no fts"""
+        if self._fts_version is False:
+            self._fts_version = search.get_fts_version(
+                self.session.connection(),
+            )
+        return self._fts_version
+
     def by_words(self, words):
         """Add filter by words"""
-        if words:
+        if not words:
+            return self
+
+        # full text index, LIKE when sqlite has no fts
+        match = search.get_match_query(words, self.fts_version)
+        if self.fts_version and match:
+            self._matches = search.get_matches(match, self.fts_version)
+        else:
             words = '%' + words.replace(' ', '%').lower() + '%'
             self._filters.append(
                 func.lower(models.Note.title).like(words)
@@ -69,20 +106,105 @@ class NoteFilterer(object):
 
     def order_by(self, order):
         """Set ordering"""
-        self._order = {
-            btype.Note.ORDER_TITLE: models.Note.title,
-            btype.Note.ORDER_UPDATED: models.Note.updated,
-            btype.Note.ORDER_TITLE_DESC: models.Note.title.desc(),
-            btype.Note.ORDER_UPDATED_DESC: models.Note.updated.desc(),
-        }[order]
+        self._order = order
+        return self
+
+    def _get_sort(self):
+        """Get sort column and is it descending, id breaks ties"""
+        # not null, NULL in continuation token matches nothing
+        updated = func.coalesce(models.Note.updated, 0)
+        if self._order == btype.Note.ORDER_RELEVANCE:
+            if self._matches is None:
+                return updated, True
+            return self._matches.c.rank, False
+        title = func.coalesce(models.Note.title, '')
+        return {
+            btype.Note.ORDER_TITLE: (title, False),
+            btype.Note.ORDER_UPDATED: (updated, False),
+            btype.Note.ORDER_TITLE_DESC: (title, True),
+            btype.Note.ORDER_UPDATED_DESC: (updated, True),
+        }.get(self._order, (models.Note.id, False))
+
+    def _get_order(self):
+        """Get order clauses"""
+        column, desc = self._get_sort()
+        if desc:
+            return column.desc(), models.Note.id.desc()
+        return column, models.Note.id
+
+    def after(self, token):
+        """Add filter for page after continuation token"""
+        if token:
+            value, last_id = json.loads(base64.urlsafe_b64decode(
+                str(token),
+            ))
+            column, desc = self._get_sort()
+            if desc:
+                self._filters.append((column < value) | (
+                    (column == value) & (models.Note.id < last_id)
+                ))
+            else:
+                self._filters.append((column > value) | (
+                    (column == value) & (models.Note.id > last_id)
+                ))
         return self
 
     def all(self):
-        """Get result"""
-        return self.session.query(models.Note).filter(and_(
+        """Get result, with relations serialized by btype.Note"""
+        return self._filter(self.session.query(models.Note))\
+            .options(*NOTE_RELATIONS)
+
+    def summaries(self):
+        """Get result as btype.NoteSummary columns, content isn't loaded"""
+        default_notebook = select([models.Notebook.id]).where(
+            models.Notebook.default == True,
+        ).limit(1).as_scalar()
+        if self.fts_version:
+            # index keeps plain text, note html isn't touched
+            snippet = func.substr(
+                search.index_table.c.content, 1, search.SNIPPET_LENGTH,
+            )
+        else:
+            snippet = literal('')
+        query = self.session.query(
+            models.Note.id,
+            func.coalesce(models.Note.title, ''),
+            models.Note.updated,
+            models.Note.created,
+            func.coalesce(models.Note.notebook_id, default_notebook),
+            func.coalesce(models.Note.pinnded, False),
+            func.coalesce(snippet, ''),
+        )
+        if self.fts_version:
+            query = query.outerjoin(
+                search.index_table,
+                search.index_table.c.rowid == models.Note.id,
+            )
+        return self._filter(query)
+
+    def page(self, limit):
+        """Get page of summaries and continuation token of next one"""
+        column, desc = self._get_sort()
+        summaries = self.summaries().add_columns(column)\
+            .limit(limit + 1).all()
+        token = ''
+        if len(summaries) > limit:
+            summaries = summaries[:limit]
+            token = base64.urlsafe_b64encode(json.dumps([
+                summaries[-1][-1], summaries[-1][0],
+            ]))
+        return [tuple(summary)[:-1] for summary in summaries], token
+
+    def _filter(self, query):
+        """Apply filters and ordering"""
+        if self._matches is not None:
+            query = query.join(
+                self._matches, self._matches.c.id == models.Note.id,
+            )
+        return query.filter(and_(
             ~models.Note.action.in_(const.DISABLED_ACTIONS),
             *self._filters
-        )).order_by(self._order)
+        )).order_by(*self._get_order())
 
 
 class ProviderServiceQObject(QObject):
@@ -90,6 +212,16 @@ class ProviderServiceQObject(QObject):
     authenticate_signal = Signal(str)
     remove_authenticate_signal = Signal()
     terminate = Signal()
+    # emitted by workers, callback is called in main loop
+    deliver = Signal(object)
+
+    def __init__(self):
+        super(ProviderServiceQObject, self).__init__()
+        self.deliver.connect(self.on_deliver)
+
+    @Slot(object)
+    def on_deliver(self, callback):
+        callback()
 
 # ********** DBUS Services/API *********
 # dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
@@ -104,13 +236,76 @@ class ProviderService(dbus.service.Object):
         self.qobject = ProviderServiceQObject()
         self.app = AppClass.instance()
 
+    # session of writer thread, or of main loop with inline calls
     @property
     def session(self):
         if not hasattr(self, '_session'):
-            self._session = get_db_session()
-            models.Note.session = self._session   # shit shit
+            self._session = get_db_session(settings=self.app.settings)
         return self._session
 
+    @property
+    def readers(self):
+        if not hasattr(self, '_readers'):
+            size = get_number_setting(
+                self.app.settings, 'service_readers',
+                const.DEFAULT_SERVICE_READERS,
+            )
+            self._readers = SessionWorkers(
+                size, get_db_readers(size, settings=self.app.settings),
+                self.qobject.deliver.emit,
+            )
+        return self._readers
+
+    @property
+    def writer(self):
+        if not hasattr(self, '_writer'):
+            self._writer = SessionWorkers(
+                1, lambda: self.session, self.qobject.deliver.emit,
+            )
+        return self._writer
+
+    def _unit(self, job):
+        """Get job running as unit of work in session"""
+        def run(session):
+            with models.unit_of_work(session):
+                return job(session)
+        return run
+
+    def _read(self, query, reply_handler, error_handler, unpack=False):
+        """Run query in readers pool, inline when called directly"""
+        query = self._unit(query)
+        if reply_handler is None:
+            return query(self.session)
+        self.readers.submit(
+            query, self._replier(reply_handler, unpack), error_handler,
+        )
+
+    def _write(
+        self, change, reply_handler, error_handler,
+        unpack=False, notify=None,
+    ):
+        """Apply change in writer, notify clients after it"""
+        notify = notify or self.data_changed
+        change = self._unit(change)
+        if reply_handler is None:
+            result = change(self.session)
+            notify()
+            return result
+        reply = self._replier(reply_handler, unpack)
+
+        def callback(result):
+            notify()
+            reply(result)
+
+        self.writer.submit(change, callback, error_handler)
+
+    def _replier(self, reply_handler, unpack):
+        """Get callback replying with result, unpacked for many
+        out args or none"""
+        if unpack:
+            return lambda result: reply_handler(*(result or ()))
+        return reply_handler
+
     @property
     def sq(self):
         if not hasattr(self, '_sq'):
@@ -122,400 +317,545 @@ class ProviderService(dbus.service.Object):
     @dbus.service.method(
         "com.everpad.Provider", in_signature='i',
         out_signature=btype.Note.signature,
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def get_note(self, id):
+    def get_note(self, id, reply_handler=None, error_handler=None):
         """Get note by id"""
-        try:
-            note = self.session.query(models.Note).filter(
-                (models.Note.id == id)
-                & (models.Note.action != const.ACTION_DELETE)
-            ).one()
+        def query(session):
+            try:
+                note = session.query(models.Note).filter(
+                    (models.Note.id == id)
+                    & (models.Note.action != const.ACTION_DELETE)
+                ).one()
 
-            return btype.Note >> note
-        except NoResultFound:
-            raise DBusException('models.Note not found')
+                return btype.Note >> note
+            except NoResultFound:
+                raise DBusException('models.Note not found')
+
+        return self._read(query, reply_handler, error_handler)
 
     #*** dbus get note by note guid
     @dbus.service.method(
         "com.everpad.Provider", in_signature='s',
         out_signature=btype.Note.signature,
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def get_note_by_guid(self, guid):
+    def get_note_by_guid(self, guid, reply_handler=None, error_handler=None):
         """Get note by guid"""
-        try:
-            note = self.session.query(models.Note).filter(
-                (models.Note.guid == guid)
-                & ~models.Note.action.in_(const.DISABLED_ACTIONS)
-            ).one()
+        def query(session):
+            try:
+                note = session.query(models.Note).filter(
+                    (models.Note.guid == guid)
+                    & ~models.Note.action.in_(const.DISABLED_ACTIONS)
+                ).one()
 
-            return btype.Note >> note
-        except NoResultFound:
-            raise DBusException('Note not found')
+                return btype.Note >> note
+            except NoResultFound:
+                raise DBusException('Note not found')
+
+        return self._read(query, reply_handler, error_handler)
 
     #*** dbus get note conflict
     @dbus.service.method(
         "com.everpad.Provider", in_signature='i',
         out_signature='a{}'.format(btype.Note.signature),
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def get_note_alternatives(self, id):
+    def get_note_alternatives(
+        self, id,
+        reply_handler=None, error_handler=None,
+    ):
         """Get note conflict alternatives"""
-        notes = self.session.query(models.Note).filter(
-            models.Note.conflict_parent_id == id,
-        ).all()
-        return btype.Note.list >> notes
+        def query(session):
+            notes = session.query(models.Note).filter(
+                models.Note.conflict_parent_id == id,
+            ).options(*NOTE_RELATIONS).all()
+            return btype.Note.list >> models.load_conflict_items(
+                session, notes,
+            )
+
+        return self._read(query, reply_handler, error_handler)
 
     #*** dbus find note
     @dbus.service.method(
         "com.everpad.Provider", in_signature='saiaiiiii',
         out_signature='a{}'.format(btype.Note.signature),
+        async_callbacks=ASYNC_CALLBACKS,
     )
     def find_notes(
         self, words, notebooks, tags, place,
         limit=const.DEFAULT_LIMIT, order=const.ORDER_UPDATED,
         pinnded=const.NOT_PINNDED,
+        reply_handler=None, error_handler=None,
     ):
         """Find notes by filters"""
-        notes = btype.Note.list >> NoteFilterer(self.session)\
-            .by_words(words)\
-            .by_notebooks(notebooks)\
-            .by_tags(tags)\
-            .by_place(place)\
-            .by_pinnded(pinnded)\
-            .order_by(order)\
-            .all()\
-            .limit(limit)
+        def query(session):
+            notes = NoteFilterer(session)\
+                .by_words(words)\
+                .by_notebooks(notebooks)\
+                .by_tags(tags)\
+                .by_place(place)\
+                .by_pinnded(pinnded)\
+                .order_by(order)\
+                .all()\
+                .limit(limit)\
+                .all()
+
+            return btype.Note.list >> models.load_conflict_items(
+                session, notes,
+            )
 
-        return notes
+        return self._read(query, reply_handler, error_handler)
+
+    #*** dbus find note summaries for lists
+    @dbus.service.method(
+        "com.everpad.Provider", in_signature='saiaiiiii',
+        out_signature='a{}'.format(btype.NoteSummary.signature),
+        async_callbacks=ASYNC_CALLBACKS,
+    )
+    def find_note_summaries(
+        self, words, notebooks, tags, place,
+        limit=const.DEFAULT_LIMIT, order=const.ORDER_UPDATED,
+        pinnded=const.NOT_PINNDED,
+        reply_handler=None, error_handler=None,
+    ):
+        """Find notes by filters, without content"""
+        def query(session):
+            summaries = NoteFilterer(session)\
+                .by_words(words)\
+                .by_notebooks(notebooks)\
+                .by_tags(tags)\
+                .by_place(place)\
+                .by_pinnded(pinnded)\
+                .order_by(order)\
+                .summaries()\
+                .limit(limit)
+
+            return [tuple(summary) for summary in summaries]
+
+        return self._read(query, reply_handler, error_handler)
+
+    #*** dbus find note summaries page by page
+    @dbus.service.method(
+        "com.everpad.Provider", in_signature='saiaiiiiis',
+        out_signature='a{}s'.format(btype.NoteSummary.signature),
+        async_callbacks=ASYNC_CALLBACKS,
+    )
+    def find_note_summaries_page(
+        self, words, notebooks, tags, place, limit, order, pinnded, token,
+        reply_handler=None, error_handler=None,
+    ):
+        """Find notes page after token, next token is empty on last page"""
+        def query(session):
+            filterer = NoteFilterer(session)\
+                .by_words(words)\
+                .by_notebooks(notebooks)\
+                .by_tags(tags)\
+                .by_place(place)\
+                .by_pinnded(pinnded)\
+                .order_by(order)
+            try:
+                filterer.after(token)
+            except (TypeError, ValueError):
+                raise DBusException('Wrong page token')
+            return filterer.page(limit)
+
+        return self._read(query, reply_handler, error_handler, unpack=True)
 
     #*** dbus
     @dbus.service.method(
         "com.everpad.Provider", in_signature='',
         out_signature='a{}'.format(btype.Notebook.signature),
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def list_notebooks(self):
+    def list_notebooks(self, reply_handler=None, error_handler=None):
         """List available notebooks"""
-        notebooks = self.session.query(models.Notebook).filter(
-            models.Notebook.action != const.ACTION_DELETE,
-        ).order_by(models.Notebook.name)
+        def query(session):
+            notebooks = session.query(models.Notebook).filter(
+                models.Notebook.action != const.ACTION_DELETE,
+            ).order_by(models.Notebook.name)
 
-        return btype.Notebook.list >> notebooks
+            return btype.Notebook.list >> notebooks
+
+        return self._read(query, reply_handler, error_handler)
 
     #*** dbus
     @dbus.service.method(
         "com.everpad.Provider", in_signature='i',
         out_signature=btype.Notebook.signature,
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def get_notebook(self, id):
+    def get_notebook(self, id, reply_handler=None, error_handler=None):
         """Get notebook by id"""
-        try:
-            notebook = self.session.query(models.Notebook).filter(
-                (models.Notebook.id == id)
-                & (models.Notebook.action != const.ACTION_DELETE)
-            ).one()
+        def query(session):
+            try:
+                notebook = session.query(models.Notebook).filter(
+                    (models.Notebook.id == id)
+                    & (models.Notebook.action != const.ACTION_DELETE)
+                ).one()
 
-            return btype.Notebook >> notebook
-        except NoResultFound:
-            raise DBusException('Notebook does not exist')
+                return btype.Notebook >> notebook
+            except NoResultFound:
+                raise DBusException('Notebook does not exist')
+
+        return self._read(query, reply_handler, error_handler)
 
     #*** dbus
     @dbus.service.method(
         "com.everpad.Provider", in_signature='i',
         out_signature='i',
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def get_notebook_notes_count(self, id):
+    def get_notebook_notes_count(
+        self, id,
+        reply_handler=None, error_handler=None,
+    ):
         """Get count of notes in notebook"""
-        return self.session.query(models.Note).filter(
-            (models.Note.notebook_id == id)
-            & ~models.Note.action.in_(const.DISABLED_ACTIONS)
-        ).count()
+        def query(session):
+            return session.query(models.Note).filter(
+                (models.Note.notebook_id == id)
+                & ~models.Note.action.in_(const.DISABLED_ACTIONS)
+            ).count()
+
+        return self._read(query, reply_handler, error_handler)
 
     #*** dbus
     @dbus.service.method(
         "com.everpad.Provider", in_signature=btype.Notebook.signature,
         out_signature=btype.Notebook.signature,
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def update_notebook(self, notebook_struct):
+    def update_notebook(
+        self, notebook_struct,
+        reply_handler=None, error_handler=None,
+    ):
         """Update notebook"""
-        try:
-            notebook_btype = btype.Notebook << notebook_struct
+        def change(session):
+            try:
+                notebook_btype = btype.Notebook << notebook_struct
 
-            notebook = self.session.query(models.Notebook).filter(
-                (models.Notebook.id == notebook_btype.id)
-                & (models.Notebook.action != const.ACTION_DELETE)
-            ).one()
+                notebook = session.query(models.Notebook).filter(
+                    (models.Notebook.id == notebook_btype.id)
+                    & (models.Notebook.action != const.ACTION_DELETE)
+                ).one()
 
-            if self.session.query(models.Notebook).filter(
-                (models.Notebook.id != notebook_btype.id)
-                & (models.Notebook.name == notebook_btype.name)
-            ).count():
-                raise DBusException(
-                    'Notebook with this name already exist',
-                )
+                if session.query(models.Notebook).filter(
+                    (models.Notebook.id != notebook_btype.id)
+                    & (models.Notebook.name == notebook_btype.name)
+                ).count():
+                    raise DBusException(
+                        'Notebook with this name already exist',
+                    )
 
-            notebook.action = const.ACTION_CHANGE
-            notebook_btype.give_to_obj(notebook)
-            self.session.commit()
+                notebook.action = const.ACTION_CHANGE
+                notebook_btype.give_to_obj(notebook)
+                session.commit()
 
-            self.data_changed()
+                return btype.Notebook >> notebook
+            except NoResultFound:
+                raise DBusException('Notebook does not exist')
 
-            return btype.Notebook >> notebook
-        except NoResultFound:
-            raise DBusException('Notebook does not exist')
+        return self._write(change, reply_handler, error_handler)
 
     #*** dbus
     @dbus.service.method(
         "com.everpad.Provider", in_signature='i',
         out_signature='b',
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def delete_notebook(self, id):
+    def delete_notebook(self, id, reply_handler=None, error_handler=None):
         """Delete notebook"""
-        try:
-            notebook = self.session.query(models.Notebook).filter(
-                models.Notebook.id == id,
-            ).one()
-            notebook.action = const.ACTION_DELETE
-            self.session.commit()
-            self.data_changed()
-            return True
-        except NoResultFound:
-            raise DBusException('Notebook does not exist')
+        def change(session):
+            try:
+                notebook = session.query(models.Notebook).filter(
+                    models.Notebook.id == id,
+                ).one()
+                notebook.action = const.ACTION_DELETE
+                session.commit()
+                return True
+            except NoResultFound:
+                raise DBusException('Notebook does not exist')
+
+        return self._write(change, reply_handler, error_handler)
 
     #*** dbus
     @dbus.service.method(
         "com.everpad.Provider", in_signature='',
         out_signature='a{}'.format(btype.Tag.signature),
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def list_tags(self):
+    def list_tags(self, reply_handler=None, error_handler=None):
         """List all tags"""
-        tags = self.session.query(models.Tag).filter(
-            models.Tag.action != const.ACTION_DELETE,
-        ).order_by(models.Tag.name)
+        def query(session):
+            tags = session.query(models.Tag).filter(
+                models.Tag.action != const.ACTION_DELETE,
+            ).order_by(models.Tag.name)
+
+            return btype.Tag.list >> tags
 
-        return btype.Tag.list >> tags
+        return self._read(query, reply_handler, error_handler)
 
     #*** dbus
     @dbus.service.method(
         "com.everpad.Provider", in_signature='i',
         out_signature='i',
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def get_tag_notes_count(self, id):
+    def get_tag_notes_count(self, id, reply_handler=None, error_handler=None):
         """Get count of notes with tag"""
-        return self.session.query(models.Note).filter(
-            models.Note.tags.any(models.Tag.id == id)
-            & ~models.Note.action.in_(const.DISABLED_ACTIONS)
-        ).count()
+        def query(session):
+            return session.query(models.Note).filter(
+                models.Note.tags.any(models.Tag.id == id)
+                & ~models.Note.action.in_(const.DISABLED_ACTIONS)
+            ).count()
+
+        return self._read(query, reply_handler, error_handler)
 
     #*** dbus
     @dbus.service.method(
         "com.everpad.Provider", in_signature='i',
         out_signature='b',
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def delete_tag(self, id):
+    def delete_tag(self, id, reply_handler=None, error_handler=None):
         """Delete tag"""
-        try:
-            tag = self.session.query(models.Tag).filter(
-                (models.Tag.id == id)
-                & (models.Tag.action != const.ACTION_DELETE)
-            ).one()
+        def change(session):
+            try:
+                tag = session.query(models.Tag).filter(
+                    (models.Tag.id == id)
+                    & (models.Tag.action != const.ACTION_DELETE)
+                ).one()
+
+                tag.action = const.ACTION_DELETE
 
-            tag.action = const.ACTION_DELETE
+                for note in session.query(models.Note).filter(
+                    models.Note.tags.contains(tag),
+                ).all():
+                    note.tags.remove(tag)
 
-            for note in self.session.query(models.Note).filter(
-                models.Note.tags.contains(tag),
-            ).all():
-                note.tags.remove(tag)
+                session.commit()
+                return True
+            except NoResultFound:
+                raise DBusException('Tag does not exist')
 
-            self.session.commit()
-            self.data_changed()
-            return True
-        except NoResultFound:
-            raise DBusException('Tag does not exist')
+        return self._write(change, reply_handler, error_handler)
 
     #*** dbus
     @dbus.service.method(
         "com.everpad.Provider", in_signature=btype.Tag.signature,
         out_signature=btype.Tag.signature,
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def update_tag(self, tag_struct):
+    def update_tag(self, tag_struct, reply_handler=None, error_handler=None):
         """Update tag"""
-        try:
-            tag_btype = btype.Tag << tag_struct
-            tag = self.session.query(models.Tag).filter(
-                (models.Tag.id == tag_btype.id)
-                & (models.Tag.action != const.ACTION_DELETE)
-            ).one()
-
-            if self.session.query(models.Tag).filter(
-                (models.Tag.id != tag_btype.id)
-                & (models.Tag.name == tag_btype.name)
-            ).count():
-                raise DBusException(
-                    'Tag with this name already exist',
-                )
-
-            tag.action = const.ACTION_CHANGE
-            tag_btype.give_to_obj(tag)
-            self.session.commit()
-            self.data_changed()
-
-            return btype.Tag >> tag
-        except NoResultFound:
-            raise DBusException('Tag does not exist')
-    
+        def change(session):
+            try:
+                tag_btype = btype.Tag << tag_struct
+                tag = session.query(models.Tag).filter(
+                    (models.Tag.id == tag_btype.id)
+                    & (models.Tag.action != const.ACTION_DELETE)
+                ).one()
+
+                if session.query(models.Tag).filter(
+                    (models.Tag.id != tag_btype.id)
+                    & (models.Tag.name == tag_btype.name)
+                ).count():
+                    raise DBusException(
+                        'Tag with this name already exist',
+                    )
+
+                tag.action = const.ACTION_CHANGE
+                tag_btype.give_to_obj(tag)
+                session.commit()
+
+                return btype.Tag >> tag
+            except NoResultFound:
+                raise DBusException('Tag does not exist')
+
+
+        return self._write(change, reply_handler, error_handler)
     #*** dbus
     @dbus.service.method(
         "com.everpad.Provider",
         in_signature=btype.Note.signature,
         out_signature=btype.Note.signature,
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def create_note(self, note_struct):
+    def create_note(self, note_struct, reply_handler=None, error_handler=None):
         """Create new note"""
-        note = models.Note(
-            action=const.ACTION_NOEXSIST,
-        )
-        note_btype = btype.Note << note_struct
-        note_btype.id = None
-        note_btype.give_to_obj(note)
+        def change(session):
+            note = models.Note(
+                action=const.ACTION_NOEXSIST,
+            )
+            note_btype = btype.Note << note_struct
+            note_btype.id = None
+            note_btype.give_to_obj(note)
 
-        note.updated = int(time.time() * 1000)
-        note.created = int(time.time() * 1000)
+            note.updated = int(time.time() * 1000)
+            note.created = int(time.time() * 1000)
+
+            session.add(note)
+            session.commit()
+
+            return btype.Note >> note
 
-        self.session.add(note)
-        self.session.commit()
-        self.data_changed()
 
-        return btype.Note >> note
-        
+        return self._write(change, reply_handler, error_handler)
     #*** dbus
     @dbus.service.method(
         "com.everpad.Provider",
         in_signature=btype.Note.signature,
         out_signature=btype.Note.signature,
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def update_note(self, note_struct):
+    def update_note(self, note_struct, reply_handler=None, error_handler=None):
         """Update note"""
-        note_btype = btype.Note << note_struct
+        def change(session):
+            note_btype = btype.Note << note_struct
 
-        try:
-            note = self.session.query(models.Note).filter(
-                (models.Note.id == note_btype.id)
-                & (models.Note.action != const.ACTION_DELETE)
-            ).one()
-        except NoResultFound:
-            raise DBusException('Note not found')
+            try:
+                note = session.query(models.Note).filter(
+                    (models.Note.id == note_btype.id)
+                    & (models.Note.action != const.ACTION_DELETE)
+                ).one()
+            except NoResultFound:
+                raise DBusException('Note not found')
 
-        note_btype.give_to_obj(note)
+            note_btype.give_to_obj(note)
 
-        if note.action == const.ACTION_NOEXSIST:
-            note.action = const.ACTION_CREATE
-        elif note.action != const.ACTION_CREATE:
-            note.action = const.ACTION_CHANGE
+            if note.action == const.ACTION_NOEXSIST:
+                note.action = const.ACTION_CREATE
+            elif note.action != const.ACTION_CREATE:
+                note.action = const.ACTION_CHANGE
 
-        note.updated_local = int(time.time() * 1000)
-        self.session.commit()
-        self.data_changed()
+            note.updated_local = int(time.time() * 1000)
+            session.commit()
+
+            return btype.Note >> note
 
-        return btype.Note >> note
+        return self._write(change, reply_handler, error_handler)
 
     #*** dbus
     @dbus.service.method(
         "com.everpad.Provider", in_signature='i',
         out_signature='a{}'.format(btype.Resource.signature),
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def get_note_resources(self, note_id):
+    def get_note_resources(
+        self, note_id,
+        reply_handler=None, error_handler=None,
+    ):
         """Get note resources"""
-        resources = self.session.query(models.Resource).filter(
-            (models.Resource.note_id == note_id)
-            & (models.Resource.action != const.ACTION_DELETE)
-        )
+        def query(session):
+            resources = session.query(models.Resource).filter(
+                (models.Resource.note_id == note_id)
+                & (models.Resource.action != const.ACTION_DELETE)
+            )
 
-        return btype.Resource.list >> resources
+            return btype.Resource.list >> resources
+
+        return self._read(query, reply_handler, error_handler)
 
     #*** dbus
     @dbus.service.method(
         "com.everpad.Provider",
         in_signature='ia{}'.format(btype.Resource.signature),
         out_signature='{}'.format(btype.Note.signature),
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def update_note_resources(self, note_id, resources_struct):
+    def update_note_resources(
+        self, note_id, resources_struct,
+        reply_handler=None, error_handler=None,
+    ):
         """Update note resources"""
-        try:
-            note = self.session.query(models.Note).filter(
-                models.Note.id == note_id,
-            ).one()
-        except NoResultFound:
-            raise DBusException('models.Note not found')
-
-        self.session.query(models.Resource).filter(
-            models.Resource.note_id == note.id,
-        ).delete()
-
-        for resource_btype in btype.Resource.list << resources_struct:
-            resource = models.Resource(
-                action=const.ACTION_CREATE,
-                note_id=note.id,
-            )
-            resource_btype.give_to_obj(resource)
-            resource.id = None
-            self.session.add(resource)
+        def change(session):
+            try:
+                note = session.query(models.Note).filter(
+                    models.Note.id == note_id,
+                ).one()
+            except NoResultFound:
+                raise DBusException('models.Note not found')
+
+            session.query(models.Resource).filter(
+                models.Resource.note_id == note.id,
+            ).delete()
+
+            for resource_btype in btype.Resource.list << resources_struct:
+                resource = models.Resource(
+                    action=const.ACTION_CREATE,
+                    note_id=note.id,
+                )
+                resource_btype.give_to_obj(resource)
+                resource.id = None
+                session.add(resource)
 
-        if note.action != const.ACTION_CREATE:
-            note.action = const.ACTION_CHANGE
+            if note.action != const.ACTION_CREATE:
+                note.action = const.ACTION_CHANGE
 
-        self.session.commit()
-        self.data_changed()
-        return btype.Note >> note
+            session.commit()
+            return btype.Note >> note
+
+        return self._write(change, reply_handler, error_handler)
 
     #*** dbus
     @dbus.service.method(
         "com.everpad.Provider",
         in_signature='i', out_signature='b',
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def delete_note(self, note_id):
+    def delete_note(self, note_id, reply_handler=None, error_handler=None):
         """Delete note"""
-        try:
-            note = self.session.query(models.Note).filter(
-                models.Note.id == note_id,
-            ).one()
-
-            if note.action == const.ACTION_CONFLICT:
-                # prevent circular dependency error
-                note.conflict_parent_id = None
-                note.conflict_parent = []
-                self.session.commit()
-                self.session.delete(note)
-            else:
-                note.action = const.ACTION_DELETE
-
-            self.session.commit()
-            self.data_changed()
-            return True
-        except NoResultFound:
-            raise DBusException('models.Note not found')
+        def change(session):
+            try:
+                note = session.query(models.Note).filter(
+                    models.Note.id == note_id,
+                ).one()
+
+                if note.action == const.ACTION_CONFLICT:
+                    # prevent circular dependency error
+                    note.conflict_parent_id = None
+                    note.conflict_parent = []
+                    session.commit()
+                    session.delete(note)
+                else:
+                    note.action = const.ACTION_DELETE
+
+                session.commit()
+                return True
+            except NoResultFound:
+                raise DBusException('models.Note not found')
+
+        return self._write(change, reply_handler, error_handler)
 
     #*** dbus
     @dbus.service.method(
         "com.everpad.Provider",
         in_signature='ss',
         out_signature=btype.Notebook.signature,
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def create_notebook(self, name, stack):
+    def create_notebook(
+        self, name, stack,
+        reply_handler=None, error_handler=None,
+    ):
         """Create new notebook"""
-        if self.session.query(models.Note).filter(
-            models.Notebook.name == name,
-        ).count():
-            raise DBusException(
-                'models.Notebook with this name already exist',
+        def change(session):
+            if session.query(models.Note).filter(
+                models.Notebook.name == name,
+            ).count():
+                raise DBusException(
+                    'models.Notebook with this name already exist',
+                )
+
+            notebook = models.Notebook(
+                action=const.ACTION_CREATE,
+                name=name, default=False, stack=stack,
             )
+            session.add(notebook)
+            session.commit()
+            return btype.Notebook >> notebook
 
-        notebook = models.Notebook(
-            action=const.ACTION_CREATE,
-            name=name, default=False, stack=stack,
-        )
-        self.session.add(notebook)
-        self.session.commit()
-        self.data_changed()
-        return btype.Notebook >> notebook
+        return self._write(change, reply_handler, error_handler)
 
     #*** dbus
     @dbus.service.method(
@@ -553,48 +893,67 @@ class ProviderService(dbus.service.Object):
     @dbus.service.method(
         "com.everpad.Provider",
         in_signature='', out_signature='a%s' % btype.Place.signature,
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def list_places(self):
+    def list_places(self, reply_handler=None, error_handler=None):
         """List places"""
-        places = self.session.query(models.Place).all()
-        return btype.Place.list >> places
+        def query(session):
+            places = session.query(models.Place).all()
+            return btype.Place.list >> places
+
+        return self._read(query, reply_handler, error_handler)
 
     #*** dbus
     @dbus.service.method(
         "com.everpad.Provider",
         in_signature='i', out_signature='',
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def share_note(self, note_id):
+    def share_note(self, note_id, reply_handler=None, error_handler=None):
         """Share note"""
-        try:
-            note = self.session.query(models.Note).filter(
-                (models.Note.id == note_id)
-                & (models.Note.action != const.ACTION_DELETE)
-            ).one()
-            note.share_status = const.SHARE_NEED_SHARE
-            self.session.commit()
-            self.sync()
-        except NoResultFound:
-            raise DBusException('models.Note not found')
+        def change(session):
+            try:
+                note = session.query(models.Note).filter(
+                    (models.Note.id == note_id)
+                    & (models.Note.action != const.ACTION_DELETE)
+                ).one()
+                note.share_status = const.SHARE_NEED_SHARE
+                session.commit()
+            except NoResultFound:
+                raise DBusException('models.Note not found')
+
+        return self._write(
+            change, reply_handler, error_handler,
+            unpack=True, notify=self.sync,
+        )
 
     #*** dbus
     @dbus.service.method(
         "com.everpad.Provider",
-        in_signature='i', out_signature=''
+        in_signature='i', out_signature='',
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def stop_sharing_note(self, note_id):
+    def stop_sharing_note(
+        self, note_id,
+        reply_handler=None, error_handler=None,
+    ):
         """Stop sharing note"""
-        try:
-            note = self.session.query(models.Note).filter(
-                (models.Note.id == note_id)
-                & (models.Note.action != const.ACTION_DELETE)
-            ).one()
-            note.share_status = const.SHARE_NEED_STOP
-            note.share_url = ''
-            self.session.commit()
-            self.sync()
-        except NoResultFound:
-            raise DBusException('models.Note not found')
+        def change(session):
+            try:
+                note = session.query(models.Note).filter(
+                    (models.Note.id == note_id)
+                    & (models.Note.action != const.ACTION_DELETE)
+                ).one()
+                note.share_status = const.SHARE_NEED_STOP
+                note.share_url = ''
+                session.commit()
+            except NoResultFound:
+                raise DBusException('models.Note not found')
+
+        return self._write(
+            change, reply_handler, error_handler,
+            unpack=True, notify=self.sync,
+        )
 
     #*** dbus
     @dbus.service.method(
@@ -649,13 +1008,17 @@ class ProviderService(dbus.service.Object):
     @dbus.service.method(
         "com.everpad.Provider", in_signature='',
         out_signature='b',
+        async_callbacks=ASYNC_CALLBACKS,
     )
-    def is_first_synced(self):
+    def is_first_synced(self, reply_handler=None, error_handler=None):
         """Check is first sync performed"""
-        return bool(self.session.query(models.Notebook).filter(
-            (models.Notebook.action != const.ACTION_DELETE)
-            & (models.Notebook.default == True)
-        ).count())
+        def query(session):
+            return bool(session.query(models.Notebook).filter(
+                (models.Notebook.action != const.ACTION_DELETE)
+                & (models.Notebook.default == True)
+            ).count())
+
+        return self._read(query, reply_handler, error_handler)
 
     #*** dbus
     @dbus.service.method(
@@ -0,0 +1,184 @@
+from thrift.Thrift import TType, TMessageType, TApplicationException
+from thrift.protocol import TBinaryProtocol
+from evernote.edam.notestore import NoteStore
+from evernote.edam.type import ttypes
+from contextlib import contextmanager
+import glob
+import hashlib
+import os
+import tempfile
+
+
+# ****** Contains:
+#        NoteStoreClient - note store streaming resource bodies
+#        FileData - resource data with body read from file on push
+#        download_resource - resource body to temp file
+#
+# Resource bodies can be hundreds of MB, they are never kept in memory
+# whole: received bodies go to file by DATA_CHUNK_SIZE chunks, pushed
+# ones are written to transport from file.
+DATA_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_PREFIX = '.download-'
+
+
+class BodyHashError(Exception):
+    """Downloaded resource body doesn't match bodyHash"""
+
+
+# **************** Push ****************
+#
+# fastbinary encodes whole struct from attributes and would skip body,
+# so structs with FileData are always encoded by python code
+class FileData(ttypes.Data):
+    """Data with body written from file"""
+
+    def __init__(self, path):
+        ttypes.Data.__init__(self)
+        self.path = path
+
+    def write(self, oprot):
+        oprot.writeStructBegin('Data')
+        oprot.writeFieldBegin('body', TType.STRING, 3)
+        oprot.writeI32(os.path.getsize(self.path))
+        with open(self.path, 'rb') as body:
+            for chunk in iter(lambda: body.read(DATA_CHUNK_SIZE), ''):
+                oprot.trans.write(chunk)
+        oprot.writeFieldEnd()
+        oprot.writeFieldStop()
+        oprot.writeStructEnd()
+
+
+# **************** Pull ****************
+#
+class _ResourceDataResult(NoteStore.getResourceData_result):
+    """getResourceData result with body written to file"""
+
+    def __init__(self, body):
+        NoteStore.getResourceData_result.__init__(self)
+        self.body = body
+
+    def read(self, iprot):
+        iprot.readStructBegin()
+        while True:
+            fname, ftype, fid = iprot.readFieldBegin()
+            if ftype == TType.STOP:
+                break
+            if fid == 0 and ftype == TType.STRING:
+                self._read_body(iprot)
+                self.success = True
+            elif ftype == TType.STRUCT and fid in (1, 2, 3):
+                exception_cls = self.thrift_spec[fid][3][0]
+                exception = exception_cls()
+                exception.read(iprot)
+                setattr(self, self.thrift_spec[fid][2], exception)
+            else:
+                iprot.skip(ftype)
+            iprot.readFieldEnd()
+        iprot.readStructEnd()
+
+    def _read_body(self, iprot):
+        """Copy binary field to file by chunks"""
+        left = iprot.readI32()
+        while left:
+            chunk = iprot.trans.readAll(min(left, DATA_CHUNK_SIZE))
+            self.body.write(chunk)
+            left -= len(chunk)
+
+
+class NoteStoreClient(NoteStore.Client):
+    """Note store client with streaming of resource bodies, url is
+    kept for clients of sync workers"""
+
+    def __init__(self, iprot, oprot=None, url=None):
+        NoteStore.Client.__init__(self, iprot, oprot)
+        self.url = url
+        self._python_oprot = TBinaryProtocol.TBinaryProtocol(
+            self._oprot.trans,
+        )
+
+    @contextmanager
+    def _python_encoding(self):
+        """Encode call without fastbinary"""
+        oprot = self._oprot
+        self._oprot = self._python_oprot
+        try:
+            yield
+        finally:
+            self._oprot = oprot
+
+    def send_createNote(self, authenticationToken, note):
+        with self._python_encoding():
+            NoteStore.Client.send_createNote(self, authenticationToken, note)
+
+    def send_updateNote(self, authenticationToken, note):
+        with self._python_encoding():
+            NoteStore.Client.send_updateNote(self, authenticationToken, note)
+
+    def getResourceDataToFile(self, authenticationToken, guid, body):
+        """getResourceData writing body to file object"""
+        self.send_getResourceData(authenticationToken, guid)
+        fname, mtype, rseqid = self._iprot.readMessageBegin()
+        if mtype == TMessageType.EXCEPTION:
+            x = TApplicationException()
+            x.read(self._iprot)
+            self._iprot.readMessageEnd()
+            raise x
+        result = _ResourceDataResult(body)
+        result.read(self._iprot)
+        self._iprot.readMessageEnd()
+        if result.success is not None:
+            return
+        for exception in (
+            result.userException, result.systemException,
+            result.notFoundException,
+        ):
+            if exception is not None:
+                raise exception
+        raise TApplicationException(
+            TApplicationException.MISSING_RESULT,
+            "getResourceData failed: unknown result",
+        )
+
+
+class _HashingFile(object):
+    """File writer counting md5 of written data"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.md5 = hashlib.md5()
+
+    def write(self, data):
+        self.md5.update(data)
+        self.fileobj.write(data)
+
+
+# Temp file is in data directory, so renaming it to resource path
+# is atomic, resource file is never partially written.
+def download_resource(note_store, auth_token, guid, body_hash, directory):
+    """Download resource body to temp file, get its path.
+
+    body_hash is hex md5, empty when unknown."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, path = tempfile.mkstemp(dir=directory, prefix=DOWNLOAD_PREFIX)
+    try:
+        with os.fdopen(fd, 'wb') as body:
+            hashing = _HashingFile(body)
+            note_store.getResourceDataToFile(auth_token, guid, hashing)
+        if body_hash and hashing.md5.hexdigest() != body_hash:
+            raise BodyHashError('Resource %s body hash %s expected, got %s' % (
+                guid, body_hash, hashing.md5.hexdigest(),
+            ))
+    except:
+        os.remove(path)
+        raise
+    return path
+
+
+def remove_downloads(directory):
+    """Remove temp files of unfinished downloads"""
+    for path in glob.glob(os.path.join(directory, DOWNLOAD_PREFIX + '*')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -5,22 +5,26 @@ from datetime import datetime
 from ... import const
 from ...specific import AppClass
 from .. import tools
-from . import note, notebook, tag
+from . import note, notebook, tag, chunk
+from .scheduler import Scheduler, ScheduledStore
+from .base import Checkpoint
+from ..geocode import Geocoder
 from .. import models
+import os
 import time
 import traceback
 import socket
 
 """
     Rate Limit handling:
+        Every note store and user store call goes through Scheduler,
+        calls are spread to sync_calls_per_hour setting. Short rate
+        limit windows are waited in place, longer ones stop the sync
+        keeping committed batches, the window end is stored in
+        Sync.rate_limit_time and no calls are made till it.
         If provider starts in a Rate Limit period, it will be caught 
-    	at _init_network. A sleep command will execute and indicator 
-    	will display Rate Limit.  There is really nothing else to do
-    	but sleep at that point.
-    	
-    	
-    	
-    	 
+    	at _init_network. Indicator will display Rate Limit.  There is
+    	really nothing else to do but sleep at that point.
 """
 
 
@@ -47,6 +51,8 @@ class SyncThread(QtCore.QThread):
         # Class = QCoreApplication
         # http://srinikom.github.io/pyside-docs/PySide/QtCore/QCoreApplication.html
         self.app = AppClass.instance()
+        # created in run()
+        self.geocoder = None
         # setup timer
         self._init_timer()
         # setup wait_condition and mutex
@@ -129,7 +135,9 @@ class SyncThread(QtCore.QThread):
     # Setup database - tools.py    
     def _init_db(self):
         """Init database"""
-        self.session = tools.get_db_session()
+        self.session = tools.get_db_session(
+            savepoints=True, settings=self.app.settings,
+        )
 
     # Initialize Network
     # Get get_auth_token get_note_store get_user_store - tools.py
@@ -137,9 +145,15 @@ class SyncThread(QtCore.QThread):
         """Init connection to remote server"""
         while True:
             try:
+                # getNoteStoreUrl call is made by get_note_store
+                self.scheduler.acquire()
                 self.auth_token = tools.get_auth_token()
-                self.note_store = tools.get_note_store(self.auth_token)
-                self.user_store = tools.get_user_store(self.auth_token)
+                self.note_store = ScheduledStore(
+                    tools.get_note_store(self.auth_token), self.scheduler,
+                )
+                self.user_store = ScheduledStore(
+                    tools.get_user_store(self.auth_token), self.scheduler,
+                )
                 break
             except EDAMSystemException, e:
                 if e.errorCode == EDAMErrorCode.RATE_LIMIT_REACHED:
@@ -148,12 +162,82 @@ class SyncThread(QtCore.QThread):
                         (e.rateLimitDuration/60)
                     )
                     self.status = const.STATUS_RATE
+                    self.scheduler.rate_limited(e.rateLimitDuration)
+                    self._store_rate_limit()
                     # nothing I can think of doing other than sleeping here
                     # until the rate limit clears
-                    time.sleep(e.rateLimitDuration)
+                    time.sleep(self.scheduler.remaining())
                     self.status = const.STATUS_NONE
             except socket.error:
                 time.sleep(30)
+
+    # *** Initialize Scheduler
+    # Api calls budget, rate limit window is restored from Sync table
+    def _init_scheduler(self):
+        """Init api calls scheduler"""
+        self.scheduler = Scheduler(
+            const.DEFAULT_SYNC_CALLS_PER_HOUR,
+            const.DEFAULT_SYNC_CALLS_BURST,
+            const.RATE_LIMIT_MAX_WAIT,
+            resume_at=self.sync_state.rate_limit_time or 0,
+        )
+        self._update_scheduler()
+
+    def _update_scheduler(self):
+        """Set calls budget from settings"""
+        settings = self.app.settings
+        self.scheduler.set_rate(
+            tools.get_number_setting(
+                settings, 'sync_calls_per_hour',
+                const.DEFAULT_SYNC_CALLS_PER_HOUR,
+            ),
+            tools.get_number_setting(
+                settings, 'sync_calls_burst', const.DEFAULT_SYNC_CALLS_BURST,
+            ),
+        )
+
+    def _init_geocoder(self):
+        """Init background geocoding of note places"""
+        timeout = tools.get_number_setting(
+            self.app.settings, 'geocode_timeout',
+            const.DEFAULT_GEOCODE_TIMEOUT, float,
+        )
+        self.geocoder = Geocoder(
+            os.path.expanduser(const.GEOCODE_CACHE_PATH), timeout,
+            self.app.log,
+        )
+
+    # Notes with coordinates and without place are submitted by every
+    # sync, so notes not geocoded before exit or pulled unchanged get
+    # place too. Cached coordinates are resolved without network.
+    def _apply_places(self):
+        """Set places geocoded since last sync, submit notes still
+        without place"""
+        identities = models.IdentityCache(self.session)
+        for guid, name in self.geocoder.results():
+            note = self.session.query(models.Note).filter(
+                models.Note.guid == guid,
+            ).first()
+            if note and not note.place:
+                note.place = identities.place(name)
+
+        for guid, latitude, longitude in self.session.query(
+            models.Note.guid, models.Note.latitude, models.Note.longitude,
+        ).filter(
+            (models.Note.place_id == None)
+            & (models.Note.guid != None)
+            & (models.Note.latitude != None)
+            & (models.Note.longitude != None)
+        ):
+            self.geocoder.submit(guid, latitude, longitude)
+
+    def _store_rate_limit(self):
+        """Save rate limit window to Sync table, flag is set for
+        windows not waited by scheduler"""
+        self.sync_state.rate_limit_time = int(self.scheduler.resume_at)
+        self.sync_state.rate_limit = int(
+            self.scheduler.remaining() > self.scheduler.max_wait)
+        self.session.commit()
                 
     # *** Initialize Sync
     # Setup Sync table with values and set status
@@ -184,7 +268,8 @@ class SyncThread(QtCore.QThread):
         
         # My thoughts right now
         # update_count - 0 since no sync
-        # last_sync - ??? don't know about this
+        # last_sync - server time of last finished sync, compared with
+        #             fullSyncBefore to decide on full or incremental sync
         # virgin_db - if == 1 then this is a first run
         # rate_limit - if provider is in a rate limit then == 1
         # rate_limit_time - rate limit time - need more here
@@ -192,8 +277,8 @@ class SyncThread(QtCore.QThread):
         
         if not self.sync_state:
             self.sync_state = models.Sync(
-                update_count=0, 
-                last_sync=self.last_sync,
+                update_count=0,
+                last_sync=0,
                 virgin_db=1,
                 rate_limit=0,
                 rate_limit_time=0,
@@ -202,9 +287,7 @@ class SyncThread(QtCore.QThread):
             self.session.add(self.sync_state)
             self.session.commit()
         else:
-            # MKG: zero my play values
-            self.sync_state.rate_limit=0
-            self.sync_state.rate_limit_time=0
+            # MKG: zero my play values, rate limit window is kept
             self.sync_state.connect_error_count=0
             self.session.commit()
 
@@ -222,6 +305,8 @@ class SyncThread(QtCore.QThread):
         # 
         self._init_db()         # setup database
         self._init_sync()       # setup Sync table times
+        self._init_scheduler()  # api calls budget
+        self._init_geocoder()   # place names of notes
         self._init_network()    # get evernote info
         
         
@@ -261,18 +346,8 @@ class SyncThread(QtCore.QThread):
         
         # get date/time to set new late sync value
         self.last_sync = datetime.now()
-
-        """        
-        I don't want to do this yet MKG
-        if self.sync_state.rate_limit:
-            if self.sync_state.last_sync < self.sync_state.rate_limit_time:
-                self.status = const.STATUS_NONE
-                self.app.log("Stopped - Still Rate Limit.")
-                return
-            else:
-                self.sync_state.rate_limit = 0
-                self.app.log("Rate Limit cleared.")
-        """
+        self._update_scheduler()
+        self._store_rate_limit()
 
         # ??? Tell the world we are start sync
         
@@ -282,6 +357,8 @@ class SyncThread(QtCore.QThread):
         
         # we hit a rate limit, might as well bug out here
         if self.sync_state.rate_limit and not need_to_update:
+            self._store_rate_limit()
+            self.sync_state_changed.emit(const.SYNC_STATE_RATE_LIMITED)
             self.sync_state_changed.emit(const.SYNC_STATE_FINISH)
             self.status = const.STATUS_NONE
             self.data_changed.emit()
@@ -289,26 +366,61 @@ class SyncThread(QtCore.QThread):
             return
 
         try:
+            complete = True
             if need_to_update:
-                self.remote_changes()
+                complete = self.remote_changes()
+            self._apply_places()
             self.local_changes()
             
             # if we get a good finish - update the count to match server
             self.sync_state.update_count = self.sync_state.srv_update_count
-            
+            if need_to_update and complete:
+                self.sync_state.last_sync = self.remote_sync_state.currentTime
+                self.sync_state.virgin_db = 0
+            self.session.commit()
+
         except Exception, e:  # maybe log this
             self.app.log("perform error")
             self.session.rollback()
             self._init_db()
+            # sync state was bound to the old session
+            self.sync_state = self.session.query(models.Sync).first()
             self.app.log(e)
         
         finally:
+            self._store_rate_limit()
+            if self.sync_state.rate_limit:
+                self.sync_state_changed.emit(const.SYNC_STATE_RATE_LIMITED)
             self.sync_state_changed.emit(const.SYNC_STATE_FINISH)
             self.status = const.STATUS_NONE
             self.all_notes = None
 
         self.data_changed.emit()
         self.app.log("Sync performed.")
+        stats = tools.http_pool.stats()
+        self.app.log(
+            "Http: %(requests)d requests, %(handshakes)d handshakes, "
+            "%(reconnects)d dropped keep-alive connections." % stats
+        )
+        self._log_compression(stats)
+        self.app.log(
+            "Api: %(calls)d calls, %(waited)d seconds waited for budget, "
+            "%(limits)d rate limits." % self.scheduler.stats()
+        )
+
+
+    def _log_compression(self, stats):
+        """Log compression ratio of http responses"""
+        if not stats['bytes_in']:
+            return
+        self.app.log(
+            "Http compression: %d KB received for %d KB, ratio %.1f, "
+            "%d KB saved." % (
+                stats['bytes_in_comp'] / 1024, stats['bytes_in'] / 1024,
+                float(stats['bytes_in']) / max(stats['bytes_in_comp'], 1),
+                (stats['bytes_in'] - stats['bytes_in_comp']) / 1024,
+            )
+        )
 
 
     def _need_to_update(self):
@@ -324,21 +436,21 @@ class SyncThread(QtCore.QThread):
         # generated. If updateCount and chunkHighUSN are identical, that means 
         # that this is the last chunk in the account ... there is no more recent information. 
         try:
-            self.sync_state.srv_update_count = self.note_store.getSyncState(
-                self.auth_token).updateCount
+            self.remote_sync_state = self.note_store.getSyncState(
+                self.auth_token)
         except EDAMSystemException, e:
-            if e.errorCode == EDAMErrorCode.RATE_LIMIT_REACHED:
-                self.app.log(
-                    "Rate limit _need_to_update: %d minutes - sleeping" % 
-                        (e.rateLimitDuration/60)
-                )
-                self.status = const.STATUS_RATE
-                # nothing I can think of doing other than sleeping here
-                # until the rate limit clears and retry
-                time.sleep(e.rateLimitDuration)
-                self.status = const.STATUS_SYNC
-                update_count = self.note_store.getSyncState(
-                    self.auth_token).updateCount
+            if e.errorCode != EDAMErrorCode.RATE_LIMIT_REACHED:
+                self.app.log("Couldn't get sync state: %s" % e)
+                return False
+            # short limits are waited by scheduler, sync is skipped
+            # till the end of long one
+            self.app.log(
+                "Rate limit _need_to_update: %d minutes" % 
+                    (e.rateLimitDuration/60)
+            )
+            self.status = const.STATUS_RATE
+            self.sync_state.rate_limit = 1
+            return False
         except socket.error, e:
             # MKG: I want to track connect errors
             self.sync_state.connect_error_count+=1
@@ -353,7 +465,8 @@ class SyncThread(QtCore.QThread):
             return False
             
         # Remember - don't get here if there was a problem
-        
+        self.sync_state.srv_update_count = self.remote_sync_state.updateCount
+
         #XXX: matsubara probably innefficient as it does a SQL each time it
         # accesses the update_count attr?
         self.app.log("Local account updates count:  %s" % self.sync_state.update_count)
@@ -368,7 +481,31 @@ class SyncThread(QtCore.QThread):
 
         return reason
 
+    # *** Need Full Sync ***
+    # http://dev.evernote.com/doc/articles/synchronization.php
+    # Full sync only for a virgin database or when the server asks
+    # for it with fullSyncBefore, otherwise pull sync chunks after
+    # the stored update_count
+    def _need_full_sync(self):
+        """Check need for full sync"""
+        last_sync = self.sync_state.last_sync
+        if (
+            self.sync_state.virgin_db
+            or not self.sync_state.update_count
+            or not isinstance(last_sync, (int, long))
+        ):
+            return True
+        return self.remote_sync_state.fullSyncBefore > last_sync
+
     
+    # *** Stop ***
+    # run() loop doesn't end, background geocoding is stopped here
+    def quit(self):
+        """Stop thread"""
+        if self.geocoder is not None:
+            self.geocoder.close()
+        QtCore.QThread.quit(self)
+
     # *** Force Sync ***
     def force_sync(self):
         """Start sync"""
@@ -407,19 +544,72 @@ class SyncThread(QtCore.QThread):
         note.PushNote(*self._get_sync_args()).push()
 
     # ******** Process Remote Changes *********
-    # Get all changes from server (evernote) 
+    # Get all changes from server (evernote), returns False when
+    # some items failed to apply, they are received again on next sync.
+    # Progress is committed with every batch to checkpoint, interrupted
+    # sync (rate limit, network, crash) continues from it.
     def remote_changes(self):
         """Receive remote changes from evernote"""
         self.app.log('Running remote_changes()')
-        
-        # Notebooks
-        self.sync_state_changed.emit(const.SYNC_STATE_NOTEBOOKS_REMOTE)
-        notebook.PullNotebook(*self._get_sync_args()).pull()
-        
-        # Tags
-        self.sync_state_changed.emit(const.SYNC_STATE_TAGS_REMOTE)
-        tag.PullTag(*self._get_sync_args()).pull()
+        checkpoint = Checkpoint(self.sync_state)
+
+        if not self._need_full_sync():
+            if checkpoint.phase != const.CHECKPOINT_CHUNKS:
+                checkpoint.start(
+                    const.CHECKPOINT_CHUNKS, self.sync_state.update_count,
+                )
+            else:
+                self.app.log('Resuming sync at USN %d.' % checkpoint.usn)
+            self.sync_state_changed.emit(const.SYNC_STATE_NOTES_REMOTE)
+            pull_chunks = chunk.PullChunks(
+                *self._get_sync_args(), checkpoint=checkpoint
+            )
+            last_usn = pull_chunks.pull(checkpoint.usn)
+            if pull_chunks.failed:
+                self.sync_state.srv_update_count = last_usn
+            else:
+                self.sync_state.srv_update_count = max(
+                    self.sync_state.srv_update_count, last_usn)
+            checkpoint.clear()
+            return not pull_chunks.failed
+
+        self.app.log('Full sync required.')
+
+        if checkpoint.phase != const.CHECKPOINT_NOTES:
+            # Notebooks
+            self.sync_state_changed.emit(const.SYNC_STATE_NOTEBOOKS_REMOTE)
+            pull_notebook = notebook.PullNotebook(*self._get_sync_args())
+            pull_notebook.pull()
+
+            # Tags
+            self.sync_state_changed.emit(const.SYNC_STATE_TAGS_REMOTE)
+            pull_tag = tag.PullTag(*self._get_sync_args())
+            pull_tag.pull()
+
+            # changes made on server while notes are pulled are received
+            # by incremental sync after usn of the start, full sync with
+            # failures is repeated from the beginning
+            failed = pull_notebook.failed or pull_tag.failed
+            if not failed:
+                checkpoint.start(
+                    const.CHECKPOINT_NOTES, self.sync_state.srv_update_count,
+                )
+                self.session.commit()
+            offset = 0
+        else:
+            failed = False
+            offset = max(checkpoint.offset - const.CHECKPOINT_OVERLAP, 0)
+            self.app.log('Resuming full sync near note %d.' % offset)
+            self.sync_state.srv_update_count = checkpoint.usn
 
         # Notes and Resources
         self.sync_state_changed.emit(const.SYNC_STATE_NOTES_REMOTE)
-        note.PullNote(*self._get_sync_args()).pull()
+        pull_note = note.PullNote(*self._get_sync_args(), checkpoint=checkpoint)
+        pull_note.pull(offset, checkpoint.updated)
+        checkpoint.clear()
+
+        if failed or pull_note.failed:
+            # full sync will be repeated
+            self.sync_state.srv_update_count = self.sync_state.update_count
+            return False
+        return True
@@ -1,13 +1,185 @@
+from evernote.edam.error.ttypes import (
+    EDAMUserException, EDAMNotFoundException,
+)
+from contextlib import contextmanager
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+from ... import const
 from ...specific import AppClass
+from ..stream import BodyHashError
+from .. import tools
+import time
+
+
+# errors of one item, it's rolled back alone and sync goes on
+ITEM_ERRORS = (
+    EDAMUserException, EDAMNotFoundException, SQLAlchemyError,
+    BodyHashError,
+)
+
+
+# **************** Checkpoint ****************
+#
+# Progress is kept in Sync table row, which is in the sync session, so
+# it's committed together with every batch. After an error the session
+# is rolled back to the last batch and progress matches it. Resources
+# aren't kept, they are applied in the savepoint of their note, and
+# notes near the checkpoint are pulled again on resume.
+class Checkpoint(object):
+    """Progress of sync, interrupted sync is resumed from it"""
+
+    def __init__(self, sync_state):
+        self.sync_state = sync_state
+
+    @property
+    def phase(self):
+        return self.sync_state.checkpoint_phase or const.CHECKPOINT_NONE
+
+    @property
+    def usn(self):
+        return self.sync_state.checkpoint_usn or 0
+
+    @property
+    def offset(self):
+        return self.sync_state.checkpoint_offset or 0
+
+    @property
+    def updated(self):
+        """Updated time of last pulled note, None when unknown"""
+        return self.sync_state.checkpoint_updated
+
+    @property
+    def generation(self):
+        """Sync generation of full pull, None when unknown"""
+        return self.sync_state.checkpoint_generation
+
+    def start(self, phase, usn, offset=0):
+        """Start phase"""
+        self.sync_state.checkpoint_phase = phase
+        self.sync_state.checkpoint_usn = usn
+        self.sync_state.checkpoint_offset = offset
+        self.sync_state.checkpoint_updated = None
+        self.sync_state.checkpoint_generation = None
+
+    def progress(
+        self, usn=None, offset=None, updated=None, generation=None,
+    ):
+        """Move checkpoint, saved with next committed batch"""
+        if usn is not None:
+            self.sync_state.checkpoint_usn = usn
+        if offset is not None:
+            self.sync_state.checkpoint_offset = offset
+        if updated is not None:
+            self.sync_state.checkpoint_updated = updated
+        if generation is not None:
+            self.sync_state.checkpoint_generation = generation
+
+    def clear(self):
+        """Sync finished"""
+        self.start(const.CHECKPOINT_NONE, None, None)
 
 
 class BaseSync(object):
     """Base class for sync"""
 
-    def __init__(self, auth_token, session, note_store, user_store):
+    def __init__(
+        self, auth_token, session, note_store, user_store, checkpoint=None,
+    ):
         """Set shortcuts"""
         self.auth_token = auth_token
         self.session = session
         self.note_store = note_store
         self.user_store = user_store
+        self.checkpoint = checkpoint
         self.app = AppClass.instance()
+        self.failed = []
+        self.generation = None
+        self._batch_count = 0
+        self._batch_started = time.time()
+        self._created = []
+
+    def _get_int_setting(self, name, default):
+        """Get integer value from settings"""
+        return tools.get_number_setting(self.app.settings, name, default)
+
+    # **************** Sync Generation ****************
+    #
+    # Every full pull marks received items with the next generation,
+    # items of older ones are not on server anymore and are removed by
+    # one indexed query, without lists of received ids.
+    def start_generation(self, model):
+        """Start full pull of model items"""
+        self.generation = (self.session.query(
+            func.max(model.sync_generation),
+        ).scalar() or 0) + 1
+
+    def stale(self, model):
+        """Get filter of items not received by full pull"""
+        q = model.sync_generation < self.generation
+        # items failed to pull are still on server
+        if self.failed:
+            q = q & ~model.guid.in_(self.failed)
+        return q
+
+    # **************** Batched Writes ****************
+    #
+    # Every item (note, notebook, tag) is applied in own savepoint,
+    # item failed with ITEM_ERRORS is rolled back alone and sync goes
+    # on. Session is committed every sync_batch_size items or
+    # sync_batch_interval ms. Other errors (server, network, bugs) stop
+    # the sync, finished items are committed before, so pushed items
+    # are not pushed again. Remote create can't be rolled back, guid of
+    # created item is kept when the rest of its savepoint fails.
+    @contextmanager
+    def savepoint(self, guid):
+        """Apply changes of one item in savepoint"""
+        self._created = []
+        self.session.begin_nested()
+        try:
+            yield
+            self.session.commit()
+        except ITEM_ERRORS as e:
+            self.session.rollback()
+            self._keep_created()
+            self.failed.append(guid)
+            self.app.log('Sync of %s failed: %s' % (guid, e))
+        except Exception:
+            self.session.rollback()
+            self._keep_created()
+            self.session.commit()
+            raise
+        else:
+            self._batch_count += 1
+            if self._batch_full():
+                self.commit_batch()
+
+    def created(self, item, guid):
+        """Set guid of item created on server"""
+        item.guid = guid
+        item.action = const.ACTION_NONE
+        self._created.append((item, guid))
+
+    def _keep_created(self):
+        """Set guids of created items again after rollback"""
+        for item, guid in self._created:
+            item.guid = guid
+            item.action = const.ACTION_NONE
+        self._created = []
+
+    def _batch_full(self):
+        """Check batch size or time limit reached"""
+        size = self._get_int_setting(
+            'sync_batch_size', const.DEFAULT_SYNC_BATCH_SIZE,
+        )
+        interval = self._get_int_setting(
+            'sync_batch_interval', const.DEFAULT_SYNC_BATCH_INTERVAL,
+        )
+        return self._batch_count >= size or (
+            (time.time() - self._batch_started) * 1000 >= interval
+        )
+
+    def commit_batch(self):
+        """Commit accumulated changes and checkpoint"""
+        self.session.commit()
+        self._batch_count = 0
+        self._batch_started = time.time()
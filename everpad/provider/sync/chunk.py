@@ -0,0 +1,111 @@
+from evernote.edam.notestore.ttypes import SyncChunkFilter
+from ... import const
+from .base import BaseSync
+from .note import PullNote
+from .notebook import PullNotebook
+from .tag import PullTag
+
+
+# ****** Contains:
+#        PullChunks - incremental sync with getFilteredSyncChunk
+
+
+# *************************************************
+# ****************   Pull Chunks   ****************
+# *************************************************
+class PullChunks(BaseSync):
+    """Pull changes made on server after known USN"""
+
+    def __init__(self, *args, **kwargs):
+        super(PullChunks, self).__init__(*args, **kwargs)
+        self._notebooks = PullNotebook(*args, **kwargs)
+        self._tags = PullTag(*args, **kwargs)
+        self._notes = PullNote(*args, **kwargs)
+
+    # Items failed to apply are received again on next sync,
+    # so usn is not moved after first chunk with failures. Usn of
+    # applied chunks is committed to checkpoint with them.
+    def pull(self, after_usn):
+        """Pull all chunks after usn, return last applied usn"""
+        self.app.log('Pulling sync chunks after USN %d.' % after_usn)
+
+        self._notes.load_identities()
+        with self._notes.fetching():
+            for chunk in self._get_chunks(after_usn):
+                self._apply_chunk(chunk)
+                if not self.failed:
+                    after_usn = chunk.chunkHighUSN or chunk.updateCount
+                    if self.checkpoint:
+                        self.checkpoint.progress(usn=after_usn)
+                self.commit_batch()
+
+        return after_usn
+
+    # **************** Get Chunks ****************
+    #
+    # SyncChunk getFilteredSyncChunk(string authenticationToken,
+    #                                i32 afterUSN,
+    #                                i32 maxEntries,
+    #                                SyncChunkFilter filter)
+    #
+    # If updateCount and chunkHighUSN are identical, that means that this
+    # is the last chunk in the account
+    def _get_chunks(self, after_usn):
+        """Iterate sync chunks"""
+        chunk_filter = SyncChunkFilter(
+            includeNotes=True,
+            includeNoteResources=True,
+            includeNoteAttributes=True,
+            includeNotebooks=True,
+            includeTags=True,
+            includeResources=True,
+            includeExpunged=True,
+        )
+
+        while True:
+            chunk = self.note_store.getFilteredSyncChunk(
+                self.auth_token, after_usn,
+                const.SYNC_CHUNK_MAX_ENTRIES, chunk_filter,
+            )
+            yield chunk
+
+            if (
+                chunk.chunkHighUSN is None
+                or chunk.chunkHighUSN >= chunk.updateCount
+            ):
+                break
+            after_usn = chunk.chunkHighUSN
+
+    # **************** Apply Chunk ****************
+    #
+    # notebooks and tags first, notes refer to them
+    def _apply_chunk(self, chunk):
+        """Apply changes from chunk to local database"""
+        for notebook_ttype in chunk.notebooks or []:
+            with self.savepoint(notebook_ttype.guid):
+                self._notebooks.pull_notebook(notebook_ttype)
+
+        for tag_ttype in chunk.tags or []:
+            with self.savepoint(tag_ttype.guid):
+                self._tags.pull_tag(tag_ttype)
+
+        # notes in trash are removed like expunged ones
+        trashed = []
+        active = []
+        for note_ttype in chunk.notes or []:
+            if note_ttype.active is False or note_ttype.deleted:
+                trashed.append(note_ttype.guid)
+            else:
+                active.append(note_ttype)
+
+        for note_ttype in self._notes.prefetched(active):
+            with self.savepoint(note_ttype.guid):
+                self._notes.pull_note(note_ttype)
+
+        for resource_ttype in chunk.resources or []:
+            with self.savepoint(resource_ttype.guid):
+                self._notes.pull_resource(resource_ttype)
+
+        self._notes.expunge_notes(trashed + (chunk.expungedNotes or []))
+        self._tags.expunge_tags(chunk.expungedTags or [])
+        self._notebooks.expunge_notebooks(chunk.expungedNotebooks or [])
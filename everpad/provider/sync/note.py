@@ -1,19 +1,20 @@
 from ipdb import set_trace as tr
-try:
-    from BeautifulSoup import BeautifulSoup
-except:
-    from bs4 import BeautifulSoup
 from sqlalchemy.orm.exc import NoResultFound
-from everpad.tools import sanitize
-from evernote.edam.error.ttypes import EDAMUserException, EDAMSystemException, EDAMErrorCode
+from evernote.edam.error.ttypes import EDAMUserException
 from evernote.edam.limits import constants as limits
 from evernote.edam.type import ttypes
 from evernote.edam.notestore.ttypes import NoteFilter, NotesMetadataResultSpec
+from contextlib import contextmanager
 from ... import const
-from .. import models
+from .. import models, tools
+from ..enml import html_to_enml
+from ..stream import FileData, download_resource, remove_downloads
 from .base import BaseSync
+from .pool import FetchPool
+from .scheduler import ScheduledStore
 import time
 import binascii
+import os
 
 
 # ****** Note:  BaseSync - Base class for sync - base.py
@@ -39,7 +40,6 @@ class ShareNoteMixin(object):
             )
             note.share_date = share_date or int(time.time() * 1000)
             note.share_status = const.SHARE_SHARED
-            self.session.commit()
         except EDAMUserException as e:
             note.share_status = const.SHARE_NONE
             self.app.log('Sharing note %s failed' % note.title)
@@ -50,7 +50,6 @@ class ShareNoteMixin(object):
         note.share_status = const.SHARE_NONE
         note.share_date = None
         note.share_url = None
-        self.session.commit()
 
 
 # *************************************************
@@ -91,27 +90,33 @@ class PushNote(BaseSync, ShareNoteMixin):
             #                     |- NEED_STOP - _stop_sharing_note
  
             self.app.log('Pushing note "%s" to remote server.' % note.title)
-            
-            note_ttype = self._create_ttype(note)
-            
-            # create note
-            if note.action == const.ACTION_CREATE:
-                self._push_new_note(note, note_ttype)
-            # change note
-            elif note.action == const.ACTION_CHANGE:
-                self._push_changed_note(note, note_ttype)
-            # delete note
-            elif note.action == const.ACTION_DELETE:
-                self._delete_note(note, note_ttype)
-
-            # handle sharing
-            if note.share_status == const.SHARE_NEED_SHARE:
-                self._share_note(note)
-            elif note.share_status == const.SHARE_NEED_STOP:
-                self._stop_sharing_note(note)
+
+            with self.savepoint(note.title):
+                self._push_note(note)
 
         # commit changes to database
-        self.session.commit()
+        self.commit_batch()
+
+    def _push_note(self, note):
+        """Push one note"""
+        note_ttype = self._create_ttype(note)
+
+        # create note
+        if note.action == const.ACTION_CREATE:
+            self._push_new_note(note, note_ttype)
+        # change note
+        elif note.action == const.ACTION_CHANGE:
+            self._push_changed_note(note, note_ttype)
+        # delete note
+        elif note.action == const.ACTION_DELETE:
+            self._delete_note(note, note_ttype)
+            return
+
+        # handle sharing
+        if note.share_status == const.SHARE_NEED_SHARE:
+            self._share_note(note)
+        elif note.share_status == const.SHARE_NEED_STOP:
+            self._stop_sharing_note(note)
 
 
     # **************** Create Note ****************
@@ -142,7 +147,7 @@ class PushNote(BaseSync, ShareNoteMixin):
         return map(
             lambda resource: ttypes.Resource(
                 noteGuid=note.guid,
-                data=ttypes.Data(body=open(resource.file_path).read()),
+                data=FileData(resource.file_path),
                 mime=resource.mime,
                 attributes=ttypes.ResourceAttributes(
                     fileName=resource.file_name.encode('utf8'),
@@ -155,23 +160,7 @@ class PushNote(BaseSync, ShareNoteMixin):
 
     def _prepare_content(self, content):
         """Prepare content"""
-        enml_content = (u"""
-            <!DOCTYPE en-note SYSTEM "http://xml.evernote.com/pub/enml2.dtd">
-            <en-note>{}</en-note>
-        """.format(sanitize(
-            html=content[:limits.EDAM_NOTE_CONTENT_LEN_MAX]
-        ))).strip().encode('utf8')
-        if BeautifulSoup.__module__ == 'bs4':
-            soup = BeautifulSoup(enml_content, 'xml', selfClosingTags=[
-                'img', 'en-todo', 'en-media', 'br', 'hr',
-            ])
-        else:
-            # TODO: maybe possible use the same code that bs4
-            soup = BeautifulSoup(enml_content, selfClosingTags=[
-                'img', 'en-todo', 'en-media', 'br', 'hr',
-            ])
-
-        return str(soup)
+        return html_to_enml(content[:limits.EDAM_NOTE_CONTENT_LEN_MAX])
 
 
     # **************** Push Note ****************
@@ -180,7 +169,7 @@ class PushNote(BaseSync, ShareNoteMixin):
         """Push new note to remote"""
         try:
             note_ttype = self.note_store.createNote(self.auth_token, note_ttype)
-            note.guid = note_ttype.guid
+            self.created(note, note_ttype.guid)
 
         except EDAMUserException as e:
             note.action = const.ACTION_NONE
@@ -196,11 +185,6 @@ class PushNote(BaseSync, ShareNoteMixin):
         """Push changed note to remote"""
         try:
             self.note_store.updateNote(self.auth_token, note_ttype)
-        except EDAMSystemException, e:
-            if e.errorCode == EDAMErrorCode.RATE_LIMIT_REACHED:
-                self.app.log("Rate limit reached: %d seconds" % e.rateLimitDuration)
-                self.sync_state.rate_limit = e.rateLimitDuration
-                self.sync_state.rate_limit_time = datetime.now() + datetime.timedelta(seconds=e.rateLimitDuration)
         except EDAMUserException as e:
             self.app.log('Push changed note "%s" failed.' % note.title)
             self.app.log(note_ttype)
@@ -216,11 +200,6 @@ class PushNote(BaseSync, ShareNoteMixin):
         """Delete note"""
         try:
             self.note_store.deleteNote(self.auth_token, note_ttype.guid)
-        except EDAMSystemException, e:
-            if e.errorCode == EDAMErrorCode.RATE_LIMIT_REACHED:
-                self.app.log("Rate limit reached: %d seconds" % e.rateLimitDuration)
-                self.sync_state.rate_limit = e.rateLimitDuration
-                self.sync_state.rate_limit_time = datetime.now() + datetime.timedelta(seconds=e.rateLimitDuration)
         except EDAMUserException as e:
             self.app.log('Note %s already removed' % note.title)
             self.app.log(e)
@@ -236,83 +215,322 @@ class PullNote(BaseSync, ShareNoteMixin):
 
     def __init__(self, *args, **kwargs):
         super(PullNote, self).__init__(*args, **kwargs)
-        self._exists = []
+        self._bodies = {}
+        self._data_path = os.path.expanduser(const.DATA_PATH)
+        self._identities = models.IdentityCache(self.session)
+        # without fetching() notes are downloaded on demand
+        self._pool = FetchPool(1, None, self.note_store, self._log)
 
-    def pull(self):
-        """Pull notes from remote server"""
+    def pull(self, offset=0, updated=None):
+        """Pull notes from remote server, starting at offset, resumed
+        pull starts before note with updated time of checkpoint"""
 
         # okay, so _get_all_notes uses a generator to yield each note
         # one at a time - great leap for a python dummy such as myself
         # _get_all_notes using findNotesMetadata returns NotesMetadataList
-        for note_meta_ttype in self._get_all_notes():
-            
-            # If no title returns "Untitled note"
-            self.app.log(
-                'Pulling note "%s" from remote server.' % note_meta_ttype.title)
-         
-            # note_ttype is a NotesMetadataList -> NoteMetadata (notes)
-            # structure of the note
-            
-            # @@@@ the resource grab/update is going to have to happen in
-            #  _create_note  _update_note          
-            
-            
-            # Pull sequence:
-            #  
-            # _update_note  
-            #    |
-            #    |- note guid in database? 
-            #        | No          | Yes                               
-            #        |             |
-            #        |             server note         
-            #   _create_note       newer
-            #        |             |----- Yes --- _get_full_note
-            #        |             |                 |
-            #   _get_full_note     |              local note
-            #                      |         ---- also changed
-            #                      |         |            |
-            #                      |         | Yes        | No
-            #                      return    |            |
-            #                                |            |
-            #                                |         from_api
-            #                          _create_conflict
-            #
-            
+        # full notes are downloaded by the pool ahead of this loop
+        # resumed pull keeps generation of interrupted one, notes pulled
+        # before resume are marked with it, so stale notes are removed
+        generation = self.checkpoint and self.checkpoint.generation
+        if offset and generation:
+            self.generation = generation
+        else:
+            self.start_generation(models.Note)
+            if self.checkpoint and not offset:
+                self.checkpoint.progress(generation=self.generation)
+        self.load_identities()
+        offset = self._get_resume_offset(offset, updated)
+        with self.fetching():
+            for position, note_meta_ttype in enumerate(
+                self.prefetched(self._get_all_notes(offset)), offset + 1,
+            ):
+                with self.savepoint(note_meta_ttype.guid):
+                    note = self.pull_note(note_meta_ttype)
+
+                    # At this point note is the note as defind in models.py
+                    note.sync_generation = self.generation
+
+                # committed with next batch, so resumed pull starts
+                # after notes already in database
+                if self.checkpoint:
+                    self.checkpoint.progress(
+                        offset=position, updated=note_meta_ttype.updated,
+                    )
+
+        #@@@@ end of for note_meta_ttype in self._get_all_note        
+        
+        # commit to local database
+        self.commit_batch()
+
+        # remove unused notes, notes pulled before resume without
+        # generation in checkpoint are not known here
+        if offset and not generation:
+            self.app.log('Resumed pull, removing notes skipped.')
+        else:
+            self._remove_notes()
+
+
+    # **************** Pull One Note ****************
+    #
+    # Used by pull() and by the incremental sync (chunk.py), note_meta_ttype
+    # is NoteMetadata from findNotesMetadata or Note from a sync chunk
+    def pull_note(self, note_meta_ttype):
+        """Create or update local note from metadata"""
+
+        # If no title returns "Untitled note"
+        self.app.log(
+            'Pulling note "%s" from remote server.' % note_meta_ttype.title)
+
+        # Pull sequence:
+        #
+        # _update_note
+        #    |
+        #    |- note guid in database?
+        #        | No          | Yes
+        #        |             |
+        #        |             server note
+        #   _create_note       newer
+        #        |             |----- Yes --- _get_full_note
+        #        |             |                 |
+        #   _get_full_note     |              local note
+        #                      |         ---- also changed
+        #                      |         |            |
+        #                      |         | Yes        | No
+        #                      return    |            |
+        #                                |            |
+        #                                |         from_api
+        #                          _create_conflict
+        #
+        try:
             try:
                 note, note_full_ttype = self._update_note(note_meta_ttype)
             except NoResultFound:
                 note, note_full_ttype = self._create_note(note_meta_ttype)
 
-            
-            # At this point note is the note as defind in models.py
-            self._exists.append(note.id)
-            
             # NotesMetadataList - includeAttributes
             # set or unset sharing
             self._check_sharing_information(note, note_meta_ttype)
-            	            
+
             # Here is where we get the resources
-            resource_ids = self._receive_resources(note, note_meta_ttype, note_full_ttype)
-            
-            if resource_ids:
-                 self._remove_resources(note, resource_ids)
+            resource_ids = self._receive_resources(
+                note, note_meta_ttype, note_full_ttype)
 
-        #@@@@ end of for note_meta_ttype in self._get_all_note        
-        
-        # commit to local database
-        self.session.commit()
+            if resource_ids is not None:
+                self._remove_resources(note, resource_ids)
+
+            self._set_coordinates(note, note_meta_ttype)
+        finally:
+            self._pool.forget(note_meta_ttype.guid)
+            self._remove_bodies(self._bodies)
+            self._bodies = {}
+        return note
+
+    # Coordinates come with metadata of every pulled note, changed or
+    # not, notes with them and without place are geocoded by SyncThread
+    def _set_coordinates(self, note, note_meta_ttype):
+        """Keep coordinates of note"""
+        attributes = getattr(note_meta_ttype, 'attributes', None)
+        if attributes:
+            coordinates = (attributes.latitude, attributes.longitude)
+        else:
+            coordinates = (None, None)
+        # unchanged note isn't made dirty, so it isn't reindexed
+        if (note.latitude, note.longitude) != coordinates:
+            note.latitude, note.longitude = coordinates
+
+    def load_identities(self):
+        """Cache notebooks, tags and places for notes"""
+        self._identities.load()
+
+    def _remove_bodies(self, bodies):
+        """Remove downloaded and not used resource bodies"""
+        for path in bodies.values():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+    # **************** Fetch Pool ****************
+    #
+    # Full notes and resource bodies are downloaded by workers
+    # with own note store clients, this thread only writes them
+    # to database in order. Workers count is sync_workers setting.
+    @contextmanager
+    def fetching(self):
+        """Download notes with worker pool"""
+        # bodies left by interrupted sync
+        remove_downloads(self._data_path)
+        inline_pool = self._pool
+        self._pool = FetchPool(
+            self._get_workers_count(),
+            self._create_note_store, self.note_store, self._log,
+        )
+        try:
+            yield
+        finally:
+            self._pool.close()
+            self._pool = inline_pool
+
+    def _create_note_store(self):
+        """Create note store for worker, sharing call budget"""
+        # url of sync note store, workers don't make unscheduled
+        # getNoteStoreUrl calls
+        note_store = tools.get_note_store(
+            self.auth_token, self.note_store.url,
+        )
+        if isinstance(self.note_store, ScheduledStore):
+            return ScheduledStore(note_store, self.note_store.scheduler)
+        return note_store
+
+    def _log(self, data):
+        """Log from pool"""
+        self.app.log(data)
+
+    def prefetched(self, note_meta_ttypes):
+        """Iterate notes metadata, downloading ahead"""
+        return self._pool.prefetched(note_meta_ttypes, self._prefetch_note)
+
+    def _get_workers_count(self):
+        """Get download workers count"""
+        return self._get_int_setting(
+            'sync_workers', const.DEFAULT_SYNC_WORKERS,
+        )
+
+    def _prefetch_note(self, note_meta_ttype):
+        """Schedule full note download when pull_note will need it"""
+        local = self.session.query(
+            models.Note.id, models.Note.updated,
+        ).filter(models.Note.guid == note_meta_ttype.guid).first()
+        if (
+            local is None or local.updated < note_meta_ttype.updated
+            or (
+                not hasattr(note_meta_ttype, 'resources')
+                and self._resources_missing(local.id, note_meta_ttype)
+            )
+        ):
+            self._pool.submit(
+                note_meta_ttype.guid, self._fetch_job(note_meta_ttype),
+            )
+
+    # Content is downloaded only when contentHash differs from the local
+    # one. Note from sync chunk already has hash, for NoteMetadata hash is
+    # received with getNote without content, different contentLength
+    # means changed content without asking for hash.
+    def _fetch_job(self, note_meta_ttype):
+        """Create job downloading note and unknown resource bodies"""
+        guid = note_meta_ttype.guid
+        local = self.session.query(
+            models.Note.contentHash, models.Note.contentLength,
+            models.Note.action,
+        ).filter(models.Note.guid == guid).first()
+        known = set(self.session.query(
+            models.Resource.guid, models.Resource.hash,
+        ).filter(
+            (models.Resource.note_id == models.Note.id)
+            & (models.Note.guid == guid)
+        ).all())
+
+        # conflict note needs server content
+        if local is None or not local.contentHash or (
+            local.action == const.ACTION_CHANGE
+        ):
+            need_content = True
+            local_hash = None
+        else:
+            local_hash = local.contentHash
+            meta_length = getattr(note_meta_ttype, 'contentLength', None)
+            need_content = (
+                meta_length is not None
+                and meta_length != local.contentLength
+            )
+        meta_hash = getattr(note_meta_ttype, 'contentHash', None)
+
+        def fetch(note_store):
+            # Types.Note getNote(string authenticationToken,
+            #           Types.Guid guid,
+            #           bool withContent,
+            #           bool withResourcesData,
+            #           bool withResourcesRecognition,
+            #           bool withResourcesAlternateData)
+            if meta_hash:
+                note_full_ttype = note_meta_ttype
+            else:
+                note_full_ttype = note_store.getNote(
+                    self.auth_token, guid, need_content, False, False, False,
+                )
+
+            if note_full_ttype.content is None and (
+                need_content or binascii.b2a_hex(
+                    note_full_ttype.contentHash or '',
+                ) != local_hash
+            ):
+                note_full_ttype.content = note_store.getNoteContent(
+                    self.auth_token, guid,
+                )
 
-        # remove unused notes
-        self._remove_notes()
+            # bodies are paths of downloaded temp files
+            bodies = {}
+            try:
+                for resource_ttype in note_full_ttype.resources or []:
+                    body_hash = binascii.b2a_hex(
+                        resource_ttype.data.bodyHash,
+                    )
+                    if (resource_ttype.guid, body_hash) not in known:
+                        bodies[resource_ttype.guid] = download_resource(
+                            note_store, self.auth_token,
+                            resource_ttype.guid, body_hash, self._data_path,
+                        )
+            except:
+                self._remove_bodies(bodies)
+                raise
+            return note_full_ttype, bodies
+
+        return fetch
+
+
+    # **************** Expunge Notes ****************
+    #
+    # Remove notes expunged (or moved to trash) on server,
+    # notes with local changes are kept
+    def expunge_notes(self, guids):
+        """Remove notes expunged on server"""
+        if not guids:
+            return
+
+        self.session.query(models.Note).filter(
+            models.Note.guid.in_(guids)
+            & ~models.Note.action.in_((
+                const.ACTION_NOEXSIST, const.ACTION_CREATE,
+                const.ACTION_CHANGE, const.ACTION_CONFLICT,
+            ))
+        ).delete(synchronize_session='fetch')
+
+
+    # **************** Pull One Resource ****************
+    #
+    # Resource changed on server without note change (sync chunk)
+    def pull_resource(self, resource_ttype):
+        """Update local resource from ttype"""
+        try:
+            resource = self.session.query(models.Resource).filter(
+                models.Resource.guid == resource_ttype.guid,
+            ).one()
+        except NoResultFound:
+            # new resources are received with their notes
+            return
+
+        if resource.hash != binascii.b2a_hex(resource_ttype.data.bodyHash):
+            resource.from_api(resource_ttype)
+            self._get_resource_data(resource)
 
 
     # **************** Get All Notes ****************
     #
-    def _get_all_notes(self):
-        """Iterate all notes"""
+    def _get_all_notes(self, offset=0):
+        """Iterate all notes from offset"""
         
-        self.app.log("get_all_notes")
-        offset = 0
+        self.app.log("get_all_notes from %d" % offset)
 
         # Function: NoteStore.findNotes - DEPRECATED. Use findNotesMetadata
         # NotesMetadataList findNotesMetadata(string authenticationToken,
@@ -326,33 +544,12 @@ class PullNote(BaseSync, ShareNoteMixin):
         # From 0 (offset) to EDAM_USER_NOTES_MAX - return NotesMetadataList
         #
 
+        # rate limit stops pull, without the rest of notes not
+        # received ones would be removed
         while True:
-            try:
-                note_list = self.note_store.findNotesMetadata(
-                    self.auth_token, 
-                    NoteFilter(
-                        order=ttypes.NoteSortOrder.UPDATED,
-                        ascending=False,
-                    ), 
-                    offset, 
-                    limits.EDAM_USER_NOTES_MAX,
-                    NotesMetadataResultSpec(
-                        includeTitle=True,
-                        includeCreated = True,
-                        includeUpdated=True,
-                        includeDeleted=True,
-                        includeAttributes=True,
-                        includeLargestResourceSize=True,
-                    )
-                )
-            # if a rate limit happens because of findNotesMetadata
-            except EDAMSystemException, e:
-                if e.errorCode == EDAMErrorCode.RATE_LIMIT_REACHED:
-                    self.app.log(
-                        "Rate limit in _get_all_notes: %d minutes" % 
-                            (e.rateLimitDuration/60)
-                    )
-                    break
+            note_list = self._find_notes_metadata(
+                offset, limits.EDAM_USER_NOTES_MAX,
+            )
 
             # https://www.jeffknupp.com/blog/2013/04/07/
             #       improve-your-python-yield-and-generators-explained/
@@ -382,34 +579,59 @@ class PullNote(BaseSync, ShareNoteMixin):
         # #################  end while True  ################# 
 
 
+    # **************** Find Notes Metadata ****************
+    #
+    # Notes ordered by updated time, recently updated first
+    def _find_notes_metadata(self, offset, max_notes):
+        """Get NotesMetadataList from offset"""
+        return self.note_store.findNotesMetadata(
+            self.auth_token, 
+            NoteFilter(
+                order=ttypes.NoteSortOrder.UPDATED,
+                ascending=False,
+            ), 
+            offset, 
+            max_notes,
+            NotesMetadataResultSpec(
+                includeTitle=True,
+                includeContentLength=True,
+                includeCreated = True,
+                includeUpdated=True,
+                includeNotebookGuid=True,
+                includeTagGuids=True,
+                includeDeleted=True,
+                includeAttributes=True,
+                includeLargestResourceSize=True,
+            )
+        )
+
+
+    # **************** Resume Offset ****************
+    #
+    # Notes expunged or moved on server before the checkpoint shift the
+    # rest to lower offsets, so the overlap alone can skip notes. Offset
+    # is moved back until the note at it is updated later than the last
+    # pulled one, all notes not pulled yet are after it. Ties of updated
+    # time are pulled again.
+    def _get_resume_offset(self, offset, updated):
+        """Get offset before last pulled note"""
+        while offset and updated is not None:
+            notes = self._find_notes_metadata(offset, 1).notes
+            if notes and notes[0].updated > updated:
+                break
+            offset = max(offset - const.CHECKPOINT_OVERLAP, 0)
+        return offset
+
+
     # **************** Get Full Note ****************
     #
-    # Get the note data from API and return it
+    # Get the note data from fetch pool and return it, note without
+    # scheduled download is downloaded now
     def _get_full_note(self, note_ttype):
         """Get full note"""
-        
-        # Types.Note getNote(string authenticationToken,
-        #           Types.Guid guid,
-        #           bool withContent,
-        #           bool withResourcesData,
-        #           bool withResourcesRecognition,
-        #           bool withResourcesAlternateData)
-        # NOTE!!! service will include the meta-data for each 
-        # resource in the note, but the binary contents of the resources 
-        # and their recognition data will be omitted
-        try:
-            note_full_ttype = self.note_store.getNote(
-                self.auth_token, note_ttype.guid,
-                True, True, True, True,
-            )
-        except EDAMSystemException, e:
-            if e.errorCode == EDAMErrorCode.RATE_LIMIT_REACHED:
-                self.app.log(
-                    "Rate limit _get_full_note: %d minutes" % 
-                        (e.rateLimitDuration/60)
-                )
-                self.sync_state.rate_limit = e.rateLimitDuration        
-        
+        self._pool.submit(note_ttype.guid, self._fetch_job(note_ttype))
+        note_full_ttype, bodies = self._pool.result(note_ttype.guid)
+        self._bodies.update(bodies)
         return note_full_ttype
 
 
@@ -425,21 +647,17 @@ class PullNote(BaseSync, ShareNoteMixin):
         # string getResourceData(
         #         string authenticationToken,
         #         Types.Guid guid)
-        
-        try:
-            data_body = self.note_store.getResourceData(
-                self.auth_token, resource.guid)
-        except EDAMSystemException, e:
-            if e.errorCode == EDAMErrorCode.RATE_LIMIT_REACHED:
-                self.app.log(
-                    "Rate limit _get_resource_data: %d minutes" % 
-                        (e.rateLimitDuration/60)
-                )
-                self.sync_state.rate_limit = e.rateLimitDuration
-                return
 
-        with open(resource.file_path, 'w') as data:
-            data.write(data_body)
+        # already downloaded by fetch pool
+        path = self._bodies.pop(resource.guid, None)
+        if path is None:
+            path = download_resource(
+                self.note_store, self.auth_token, resource.guid,
+                resource.hash, self._data_path,
+            )
+
+        # body is streamed to temp file and replaces resource at once
+        os.rename(path, resource.file_path)
             
 
     # **************** Create Note ****************
@@ -467,12 +685,13 @@ class PullNote(BaseSync, ShareNoteMixin):
         #    ... create Note ORM with guid
         note = models.Note(guid=note_full_ttype.guid)
         #    ... add other note information
-        note.from_api(note_full_ttype, self.session)
+        note.from_api(
+            note_full_ttype, self.session, self._identities,
+        )
         
-        # ... commit note data
+        # ... add note data, id is needed for resources
         self.session.add(note)
-        
-        self.session.commit()
+        self.session.flush()
        
         # Is note the models.py version at this point?
         # why yes it is - confused yet?
@@ -513,7 +732,9 @@ class PullNote(BaseSync, ShareNoteMixin):
                 self._create_conflict(note, note_full_ttype)
             else:
                 # else update database with new sever note
-                note.from_api(note_full_ttype, self.session)
+                note.from_api(
+                    note_full_ttype, self.session, self._identities,
+                )
         
         else:
             # okay, hope this works.  If no update or conflict then,
@@ -536,7 +757,9 @@ class PullNote(BaseSync, ShareNoteMixin):
         # generate a new local note and populate it with
         # server note data
         conflict_note = models.Note()
-        conflict_note.from_api(note_full_ttype, self.session)
+        conflict_note.from_api(
+            note_full_ttype, self.session, self._identities,
+        )
         
         # set the conflict note guid as empty string
         conflict_note.guid = ''
@@ -545,24 +768,17 @@ class PullNote(BaseSync, ShareNoteMixin):
         # relate the conflict and local note for reference
         conflict_note.conflict_parent_id = note.id
         
-        # commit to database
+        # add to database
         self.session.add(conflict_note)
-        self.session.commit()
 
     
     # **************** Remove Note ****************
     def _remove_notes(self):
         """Remove not exists notes"""
-        if self._exists:
-            q = ((~models.Note.id.in_(self._exists) |
-                ~models.Note.conflict_parent_id.in_(self._exists)) &
-                ~models.Note.action.in_((
-                    const.ACTION_NOEXSIST, const.ACTION_CREATE,
-                    const.ACTION_CHANGE, const.ACTION_CONFLICT)))
-        else:
-            q = (~models.Note.action.in_((
-                    const.ACTION_NOEXSIST, const.ACTION_CREATE,
-                    const.ACTION_CHANGE, const.ACTION_CONFLICT)))
+        q = (self.stale(models.Note) &
+            ~models.Note.action.in_((
+                const.ACTION_NOEXSIST, const.ACTION_CREATE,
+                const.ACTION_CHANGE, const.ACTION_CONFLICT)))
         self.session.query(models.Note).filter(q).delete(
             synchronize_session='fetch')
         self.session.commit()
@@ -573,27 +789,37 @@ class PullNote(BaseSync, ShareNoteMixin):
     # note is the note as defind in models.py
     # note_ttype == Types.Note
     def _receive_resources(self, note, note_meta_ttype, note_full_ttype):
-        """Receive note resources"""
+        """Receive note resources, return None when nothing changed"""
+
+        resource_ttypes = self._get_resource_ttypes(
+            note, note_meta_ttype, note_full_ttype)
+        if resource_ttypes is None:
+            return None
+
+        # compare (guid, bodyHash) pairs with local resources,
+        # same set means nothing to download or remove
+        local_hashes = dict(self.session.query(
+            models.Resource.guid, models.Resource.hash,
+        ).filter(models.Resource.note_id == note.id).all())
+        remote_hashes = dict(
+            (resource_ttype.guid, binascii.b2a_hex(
+                resource_ttype.data.bodyHash,
+            )) for resource_ttype in resource_ttypes
+        )
+        if remote_hashes == local_hashes:
+            return None
 
-        # empty resource id list        
+        # empty resource id list
         resources_ids = []
-        
-        # !!!!! need work here        
-        if note_meta_ttype.largestResourceSize or note_full_ttype == None:
-            # get full note
-            note_full_ttype = self._get_full_note(note_meta_ttype)
 
-        # Update note resources in database and download or delete
-        # actual binary data?  See resource.from_api in models.py
-        
         # try: looks in database for the resource guid, if
-        # not found fall though to except.  If in the database, append to the 
+        # not found fall though to except.  If in the database, append to the
         # list and check hash to verify the existing resource.  If the resource
-        # has changed then update database --- !!! I also need to download it again !!!!
-        # The except handles resources that do not exist.  
-        for resource_ttype in note_full_ttype.resources or []:
+        # has changed then update database and download it again.
+        # The except handles resources that do not exist.
+        for resource_ttype in resource_ttypes:
             try:
-                # Is the resource in the database? If not then except NoResultFound  
+                # Is the resource in the database? If not then except NoResultFound
                 resource = self.session.query(models.Resource).filter(
                     models.Resource.guid == resource_ttype.guid,
                 ).one()
@@ -603,15 +829,10 @@ class PullNote(BaseSync, ShareNoteMixin):
 
                 # if resource changed (hash does not match) then
                 # re-get resource
-                if resource.hash != binascii.b2a_hex(
-                    resource_ttype.data.bodyHash,
-                ):
+                if resource.hash != remote_hashes[resource_ttype.guid]:
                     resource.from_api(resource_ttype)
                     self._get_resource_data(resource)
-                    #@@@@ do I need session.commit() here????
-                    # I put it here for now
-                    self.session.commit()
-                    
+
             # resourse not found in database then:
             except NoResultFound:
                 # Make new database entry and get resource
@@ -621,23 +842,49 @@ class PullNote(BaseSync, ShareNoteMixin):
                 )
                 resource.from_api(resource_ttype)
                 self._get_resource_data(resource)
-                
+
                 self.session.add(resource)
-                self.session.commit()
+                self.session.flush()
                 resources_ids.append(resource.id)
 
         return resources_ids
 
-    
+    # Resources metadata (guid and bodyHash) comes with already downloaded
+    # full note or with Note from sync chunk. NoteMetadata has only
+    # largestResourceSize, unchanged note is downloaded only when its
+    # resources never reached local database.
+    def _get_resource_ttypes(self, note, note_meta_ttype, note_full_ttype):
+        """Get remote resources list, None when unknown and unchanged"""
+        if note_full_ttype is not None:
+            return note_full_ttype.resources or []
+
+        if hasattr(note_meta_ttype, 'resources'):
+            return note_meta_ttype.resources or []
+
+        if self._resources_missing(note.id, note_meta_ttype):
+            return self._get_full_note(note_meta_ttype).resources or []
+
+        return None
+
+    def _resources_missing(self, note_id, note_meta_ttype):
+        """Check note has remote resources but no local ones"""
+        return bool(
+            getattr(note_meta_ttype, 'largestResourceSize', None)
+        ) and not self.session.query(models.Resource.id).filter(
+            models.Resource.note_id == note_id,
+        ).first()
+
+
     # **************** Remove Resource ****************
     #
     def _remove_resources(self, note, resources_ids):
         """Remove non exists resources"""
-        self.session.query(models.Resource).filter(
-            ~models.Resource.id.in_(resources_ids)
-            & (models.Resource.note_id == note.id)
-        ).delete(synchronize_session='fetch')
-        self.session.commit()
+        query = self.session.query(models.Resource).filter(
+            models.Resource.note_id == note.id,
+        )
+        if resources_ids:
+            query = query.filter(~models.Resource.id.in_(resources_ids))
+        query.delete(synchronize_session='fetch')
 
     
     # **************** Check Sharing Info ****************
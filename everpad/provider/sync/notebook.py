@@ -29,19 +29,20 @@ class PushNotebook(BaseSync):
             self.app.log(
                 'Pushing notebook "%s" to remote server.' % notebook.name)
 
-            try:
-                notebook_ttype = self._create_ttype(notebook)
-            except TTypeValidationFailed:
-                self.app.log('notebook %s skipped' % notebook.name)
-                notebook.action = const.ACTION_NONE
-                continue
-
-            if notebook.action == const.ACTION_CREATE:
-                self._push_new_notebook(notebook, notebook_ttype)
-            elif notebook.action == const.ACTION_CHANGE:
-                self._push_changed_notebook(notebook, notebook_ttype)
-
-        self.session.commit()
+            with self.savepoint(notebook.name):
+                try:
+                    notebook_ttype = self._create_ttype(notebook)
+                except TTypeValidationFailed:
+                    self.app.log('notebook %s skipped' % notebook.name)
+                    notebook.action = const.ACTION_NONE
+                    continue
+
+                if notebook.action == const.ACTION_CREATE:
+                    self._push_new_notebook(notebook, notebook_ttype)
+                elif notebook.action == const.ACTION_CHANGE:
+                    self._push_changed_notebook(notebook, notebook_ttype)
+
+        self.commit_batch()
         self._merge_duplicates()
 
     def _create_ttype(self, notebook):
@@ -72,8 +73,7 @@ class PushNotebook(BaseSync):
             notebook_ttype = self.note_store.createNotebook(
                 self.auth_token, notebook_ttype,
             )
-            notebook.guid = notebook_ttype.guid
-            notebook.action = const.ACTION_NONE
+            self.created(notebook, notebook_ttype.guid)
         except EDAMUserException:
             notebook.action = const.ACTION_DUPLICATE
             self.app.log('Duplicate %s' % notebook_ttype.name)
@@ -119,32 +119,53 @@ class PushNotebook(BaseSync):
 class PullNotebook(BaseSync):
     """Pull notebook from server"""
 
-    def __init__(self, *args, **kwargs):
-        super(PullNotebook, self).__init__(*args, **kwargs)
-        self._exists = []
-
     def pull(self):
         """Receive notebooks from server"""
         
+        self.start_generation(models.Notebook)
+
         # request and return all notebooks in Notebook structure
         for notebook_ttype in self.note_store.listNotebooks(self.auth_token):
-            self.app.log(
-                'Pulling notebook "%s" from remote server.' % notebook_ttype.name)
-            
-            try:
-                notebook = self._update_notebook(notebook_ttype)
-            except NoResultFound:
-                notebook = self._create_notebook(notebook_ttype)
-            
-            self._exists.append(notebook.id)
+            with self.savepoint(notebook_ttype.guid):
+                notebook = self.pull_notebook(notebook_ttype)
+                notebook.sync_generation = self.generation
 
         # commit local changes
-        self.session.commit()
+        self.commit_batch()
         
         # remove unneeded from database
         self._remove_notebooks()
 
 
+    # ************** Pull One Notebook **************
+    #
+    # Used by pull() and by the incremental sync (chunk.py)
+    def pull_notebook(self, notebook_ttype):
+        """Create or update local notebook from ttype"""
+        self.app.log(
+            'Pulling notebook "%s" from remote server.' % notebook_ttype.name)
+
+        try:
+            return self._update_notebook(notebook_ttype)
+        except NoResultFound:
+            return self._create_notebook(notebook_ttype)
+
+
+    # ************** Expunge Notebooks **************
+    #
+    # Remove notebooks expunged on server, local changes are kept
+    def expunge_notebooks(self, guids):
+        """Remove notebooks expunged on server"""
+        if not guids:
+            return
+
+        self.session.query(models.Notebook).filter(
+            models.Notebook.guid.in_(guids)
+            & (models.Notebook.action != const.ACTION_CREATE)
+            & (models.Notebook.action != const.ACTION_CHANGE)
+        ).delete(synchronize_session='fetch')
+
+
     # ************** Update Notebook **************
     #
     def _update_notebook(self, notebook_ttype):
@@ -174,9 +195,9 @@ class PullNotebook(BaseSync):
         # fill in values 
         notebook.from_api(notebook_ttype)
         
-        # add/commit to local database
+        # add to local database, id is needed by caller
         self.session.add(notebook)
-        self.session.commit()
+        self.session.flush()
         
         # done
         return notebook
@@ -186,13 +207,9 @@ class PullNotebook(BaseSync):
     #
     def _remove_notebooks(self):
         """Remove not received notebooks"""
-        if self._exists:
-            q = (~models.Notebook.id.in_(self._exists)
-                & (models.Notebook.action != const.ACTION_CREATE)
-                & (models.Notebook.action != const.ACTION_CHANGE))
-        else:
-            q = ((models.Notebook.action != const.ACTION_CREATE)
-                & (models.Notebook.action != const.ACTION_CHANGE))
+        q = (self.stale(models.Notebook)
+            & (models.Notebook.action != const.ACTION_CREATE)
+            & (models.Notebook.action != const.ACTION_CHANGE))
 
         self.session.query(models.Notebook).filter(
             q).delete(synchronize_session='fetch')
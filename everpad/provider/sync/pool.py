@@ -0,0 +1,114 @@
+from collections import deque
+from Queue import Queue
+import threading
+
+
+# ****** Contains:
+#        FetchPool - bounded pool of download workers used by PullNote
+
+
+class _Job(object):
+    """Job with result slot"""
+
+    def __init__(self, fnc):
+        self.fnc = fnc
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# *************************************************
+# ****************   Fetch Pool    ****************
+# *************************************************
+class FetchPool(object):
+    """Download pool, each worker has own note store client.
+
+    Jobs are callables receiving note store, results are taken
+    in any order by the single writer (sync thread). Rate limits
+    are handled by scheduler of note store clients."""
+
+    def __init__(self, size, client_factory, note_store, log):
+        self.size = max(size, 1)
+        self.window = self.size * 2
+        self._log = log
+        self._jobs = {}
+        self._queue = Queue()
+        self._workers = []
+        self._inline_store = note_store
+
+        # one worker means fetching on demand in sync thread
+        if self.size > 1:
+            for _ in range(self.size):
+                worker = threading.Thread(
+                    target=self._work, args=(client_factory,),
+                )
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, key, fnc):
+        """Schedule fetching"""
+        if key in self._jobs:
+            return
+        job = _Job(fnc)
+        self._jobs[key] = job
+        if self._workers:
+            self._queue.put(job)
+
+    def result(self, key):
+        """Wait for result, return None when not submitted"""
+        job = self._jobs.get(key)
+        if not job:
+            return None
+        if not self._workers and not job.done.is_set():
+            self._run(job, self._inline_store)
+        job.done.wait()
+        if job.error:
+            raise job.error
+        return job.result
+
+    def forget(self, key):
+        """Drop result"""
+        self._jobs.pop(key, None)
+
+    def prefetched(self, items, prefetch):
+        """Iterate items in order, prefetching ahead of consumer"""
+        pending = deque()
+        for item in items:
+            prefetch(item)
+            pending.append(item)
+            if len(pending) > self.window:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+    def close(self):
+        """Stop workers"""
+        for _ in self._workers:
+            self._queue.put(None)
+        self._workers = []
+        self._jobs = {}
+
+    def _work(self, client_factory):
+        """Worker loop"""
+        note_store = None
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            if note_store is None:
+                try:
+                    note_store = client_factory()
+                except Exception as e:
+                    job.error = e
+                    job.done.set()
+                    continue
+            self._run(job, note_store)
+
+    def _run(self, job, note_store):
+        """Run job"""
+        try:
+            job.result = job.fnc(note_store)
+        except Exception as e:
+            job.error = e
+        job.done.set()
@@ -0,0 +1,127 @@
+from evernote.edam.error.ttypes import EDAMSystemException, EDAMErrorCode
+from functools import partial
+import threading
+import time
+
+
+# ****** Contains:
+#        Scheduler - token bucket for evernote api calls
+#        ScheduledStore - note or user store calling through scheduler
+#
+# Evernote limits calls per api key and user in an hour window,
+# exceeding it blocks the account till the end of rateLimitDuration:
+# http://dev.evernote.com/doc/articles/rate_limits.php
+#
+# Calls are spread to calls_per_hour, up to burst calls are made
+# without waiting. When the server still answers RATE_LIMIT_REACHED
+# the window is waited in place if it's shorter than max_wait, else
+# calls fail immediately with the same exception till it ends, sync
+# stops keeping committed batches.
+
+
+def _rate_limit_reached(duration):
+    """Create exception server raises on rate limit"""
+    return EDAMSystemException(
+        errorCode=EDAMErrorCode.RATE_LIMIT_REACHED,
+        rateLimitDuration=int(duration),
+    )
+
+
+# *************************************************
+# ****************    Scheduler    ****************
+# *************************************************
+class Scheduler(object):
+    """Token bucket shared by sync thread and fetch pool workers"""
+
+    def __init__(
+        self, calls_per_hour, burst, max_wait, resume_at=0,
+        clock=time.time, sleep=time.sleep,
+    ):
+        self.max_wait = max_wait
+        self.resume_at = resume_at
+        self.calls = 0
+        self.waited = 0
+        self.limits = 0
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._updated = clock()
+        self.set_rate(calls_per_hour, burst)
+        self._tokens = self.burst
+
+    def set_rate(self, calls_per_hour, burst):
+        """Change call budget"""
+        with self._lock:
+            self.rate = max(calls_per_hour, 1) / 3600.0
+            self.burst = max(burst, 1)
+
+    def _refill(self, now):
+        """Add tokens for time passed"""
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated) * self.rate,
+        )
+        self._updated = now
+
+    def acquire(self):
+        """Wait for call budget, raise when rate limited for long"""
+        with self._lock:
+            now = self._clock()
+            window = self.resume_at - now
+            if window > self.max_wait:
+                raise _rate_limit_reached(window)
+            self._refill(now)
+            # token is reserved at once, so concurrent callers
+            # queue one after another
+            self._tokens -= 1
+            delay = max(-self._tokens / self.rate, window, 0)
+            self.calls += 1
+            self.waited += delay
+        if delay > 0:
+            self._sleep(delay)
+
+    def rate_limited(self, duration):
+        """Start rate limit window, calls are spread after it"""
+        with self._lock:
+            now = self._clock()
+            self.resume_at = max(self.resume_at, now + duration)
+            self.limits += 1
+            self._refill(now)
+            self._tokens = min(self._tokens, 0)
+
+    def remaining(self):
+        """Get seconds till end of rate limit window"""
+        return max(self.resume_at - self._clock(), 0)
+
+    def call(self, method, *args, **kwargs):
+        """Call api method within budget"""
+        while True:
+            self.acquire()
+            try:
+                return method(*args, **kwargs)
+            except EDAMSystemException as e:
+                if e.errorCode != EDAMErrorCode.RATE_LIMIT_REACHED:
+                    raise
+                self.rate_limited(e.rateLimitDuration)
+
+    def stats(self):
+        """Get counters of calls, seconds waited and rate limits"""
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'waited': self.waited,
+                'limits': self.limits,
+            }
+
+
+class ScheduledStore(object):
+    """Store with api calls going through scheduler"""
+
+    def __init__(self, store, scheduler):
+        self.store = store
+        self.scheduler = scheduler
+
+    def __getattr__(self, name):
+        attr = getattr(self.store, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        return partial(self.scheduler.call, attr)
@@ -22,19 +22,20 @@ class PushTag(BaseSync):
         ):
             self.app.log('Pushing tag "%s" to remote server.' % tag.name)
 
-            try:
-                tag_ttype = self._create_ttype(tag)
-            except TTypeValidationFailed:
-                tag.action = const.ACTION_NONE
-                self.app.log('tag %s skipped' % tag.name)
-                continue
+            with self.savepoint(tag.name):
+                try:
+                    tag_ttype = self._create_ttype(tag)
+                except TTypeValidationFailed:
+                    tag.action = const.ACTION_NONE
+                    self.app.log('tag %s skipped' % tag.name)
+                    continue
 
-            if tag.action == const.ACTION_CREATE:
-                self._push_new_tag(tag, tag_ttype)
-            elif tag.action == const.ACTION_CHANGE:
-                self._push_changed_tag(tag, tag_ttype)
+                if tag.action == const.ACTION_CREATE:
+                    self._push_new_tag(tag, tag_ttype)
+                elif tag.action == const.ACTION_CHANGE:
+                    self._push_changed_tag(tag, tag_ttype)
 
-        self.session.commit()
+        self.commit_batch()
 
     def _create_ttype(self, tag):
         """Create tag ttype"""
@@ -56,8 +57,7 @@ class PushTag(BaseSync):
             tag_ttype = self.note_store.createTag(
                 self.auth_token, tag_ttype,
             )
-            tag.guid = tag_ttype.guid
-            tag.action = const.ACTION_NONE
+            self.created(tag, tag_ttype.guid)
         except EDAMUserException as e:
             self.app.log(e)
 
@@ -75,36 +75,48 @@ class PushTag(BaseSync):
 class PullTag(BaseSync):
     """Pull tags from server"""
 
-    def __init__(self, *args, **kwargs):
-        super(PullTag, self).__init__(*args, **kwargs)
-        self._exists = []
-
     def pull(self):
         """Pull tags from server"""
         
+        self.start_generation(models.Tag)
+
         # Function: NoteStore.listTags
         # Struct: Tag
         for tag_ttype in self.note_store.listTags(self.auth_token):
-            
-            self.app.log(
-                'Pulling tag "%s" from remote server.' % tag_ttype.name)
-            try:
-                tag = self._update_tag(tag_ttype)
-            except NoResultFound:
-                tag = self._create_tag(tag_ttype)
-                
-            self._exists.append(tag.id)
-
-        self.session.commit()
+            with self.savepoint(tag_ttype.guid):
+                tag = self.pull_tag(tag_ttype)
+                tag.sync_generation = self.generation
+
+        self.commit_batch()
         self._remove_tags()
 
+    # pull one tag, used by pull() and by the incremental sync (chunk.py)
+    def pull_tag(self, tag_ttype):
+        """Create or update local tag from ttype"""
+        self.app.log(
+            'Pulling tag "%s" from remote server.' % tag_ttype.name)
+        try:
+            return self._update_tag(tag_ttype)
+        except NoResultFound:
+            return self._create_tag(tag_ttype)
+
+    # remove tags expunged on server
+    def expunge_tags(self, guids):
+        """Remove tags expunged on server"""
+        if not guids:
+            return
+        self.session.query(models.Tag).filter(
+            models.Tag.guid.in_(guids)
+            & (models.Tag.action != const.ACTION_CREATE)
+        ).delete(synchronize_session='fetch')
+
     # new tag
     def _create_tag(self, tag_ttype):
         """Create tag from server"""
         tag = models.Tag(guid=tag_ttype.guid)
         tag.from_api(tag_ttype)
         self.session.add(tag)
-        self.session.commit()
+        self.session.flush()
         return tag
 
     # update tag
@@ -120,10 +132,7 @@ class PullTag(BaseSync):
     # remove tag
     def _remove_tags(self):
         """Remove not exist tags"""
-        if self._exists:
-            q = (~models.Tag.id.in_(self._exists)
-                & (models.Tag.action != const.ACTION_CREATE))
-        else:
-            q = (models.Tag.action != const.ACTION_CREATE)
+        q = (self.stale(models.Tag)
+            & (models.Tag.action != const.ACTION_CREATE))
         self.session.query(models.Tag).filter(q).delete(
             synchronize_session='fetch')
@@ -1,15 +1,24 @@
 from thrift.protocol import TBinaryProtocol
 from thrift.transport import THttpClient
+try:
+    from thrift.protocol import fastbinary
+except ImportError:
+    fastbinary = None
 from evernote.edam.userstore import UserStore
-from evernote.edam.notestore import NoteStore
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import SingletonThreadPool
 from urlparse import urlparse
-from .models import Base
-from ..const import HOST, DB_PATH
+from .migrations import migrate
+from .stream import NoteStoreClient
+from . import search
+from ..const import (
+    HOST, DB_PATH, DEFAULT_DB_PRAGMAS, HTTP_POOL_SIZE, HTTP_COMPRESSION,
+)
 from ..tools import get_proxy_config
 from ..specific import get_keyring
 import os
+import re
 
 # change item to lower case
 # used local only
@@ -37,20 +46,117 @@ def get_auth_token():
 # Setup database
 # Ref:  http://docs.sqlalchemy.org/en/rel_0_9/orm/tutorial.html
 #       http://pypix.com/tools-and-tips/essential-sqlalchemy/
-def get_db_session(db_path=None):
+def get_db_session(db_path=None, savepoints=False, settings=None):
     # DB_PATH defined in const.py
     if not db_path:
         db_path = os.path.expanduser(DB_PATH)
+    engine = get_db_engine(db_path, settings)
+    if savepoints:
+        _enable_savepoints(engine)
+    migrate(engine)
+    Session = sessionmaker(bind=engine)
+    search.watch(Session)
+    return Session()
+
+
+# Session factory for service readers (see workers.py), each reader
+# thread keeps own connection. Readers don't change notes, so search
+# index isn't watched.
+def get_db_readers(size, db_path=None, settings=None):
+    if not db_path:
+        db_path = os.path.expanduser(DB_PATH)
+    # one more connection for migrate in calling thread
+    engine = get_db_engine(db_path, settings, pool_size=size + 1)
+    migrate(engine)
+    return sessionmaker(bind=engine)
+
+
+# Sqlite engine with tuned connections. WAL lets the service session
+# read while sync thread writes, synchronous=NORMAL is safe with WAL
+# and syncs only on checkpoint. See benchmarks/README.rst
+# settings - provider QSettings, db_<pragma name> overrides defaults
+# pool_size - connections kept, one per thread
+def get_db_engine(db_path, settings=None, pool_size=None):
     # Ex: engine = create_engine('sqlite:///:memory:', echo=True)
     # echo True - logging to python
-    # uses mysql-python as the default DBAPI
-    engine = create_engine('sqlite:///%s' % db_path)
-    Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    conn = session.connection()
-    conn.connection.create_function('lower', 1, _nocase_lower)
-    return session
+    if pool_size:
+        engine = create_engine(
+            'sqlite:///%s' % db_path,
+            poolclass=SingletonThreadPool, pool_size=pool_size,
+        )
+    else:
+        engine = create_engine('sqlite:///%s' % db_path)
+    pragmas = get_db_pragmas(settings)
+
+    def on_connect(dbapi_connection, connection_record):
+        dbapi_connection.create_function('lower', 1, _nocase_lower)
+        dbapi_connection.create_function(
+            search.RANK_FUNCTION, 1, search.get_rank)
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
+
+    event.listen(engine, 'connect', on_connect)
+    return engine
+
+
+# values are put into PRAGMA statements, so only
+# numbers and words are accepted from settings
+def get_db_pragmas(settings=None):
+    pragmas = []
+    for name, default in DEFAULT_DB_PRAGMAS:
+        value = settings.value('db_%s' % name) if settings else None
+        if not value or not re.match(r'^-?\w+$', str(value)):
+            value = default
+        pragmas.append((name, value))
+    return pragmas
+
+
+# Number from provider QSettings, default when it's not set or isn't
+# a number. convert - int or float
+def get_number_setting(settings, name, default, convert=int):
+    try:
+        return convert(settings.value(name) or default)
+    except (TypeError, ValueError):
+        return default
+
+
+# pysqlite begins transactions only before DML and breaks SAVEPOINT,
+# so transactions are started by sqlalchemy itself.  Only for the sync
+# session, with explicit BEGIN a session that never commits (service)
+# would hold the read lock forever.
+# Ref: http://docs.sqlalchemy.org/en/rel_0_9/dialects/sqlite.html
+#      #serializable-isolation-savepoints-transactional-ddl
+def _enable_savepoints(engine):
+    def on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    def on_begin(connection):
+        connection.execute('BEGIN')
+
+    event.listen(engine, 'connect', on_connect)
+    event.listen(engine, 'begin', on_begin)
+
+
+# Keep-alive connections shared by all note and user stores, sync
+# workers included, so tls handshake is done once per connection.
+http_pool = THttpClient.THttpConnectionPool(HTTP_POOL_SIZE)
+
+
+# Generated types decode with fastbinary only when protocol is
+# accelerated and transport is readable from C (THttpClient is),
+# pure python TBinaryProtocol when extension isn't built. ENML and
+# notes metadata replies are gzipped by server when it's accepted.
+def get_thrift_protocol(uri):
+    """Get binary protocol over http"""
+    http_client = THttpClient.THttpClient(
+        uri, None, None, get_proxy_config(urlparse(uri).scheme), None,
+        pool=http_pool, compress=HTTP_COMPRESSION,
+    )
+    if fastbinary is not None:
+        return TBinaryProtocol.TBinaryProtocolAccelerated(http_client)
+    return TBinaryProtocol.TBinaryProtocol(http_client)
 
 
 # MKG: Fixed to work with the v2.5 API  041314
@@ -61,26 +167,22 @@ def get_user_store(auth_token=None):
         auth_token = get_auth_token()
         
     user_store_uri = "https://" + HOST + "/edam/user"
-    http_proxy=get_proxy_config(urlparse(user_store_uri).scheme)
-
-    user_store_http_client = THttpClient.THttpClient(user_store_uri,None,None,http_proxy,None)
-    user_store_protocol = TBinaryProtocol.TBinaryProtocol(user_store_http_client)
+    user_store_protocol = get_thrift_protocol(user_store_uri)
 
     return UserStore.Client(user_store_protocol)
 
 
 # MKG: Fixed to work with the v2.5 API  041314
-def get_note_store(auth_token=None):
+# url is requested from user store when it's not known yet
+def get_note_store(auth_token=None, note_store_url=None):
     
     # Get token if don't have it already
     if not auth_token:
         auth_token = get_auth_token()
     
-    user_store = get_user_store(auth_token)
-    note_store_url = user_store.getNoteStoreUrl(auth_token)
-    http_proxy=get_proxy_config(urlparse(note_store_url).scheme)
-
-    note_store_http_client = THttpClient.THttpClient(note_store_url,None,None,http_proxy,None)
-    note_store_protocol = TBinaryProtocol.TBinaryProtocol(note_store_http_client)
+    if not note_store_url:
+        user_store = get_user_store(auth_token)
+        note_store_url = user_store.getNoteStoreUrl(auth_token)
+    note_store_protocol = get_thrift_protocol(note_store_url)
 
-    return NoteStore.Client(note_store_protocol)
+    return NoteStoreClient(note_store_protocol, url=note_store_url)
@@ -0,0 +1,73 @@
+from Queue import Queue
+import threading
+
+
+# ****** Contains:
+#        SessionWorkers - threads running service jobs with own sessions
+#
+# Service methods don't touch database in main loop: read only queries
+# go to readers pool, changes to single writer, so they are applied in
+# order. Job receives session of worker and returns result, callback
+# or errback with it is delivered back to main loop, where dbus reply
+# is sent. Session is closed after each job, so reader doesn't keep
+# old snapshot and objects between queries.
+
+
+# *************************************************
+# ****************  Session Workers ***************
+# *************************************************
+class SessionWorkers(object):
+    """Queue of jobs, each worker thread has own session"""
+
+    def __init__(self, size, session_factory, deliver):
+        self.size = max(size, 1)
+        self._session_factory = session_factory
+        self._deliver = deliver
+        self._queue = Queue()
+        self._workers = []
+        for _ in range(self.size):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, job, callback, errback):
+        """Schedule job"""
+        self._queue.put((job, callback, errback))
+
+    def join(self):
+        """Wait for submitted jobs"""
+        self._queue.join()
+
+    def close(self):
+        """Stop workers after submitted jobs"""
+        for _ in self._workers:
+            self._queue.put(None)
+        self._workers = []
+
+    def _work(self):
+        """Worker loop"""
+        session = self._session_factory()
+        try:
+            while True:
+                item = self._queue.get()
+                try:
+                    if item is None:
+                        return
+                    self._run(session, *item)
+                finally:
+                    self._queue.task_done()
+        finally:
+            session.close()
+
+    def _run(self, session, job, callback, errback):
+        """Run job and deliver result"""
+        try:
+            result = job(session)
+        except Exception as e:
+            self._deliver(lambda: errback(e))
+        else:
+            self._deliver(lambda: callback(result))
+        finally:
+            # not committed changes are rolled back
+            session.close()
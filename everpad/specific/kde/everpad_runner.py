@@ -1,8 +1,7 @@
 from PyKDE4 import plasmascript
 from PyKDE4.plasma import Plasma
 from PyKDE4.kdeui import KIcon
-from html2text import html2text
-from everpad.basetypes import Note
+from everpad.basetypes import Note, NoteSummary
 from everpad.tools import get_provider, get_pad
 import dbus
 
@@ -36,16 +35,14 @@ class EverpadRunner(plasmascript.Runner):
             action.setData(str(SETTINGS))
             context.addMatch(query, action)
         blank = dbus.Array([], signature='i')
-        for note_struct in provider.find_notes(
+        for note_struct in provider.find_note_summaries(
             search, blank, blank, 0,
-            1000, Note.ORDER_TITLE, -1,
+            1000, Note.ORDER_RELEVANCE, -1,
         ):
-            note = Note.from_tuple(note_struct)
+            note = NoteSummary.from_tuple(note_struct)
             action = Plasma.QueryMatch(self.runner)
             action.setText(note.title)
-            content = html2text(note.content)
-            content = content[:200]
-            action.setSubtext(content)
+            action.setSubtext(note.snippet)
             action.setType(Plasma.QueryMatch.ExactMatch)
             action.setIcon(KIcon("everpad"))
             action.setData(str(note.id))
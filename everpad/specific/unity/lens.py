@@ -4,7 +4,7 @@ from singlet.lens import SingleScopeLens, ListViewCategory
 from gi.repository import Gio, Unity, Notify
 from singlet.utils import run_lens
 from everpad.tools import get_provider, get_pad, resource_filename
-from everpad.basetypes import Note, Tag, Notebook, Place, Resource
+from everpad.basetypes import Note, NoteSummary, Tag, Notebook, Place, Resource
 from everpad.const import API_VERSION
 from html2text import html2text
 from datetime import datetime
@@ -113,14 +113,14 @@ class EverpadLens(SingleScopeLens):
         else:
             place = 0
         tags = dbus.Array(self.tag_filter_ids, signature='i')
-        for note_struct in provider.find_notes(
+        for note_struct in provider.find_note_summaries(
             search, notebooks, tags, place,
-            1000, Note.ORDER_TITLE, -1,
+            1000, Note.ORDER_RELEVANCE, -1,
         ):
-            note = Note.from_tuple(note_struct)
+            note = NoteSummary.from_tuple(note_struct)
             results.append(json.dumps({'id': note.id, 'search': search}),
                 'everpad-note', self.pin_notes if note.pinnded else self.all_notes,
-                "text/html", note.title, html2text(note.content),
+                "text/html", note.title, note.snippet,
             '')
 
     def global_search(self, phrase, results):
@@ -1,4 +1,6 @@
-from setuptools import setup, find_packages
+from setuptools import setup, find_packages, Extension
+from setuptools.command.build_ext import build_ext
+from distutils.errors import CCompilerError, DistutilsError
 import os
 
 version = '2.5'
@@ -16,6 +18,22 @@ if not 'TRAVIS_CI' in os.environ:
     requirements.append('PySide')
 
 
+class optional_build_ext(build_ext):
+    """Don't fail without compiler, thrift has pure python codec"""
+
+    def run(self):
+        try:
+            build_ext.run(self)
+        except DistutilsError as e:
+            self.warn('fastbinary not built: %s' % e)
+
+    def build_extension(self, ext):
+        try:
+            build_ext.build_extension(self, ext)
+        except (CCompilerError, DistutilsError) as e:
+            self.warn('%s not built: %s' % (ext.name, e))
+
+
 setup(
     name='everpad',
     version=version,
@@ -31,8 +49,15 @@ setup(
     license='X11',
     packages=find_packages(exclude=['ez_setup', 'examples', 'tests']),
     include_package_data=True,
-    zip_safe=True,
+    zip_safe=False,
     install_requires=requirements,
+    ext_modules=[
+        Extension(
+            'thrift.protocol.fastbinary',
+            ['thrift/protocol/fastbinary.c'],
+        ),
+    ],
+    cmdclass={'build_ext': optional_build_ext},
     entry_points={
         'gui_scripts': [
             'everpad=everpad.pad.indicator:main'
@@ -8,7 +8,6 @@ from everpad.basetypes import (
     Note, Notebook, Tag, Resource, Place,
     NONE_ID, NONE_VAL,
 )
-from everpad.provider import models
 from everpad.pad.editor import Editor
 from everpad.pad.editor.content import set_links
 from datetime import datetime
@@ -61,7 +60,6 @@ if 'test_editor' in os.environ:
         def setUp(self):
             self.service = ProviderService()
             self.service._session = get_db_session()
-            models.Note.session = self.service._session
             self.app = app
             self.app.update(self.service)
             notebook = Notebook.from_tuple(
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from everpad.provider.enml import enml_to_html, html_to_enml
+import unittest
+
+
+DOCTYPE = '<!DOCTYPE en-note SYSTEM "http://xml.evernote.com/pub/enml2.dtd">'
+
+# received ENML and content, as converted by BeautifulSoup before
+PULL_CORPUS = (
+    ('<?xml version="1.0" encoding="UTF-8"?>\n%s\n'
+     '<en-note style="word-wrap: break-word;">\n<div>First line</div>\n'
+     '<div><br/></div>\n<div>Second <b>bold</b>, '
+     '<font color="#ff0000">red</font></div>\n'
+     '<ul>\n<li>one</li>\n<li>two</li>\n</ul>\n</en-note>' % DOCTYPE,
+     u'\n<div>First line</div>\n<div><br /></div>\n<div>Second <b>bold</b>, '
+     u'<font color="#ff0000">red</font></div>\n'
+     u'<ul>\n<li>one</li>\n<li>two</li>\n</ul>\n'),
+    ('<en-note><div>Tom &amp; Jerry&nbsp;&lt;3 &#160;&#x41; &copy; '
+     'a &gt; b</div></en-note>',
+     u'<div>Tom &amp; Jerry&nbsp;&lt;3 &#160;&#x41; &copy; a &gt; b</div>'),
+    ('<en-note><a href="http://x.com/?a=1&amp;b=2" '
+     'title=\'say "hi"\'>l</a></en-note>',
+     u'<a href="http://x.com/?a=1&amp;b=2" title=\'say "hi"\'>l</a>'),
+    ('<en-note><en-media hash="abc" type="image/png"></en-media>'
+     '<en-todo checked="true"></en-todo>task</en-note>',
+     u'<en-media hash="abc" type="image/png"></en-media>'
+     u'<en-todo checked="true"></en-todo>task'),
+    ('<en-note>\xc3\xa9t\xc3\xa9 '
+     '<span style="color: red;">\xe2\x9c\x93</span></en-note>',
+     u'\xe9t\xe9 <span style="color: red;">✓</span>'),
+    ('<en-note><table><tbody><tr><td>1</td><td>2</td></tr></tbody>'
+     '</table></en-note>',
+     u'<table><tbody><tr><td>1</td><td>2</td></tr></tbody></table>'),
+    ('<en-note><en-crypt cipher="RC2" length="64" hint="h">abc==</en-crypt>'
+     '</en-note>',
+     u'<en-crypt cipher="RC2" length="64" hint="h">abc==</en-crypt>'),
+    ('<en-note><pre>  a\n  b</pre>\n\n   <div>  </div><!-- comment -->'
+     '</en-note>',
+     u'<pre>  a\n  b</pre>\n<div> </div><!-- comment -->'),
+    ('<en-note><div><b><i>x</b></i><p>a<p>b</div><ul><li>1<li>2</ul>'
+     '</en-note>',
+     u'<div><b><i>x</i></b><p>a</p><p>b</p></div>'
+     u'<ul><li>1</li><li>2</li></ul>'),
+    ('<en-note><br>a</br>b<img src=x>c</img><td nowrap>d</td></en-note>',
+     u'<br />ab<img src="x" />c<td nowrap="nowrap">d</td>'),
+    ('<en-note></en-note>', u''),
+    ('<en-note/>', u''),
+)
+
+# note content and ENML sent, as converted by BeautifulSoup before
+PUSH_CORPUS = (
+    (u'<div>one</div>\n<div>two&nbsp;&nbsp; three &amp; four</div>'
+     u'<div><br></div>',
+     '<div>one</div>\n<div>two&nbsp;&nbsp; three &amp; four</div>'
+     '<div><br /></div>'),
+    (u'<div><a href="http://everpad.org/a?b=1&amp;c=2">link</a></div>',
+     '<div><a href="http://everpad.org/a?b=1&amp;c=2">link</a></div>'),
+    (u'a<br>b<hr><en-media hash="abc" type="image/png"></en-media>'
+     u'<en-todo checked="true"></en-todo>x',
+     'a<br />b<hr /><en-media hash="abc" type="image/png" />'
+     '<en-todo checked="true" />x'),
+    (u'<en-media hash="abc" type="image/png" /><en-todo/>x',
+     '<en-media hash="abc" type="image/png" /><en-todo />x'),
+    (u'<a href="javascript:alert(1)" onclick="x" class="c" id="i" '
+     u'style="s">l</a><a>n</a>',
+     '<a style="s">l</a><a>n</a>'),
+    (u'<script>bad()</script><span>ok</span>'
+     u'<custom>inner <b>bold</b></custom>',
+     'bad()<span>ok</span>inner <b>bold</b>'),
+    (u'<html><body><div>x</div>\n  <input type="checkbox">\n'
+     u'  <div>y</div></body></html>',
+     '<div>x</div>\n<div>y</div>'),
+    (u'\xe9t\xe9 ✓ &lt; bare & \x01ctrl',
+     '\xc3\xa9t\xc3\xa9 \xe2\x9c\x93 &lt; bare &amp; ctrl'),
+    (u'<p>p1<p>p2</p></p><ul><li>1<li>2</ul><!-- c -->',
+     '<p>p1</p><p>p2</p><ul><li>1</li><li>2</li></ul><!-- c -->'),
+    (u'<pre>  keep\n   spaces </pre>',
+     '<pre>  keep\n   spaces </pre>'),
+    (u'', ''),
+)
+
+
+class EnmlCase(unittest.TestCase):
+    """ENML converter case"""
+
+    def test_pull_corpus(self):
+        """Test received content same as before"""
+        for enml, html in PULL_CORPUS:
+            self.assertEqual(enml_to_html(enml), html)
+
+    def test_push_corpus(self):
+        """Test sent ENML same as before"""
+        for html, content in PUSH_CORPUS:
+            self.assertEqual(
+                html_to_enml(html),
+                '%s\n<en-note>%s</en-note>' % (DOCTYPE, content),
+            )
+
+    def test_pull_self_closing(self):
+        """Test content after self-closing tags not nested in them"""
+        self.assertEqual(enml_to_html(
+            '<en-note><en-media hash="abc" type="image/png"/>'
+            '<en-todo checked="true"/>task<br/></en-note>',
+        ), u'<en-media hash="abc" type="image/png"></en-media>'
+           u'<en-todo checked="true"></en-todo>task<br />')
+
+    def test_pull_without_note(self):
+        """Test content without en-note rejected"""
+        with self.assertRaises(ValueError):
+            enml_to_html('<div>text</div>')
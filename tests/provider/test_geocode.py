@@ -0,0 +1,98 @@
+from everpad.provider.geocode import Geocoder
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+
+class GeocoderCase(unittest.TestCase):
+    """Background geocoder case"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.calls = []
+        self.fail = False
+        self.logged = []
+        self.geocoder = self._create_geocoder()
+
+    def tearDown(self):
+        self.geocoder.close()
+        shutil.rmtree(self.path)
+
+    def _create_geocoder(self):
+        """Create geocoder with fake resolver and cache in temp dir"""
+        return Geocoder(
+            os.path.join(self.path, 'cache', 'geocode.db'), 5,
+            self.logged.append, resolver=self._resolve,
+        )
+
+    def _resolve(self, latitude, longitude, timeout):
+        """Fake resolver"""
+        self.calls.append((latitude, longitude, timeout))
+        if self.fail:
+            raise socket.timeout('timed out')
+        if latitude > 0:
+            return 'place %.1f' % latitude
+
+    def _geocode(self, *notes):
+        """Submit notes and get results"""
+        for note in notes:
+            self.geocoder.submit(*note)
+        self.geocoder.join()
+        return self.geocoder.results()
+
+    def test_resolve(self):
+        """Test place names resolved, unknown skipped"""
+        self.assertEqual(self._geocode(
+            ('guid', 10.0, 20.0), ('unknown', -10.0, 20.0),
+        ), [('guid', 'place 10.0')])
+        self.assertEqual(self.calls, [(10.0, 20.0, 5), (-10.0, 20.0, 5)])
+        self.assertEqual(self.geocoder.results(), [])
+
+    def test_cache(self):
+        """Test near coordinates resolved once and kept on disk"""
+        self.assertEqual(self._geocode(
+            ('first', 10.0, 20.0), ('second', 10.0001, 20.0002),
+            ('unknown', -10.0, 20.0), ('unknown', -10.0, 20.0),
+        ), [('first', 'place 10.0'), ('second', 'place 10.0')])
+        self.assertEqual(len(self.calls), 2)
+        self.geocoder.close()
+        self.geocoder = self._create_geocoder()
+        self.assertEqual(self._geocode(('third', 10.0, 20.0)), [
+            ('third', 'place 10.0'),
+        ])
+        self.assertEqual(len(self.calls), 2)
+
+    def test_pending_not_submitted_again(self):
+        """Test note waiting for geocoding not scheduled twice"""
+        release = threading.Event()
+        resolve = self._resolve
+
+        def wait_resolve(*args):
+            release.wait()
+            return resolve(*args)
+
+        self._resolve = wait_resolve
+        self.geocoder.close()
+        self.geocoder = self._create_geocoder()
+        for _ in range(3):
+            self.geocoder.submit('guid', 10.0, 20.0)
+        release.set()
+        self.geocoder.join()
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self._geocode(('guid', 11.0, 20.0)), [
+            ('guid', 'place 10.0'), ('guid', 'place 11.0'),
+        ])
+
+    def test_failed_not_cached(self):
+        """Test failed lookup logged and tried again"""
+        self.fail = True
+        self.assertEqual(self._geocode(('guid', 10.0, 20.0)), [])
+        self.assertEqual(len(self.logged), 1)
+        self.fail = False
+        self.assertEqual(self._geocode(('guid', 10.0, 20.0)), [
+            ('guid', 'place 10.0'),
+        ])
+        self.assertEqual(len(self.calls), 2)
@@ -0,0 +1,180 @@
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from thrift.transport.THttpClient import THttpClient, THttpConnectionPool
+from cStringIO import StringIO
+import gzip
+import socket
+import threading
+import unittest
+import zlib
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    """Keep-alive handler replying with request body"""
+    protocol_version = 'HTTP/1.1'
+    drop = False
+    encoding = None
+    hang = None
+    received = []
+
+    def _encode(self, body):
+        """Compress body with accepted encoding"""
+        accepted = self.headers.get('Accept-Encoding', '')
+        if not self.encoding or self.encoding not in accepted:
+            return body
+        self.send_header('Content-Encoding', self.encoding)
+        if self.encoding == 'deflate':
+            return zlib.compress(body)
+        buf = StringIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb') as gzip_file:
+            gzip_file.write(body)
+        return buf.getvalue()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.received.append(body)
+        if self.hang:
+            # handled, but reply is late
+            self.hang.wait()
+            return
+        self.send_response(200)
+        body = self._encode(body)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # close without telling client, like idle timeout on server,
+        # HTTP/1.0 client (not pooled) reads till close
+        self.close_connection = int(
+            self.drop or self.request_version == 'HTTP/1.0')
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class HttpPoolCase(unittest.TestCase):
+    """Keep-alive connections pool case"""
+
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), EchoHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.uri = 'http://127.0.0.1:%d/edam' % self.server.server_port
+        self.pool = THttpConnectionPool()
+        del EchoHandler.received[:]
+
+    def tearDown(self):
+        if EchoHandler.hang:
+            EchoHandler.hang.set()
+            EchoHandler.hang = None
+        self.pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _call(self, client, data):
+        """Send data and read reply"""
+        client.write(data)
+        client.flush()
+        return client.readAll(len(data))
+
+    def test_keep_alive(self):
+        """Test connection reused between calls and clients"""
+        client = THttpClient(self.uri, pool=self.pool)
+        for num in range(3):
+            self.assertEqual(self._call(client, 'call%d' % num), 'call%d' % num)
+        client.close()
+        self.assertEqual(
+            self._call(THttpClient(self.uri, pool=self.pool), 'other'),
+            'other',
+        )
+        self.assertEqual(self.pool.stats(), {
+            'handshakes': 1, 'requests': 4, 'reconnects': 0,
+            'bytes_in': 0, 'bytes_in_comp': 0,
+        })
+
+    def test_reconnect(self):
+        """Test request sent again when idle connection dropped"""
+        client = THttpClient(self.uri, pool=self.pool)
+        EchoHandler.drop = True
+        try:
+            self._call(client, 'first')
+        finally:
+            EchoHandler.drop = False
+        self.assertEqual(self._call(client, 'second'), 'second')
+        self.assertEqual(self.pool.stats(), {
+            'handshakes': 2, 'requests': 3, 'reconnects': 1,
+            'bytes_in': 0, 'bytes_in_comp': 0,
+        })
+
+    def test_not_sent_again(self):
+        """Test request not sent again when reply failed after server
+        got it"""
+        client = THttpClient(self.uri, pool=self.pool)
+        client.setTimeout(300)
+        self.assertEqual(self._call(client, 'first'), 'first')
+        EchoHandler.hang = threading.Event()
+        with self.assertRaises(socket.timeout):
+            self._call(client, 'create')
+        self.assertEqual(EchoHandler.received, ['first', 'create'])
+        self.assertEqual(self.pool.stats()['reconnects'], 0)
+
+    def test_read_large(self):
+        """Test large reads bypass buffer and small ones use it"""
+        client = THttpClient(self.uri, pool=self.pool, rbuf_size=1024)
+        data = ''.join(chr(num % 256) for num in range(200000))
+        client.write(data)
+        client.flush()
+        self.assertEqual(client.readAll(4), data[:4])
+        self.assertEqual(client.readAll(150000), data[4:150004])
+        self.assertEqual(client.read(10), data[150004:150014])
+        self.assertEqual(client.readAll(49986), data[150014:])
+        with self.assertRaises(EOFError):
+            client.readAll(1)
+
+    def _test_compressed(self, encoding, pool=True):
+        """Test compressed reply decoded"""
+        client = THttpClient(
+            self.uri, pool=self.pool if pool else None, rbuf_size=1024,
+            compress=True,
+        )
+        data = 'compressed reply ' * 10000
+        EchoHandler.encoding = encoding
+        try:
+            for num in range(2):
+                self.assertEqual(self._call(client, data), data)
+            client.close()
+        finally:
+            EchoHandler.encoding = None
+        self.assertEqual(client.bytes_in, len(data) * 2)
+        self.assertLess(client.bytes_in_comp, len(data) / 10)
+        if pool:
+            stats = self.pool.stats()
+            self.assertEqual(stats['handshakes'], 1)
+            self.assertEqual(stats['bytes_in'], client.bytes_in)
+            self.assertEqual(stats['bytes_in_comp'], client.bytes_in_comp)
+
+    def test_gzip(self):
+        """Test gzip reply decoded"""
+        self._test_compressed('gzip')
+
+    def test_deflate(self):
+        """Test deflate reply decoded"""
+        self._test_compressed('deflate')
+
+    def test_compressed_not_pooled(self):
+        """Test compressed sizes counted without pool"""
+        self._test_compressed('gzip', pool=False)
+
+    def test_not_compressed(self):
+        """Test compression not accepted by default"""
+        client = THttpClient(self.uri, pool=self.pool)
+        EchoHandler.encoding = 'gzip'
+        try:
+            self.assertEqual(self._call(client, 'plain'), 'plain')
+        finally:
+            EchoHandler.encoding = None
+        self.assertEqual(self.pool.stats()['bytes_in_comp'], 0)
@@ -0,0 +1,182 @@
+from .. import settings
+from everpad.provider.migrations import migrate
+from everpad.provider import models, search
+from everpad import const
+from sqlalchemy import create_engine
+import unittest
+
+
+# schema of databases created before migrations (everpad.5.db)
+LEGACY_SCHEMA = (
+    """CREATE TABLE notebooks (
+        id INTEGER NOT NULL,
+        guid VARCHAR,
+        name VARCHAR,
+        "default" BOOLEAN,
+        service_created INTEGER,
+        service_updated INTEGER,
+        action INTEGER,
+        stack VARCHAR,
+        PRIMARY KEY (id),
+        CHECK ("default" IN (0, 1))
+    )""",
+    """CREATE TABLE places (
+        id INTEGER NOT NULL,
+        name VARCHAR,
+        PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE account (
+        id INTEGER NOT NULL,
+        user_id INTEGER,
+        username VARCHAR,
+        email VARCHAR,
+        created INTEGER,
+        updated INTEGER,
+        deleted INTEGER,
+        active INTEGER,
+        PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE sync (
+        id INTEGER NOT NULL,
+        update_count INTEGER,
+        srv_update_count INTEGER,
+        last_sync INTEGER,
+        virgin_db INTEGER,
+        rate_limit INTEGER,
+        rate_limit_time INTEGER,
+        connect_error_count INTEGER,
+        PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE tags (
+        id INTEGER NOT NULL,
+        guid VARCHAR,
+        name VARCHAR,
+        "parentGuid" VARCHAR,
+        action INTEGER,
+        PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE notes (
+        id INTEGER NOT NULL,
+        guid VARCHAR,
+        title VARCHAR,
+        content VARCHAR,
+        "contentHash" VARCHAR,
+        "contentLength" INTEGER,
+        created INTEGER,
+        updated INTEGER,
+        updated_local INTEGER,
+        notebook_id INTEGER,
+        pinnded BOOLEAN,
+        place_id INTEGER,
+        action INTEGER,
+        conflict_parent_id INTEGER,
+        share_date INTEGER,
+        share_status INTEGER,
+        share_url VARCHAR,
+        PRIMARY KEY (id),
+        FOREIGN KEY(notebook_id) REFERENCES notebooks (id),
+        CHECK (pinnded IN (0, 1)),
+        FOREIGN KEY(place_id) REFERENCES places (id),
+        FOREIGN KEY(conflict_parent_id) REFERENCES notes (id)
+    )""",
+    """CREATE TABLE resources (
+        id INTEGER NOT NULL,
+        note_id INTEGER,
+        file_name VARCHAR,
+        file_path VARCHAR,
+        guid VARCHAR,
+        hash VARCHAR,
+        mime VARCHAR,
+        action INTEGER,
+        PRIMARY KEY (id),
+        FOREIGN KEY(note_id) REFERENCES notes (id)
+    )""",
+    """CREATE TABLE notetags (
+        note INTEGER,
+        tag INTEGER,
+        FOREIGN KEY(note) REFERENCES notes (id),
+        FOREIGN KEY(tag) REFERENCES tags (id)
+    )""",
+)
+
+
+class MigrationsCase(unittest.TestCase):
+    """Schema migrations case"""
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+
+    def _get_indexes(self):
+        """Get names of indexes in database"""
+        return set(name for name, in self.engine.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'",
+        ))
+
+    def _create_legacy_database(self):
+        """Create database with schema before migrations"""
+        for sql in LEGACY_SCHEMA:
+            self.engine.execute(sql)
+
+    def _get_version(self):
+        """Get database schema version"""
+        return self.engine.execute('PRAGMA user_version').scalar()
+
+    def test_new_database(self):
+        """Test create new database"""
+        migrate(self.engine)
+        self.assertEqual(self._get_version(), const.SCHEMA_VERSION)
+        self.assertIn('ix_notes_guid', self._get_indexes())
+        self.assertTrue(search.get_fts_version(self.engine))
+
+    def test_legacy_database(self):
+        """Test upgrade database created before migrations"""
+        self._create_legacy_database()
+        self.engine.execute(
+            "INSERT INTO notes (id, title, action) VALUES (1, 'title', 0)",
+        )
+
+        migrate(self.engine)
+
+        self.assertEqual(self._get_version(), const.SCHEMA_VERSION)
+        self.assertTrue(set([
+            'ix_notes_guid', 'ix_notes_action_updated',
+            'ix_notes_notebook_id_action', 'ix_resources_guid',
+            'ix_resources_note_id', 'ix_tags_name', 'ix_notetags_note',
+            'ix_notes_sync_generation', 'ix_tags_sync_generation',
+            'ix_notebooks_sync_generation',
+        ]) <= self._get_indexes())
+        self.assertEqual(self.engine.execute(
+            'SELECT sync_generation, latitude FROM notes',
+        ).fetchall(), [(0, None)])
+
+    def test_index_existing_notes(self):
+        """Test notes of legacy database put to full text index"""
+        self._create_legacy_database()
+        self.engine.execute(
+            "INSERT INTO notes (id, title, content) "
+            "VALUES (1, 'title', '<b>content</b>')",
+        )
+        migrate(self.engine)
+        self.assertEqual(self.engine.execute(
+            "SELECT rowid FROM notes_fts WHERE notes_fts MATCH 'content'",
+        ).fetchall(), [(1,)])
+
+    def test_add_columns(self):
+        """Test columns added to existing tables"""
+        models.Base.metadata.create_all(self.engine)
+        self.engine.execute('DROP TABLE sync')
+        self.engine.execute(
+            'CREATE TABLE sync (id INTEGER PRIMARY KEY, update_count INTEGER)',
+        )
+        self.engine.execute('INSERT INTO sync (update_count) VALUES (3)')
+        self.engine.execute('PRAGMA user_version = 7')
+        migrate(self.engine)
+        self.assertEqual(self.engine.execute(
+            'SELECT update_count, checkpoint_phase FROM sync',
+        ).fetchall(), [(3, None)])
+
+    def test_migrated_database(self):
+        """Test migrate already migrated database"""
+        migrate(self.engine)
+        migrate(self.engine)
+        self.assertEqual(self._get_version(), const.SCHEMA_VERSION)
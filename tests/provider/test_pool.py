@@ -0,0 +1,58 @@
+from everpad.provider.sync.pool import FetchPool
+from mock import MagicMock
+import unittest
+
+
+class FetchPoolCase(unittest.TestCase):
+    """Fetch pool case"""
+
+    def setUp(self):
+        self.note_store = MagicMock()
+        self.log = MagicMock()
+
+    def _create_pool(self, size):
+        """Create pool with note store mocks"""
+        return FetchPool(size, MagicMock, self.note_store, self.log)
+
+    def test_inline(self):
+        """Test one worker fetch in caller thread"""
+        pool = self._create_pool(1)
+        pool.submit('guid', lambda note_store: note_store)
+        self.assertEqual(pool.result('guid'), self.note_store)
+        pool.close()
+
+    def test_workers(self):
+        """Test workers use own clients"""
+        pool = self._create_pool(3)
+        for num in range(10):
+            pool.submit(num, lambda note_store, num=num: (note_store, num))
+        results = [pool.result(num) for num in range(10)]
+        pool.close()
+        self.assertEqual([num for _, num in results], range(10))
+        for note_store, _ in results:
+            self.assertNotEqual(note_store, self.note_store)
+
+    def test_not_submitted(self):
+        """Test result of not submitted job"""
+        pool = self._create_pool(2)
+        self.assertIsNone(pool.result('guid'))
+        pool.close()
+
+    def test_error(self):
+        """Test error raised in writer"""
+        def fail(note_store):
+            raise ValueError()
+        pool = self._create_pool(2)
+        pool.submit('guid', fail)
+        self.assertRaises(ValueError, pool.result, 'guid')
+        pool.close()
+
+    def test_prefetched(self):
+        """Test prefetching ahead of consumer"""
+        pool = self._create_pool(2)
+        prefetched = []
+        items = pool.prefetched(range(10), prefetched.append)
+        self.assertEqual(next(items), 0)
+        self.assertEqual(prefetched, range(pool.window + 1))
+        self.assertEqual(list(items), range(1, 10))
+        pool.close()
@@ -0,0 +1,91 @@
+from evernote.edam.error.ttypes import EDAMSystemException, EDAMErrorCode
+from everpad.provider.sync.scheduler import Scheduler, ScheduledStore
+from mock import MagicMock
+import unittest
+
+
+class FakeClock(object):
+    """Clock advanced by sleep"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+class SchedulerCase(unittest.TestCase):
+    """Api calls scheduler case"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def _create_scheduler(self, resume_at=0):
+        """Create scheduler for 3600 calls per hour"""
+        return Scheduler(
+            3600, 3, 60, resume_at=resume_at,
+            clock=self.clock.time, sleep=self.clock.sleep,
+        )
+
+    def _rate_limit(self, duration):
+        """Create rate limit exception"""
+        return EDAMSystemException(
+            errorCode=EDAMErrorCode.RATE_LIMIT_REACHED,
+            rateLimitDuration=duration,
+        )
+
+    def test_burst(self):
+        """Test calls spread after burst"""
+        scheduler = self._create_scheduler()
+        for _ in range(5):
+            scheduler.acquire()
+        self.assertEqual(self.clock.sleeps, [1, 1])
+        self.clock.now += 10
+        scheduler.acquire()
+        self.assertEqual(len(self.clock.sleeps), 2)
+        self.assertEqual(scheduler.stats(), {
+            'calls': 6, 'waited': 2, 'limits': 0,
+        })
+
+    def test_short_rate_limit(self):
+        """Test call retried after short rate limit"""
+        scheduler = self._create_scheduler()
+        method = MagicMock(side_effect=[self._rate_limit(30), 'result'])
+        self.assertEqual(scheduler.call(method, 'token'), 'result')
+        self.assertEqual(method.call_count, 2)
+        self.assertEqual(self.clock.sleeps, [30])
+
+    def test_long_rate_limit(self):
+        """Test calls fail without request till end of long rate limit"""
+        scheduler = self._create_scheduler()
+        method = MagicMock(side_effect=self._rate_limit(600))
+        with self.assertRaises(EDAMSystemException) as context:
+            scheduler.call(method, 'token')
+        self.assertEqual(context.exception.rateLimitDuration, 600)
+        self.assertEqual(scheduler.resume_at, 1600)
+        self.clock.now += 300
+        with self.assertRaises(EDAMSystemException) as context:
+            scheduler.call(method, 'token')
+        self.assertEqual(context.exception.rateLimitDuration, 300)
+        self.assertEqual(method.call_count, 1)
+
+    def test_restored_rate_limit(self):
+        """Test window restored from sync state waited"""
+        scheduler = self._create_scheduler(resume_at=1030)
+        scheduler.acquire()
+        self.assertEqual(self.clock.sleeps, [30])
+
+    def test_scheduled_store(self):
+        """Test store calls go through scheduler"""
+        store = MagicMock()
+        store.getSyncState.return_value = 'state'
+        scheduler = self._create_scheduler()
+        scheduled = ScheduledStore(store, scheduler)
+        self.assertEqual(scheduled.getSyncState('token'), 'state')
+        store.getSyncState.assert_called_once_with('token')
+        self.assertEqual(scheduler.calls, 1)
@@ -2,13 +2,18 @@
 from .. import settings
 
 from dbus.exceptions import DBusException
-from mock import MagicMock
+from mock import MagicMock, patch
+from sqlalchemy import event
 from everpad.provider.service import ProviderService
-from everpad.provider.tools import get_db_session
+from everpad.provider.tools import get_db_session, get_db_readers
+from everpad.provider.workers import SessionWorkers
 from everpad import const
-from everpad.provider import models
+from everpad.provider import models, search
 import unittest
 import dbus
+import os
+import shutil
+import tempfile
 import everpad.basetypes as btype
 from .. import factories
 
@@ -92,7 +97,6 @@ class FindTestCase(unittest.TestCase):
         """Create service"""
         self.service = ProviderService()
         self.service._session = get_db_session()
-        models.Note.session = self.service._session  # TODO: fix that shit
 
     def _to_ids(self, items):
         return set(map(lambda item: item.id, items))
@@ -119,7 +123,7 @@ class FindTestCase(unittest.TestCase):
             self._to_ids(two), self._to_ids(self.notes[:2]),
         )
         blank = self._find(
-            'not note', dbus.Array([], signature='i'),
+            'new old', dbus.Array([], signature='i'),
             dbus.Array([], signature='i'), 0,
             100, const.ORDER_UPDATED_DESC, -1,
         )
@@ -201,6 +205,228 @@ class FindTestCase(unittest.TestCase):
             self._to_ids(all_notes), self._to_ids(self.notes[-2:]),
         )
 
+    def test_by_words_in_html(self):
+        """Test find by text of note html"""
+        note = btype.Note << self.service.update_note(
+            self.service.create_note(btype.Note(
+                title='html',
+                content='<div>first<b>second</b> &amp; third</div>',
+                tags=[],
+                notebook=self.notebook.id,
+                created=const.NONE_VAL,
+                updated=const.NONE_VAL,
+                place='',
+                pinnded=False,
+            ).struct),
+        )
+        for words in ('secon', 'third', 'html first'):
+            self.assertItemsEqual(self._to_ids(self._find(
+                words, dbus.Array([], signature='i'),
+                dbus.Array([], signature='i'), 0,
+                100, const.ORDER_UPDATED_DESC, -1,
+            )), [note.id])
+        self.assertEqual(len(self._find(
+            'div', dbus.Array([], signature='i'),
+            dbus.Array([], signature='i'), 0,
+            100, const.ORDER_UPDATED_DESC, -1,
+        )), 0)
+
+    def test_by_words_after_tag_rename(self):
+        """Test find by new tag name"""
+        tag = self.service.session.query(models.Tag).filter(
+            models.Tag.name == 'ef',
+        ).one()
+        tag.name = 'renamed'
+        self.service.session.commit()
+        found = self._find(
+            'renamed', dbus.Array([], signature='i'),
+            dbus.Array([], signature='i'), 0,
+            100, const.ORDER_UPDATED_DESC, -1,
+        )
+        self.assertItemsEqual(self._to_ids(found), [self.notes[1].id])
+
+    def test_by_words_deleted(self):
+        """Test deleted note not found"""
+        self.service.session.query(models.Note).filter(
+            models.Note.id == self.notes[0].id,
+        ).delete(synchronize_session='fetch')
+        found = self._find(
+            'new', dbus.Array([], signature='i'),
+            dbus.Array([], signature='i'), 0,
+            100, const.ORDER_UPDATED_DESC, -1,
+        )
+        self.assertEqual(len(found), 0)
+
+    def test_by_words_after_bulk_delete(self):
+        """Test not found by names of removed tag and notebook"""
+        for words in ('ef', 'test2'):
+            self.assertEqual(self._to_ids(self._find(
+                words, dbus.Array([], signature='i'),
+                dbus.Array([], signature='i'), 0,
+                100, const.ORDER_UPDATED_DESC, -1,
+            )), set([self.notes[1].id]))
+        self.service.session.query(models.Tag).filter(
+            models.Tag.name == 'ef',
+        ).delete(synchronize_session='fetch')
+        self.service.session.query(models.Notebook).filter(
+            models.Notebook.name == 'test2',
+        ).delete(synchronize_session='fetch')
+        for words in ('ef', 'test2'):
+            self.assertEqual(len(self._find(
+                words, dbus.Array([], signature='i'),
+                dbus.Array([], signature='i'), 0,
+                100, const.ORDER_UPDATED_DESC, -1,
+            )), 0)
+        self.assertEqual(self._to_ids(self._find(
+            'gh old', dbus.Array([], signature='i'),
+            dbus.Array([], signature='i'), 0,
+            100, const.ORDER_UPDATED_DESC, -1,
+        )), set([self.notes[1].id]))
+
+    def test_order_by_relevance(self):
+        """Test best matches first"""
+        notes = [
+            btype.Note << self.service.update_note(
+                self.service.create_note(btype.Note(
+                    title=title,
+                    content=content,
+                    tags=[],
+                    notebook=self.notebook.id,
+                    created=const.NONE_VAL,
+                    updated=const.NONE_VAL,
+                    place='',
+                    pinnded=False,
+                ).struct),
+            ) for title, content in (
+                ('once', 'relevant other other'),
+                ('thrice', 'relevant relevant relevant'),
+                ('twice', 'relevant relevant other'),
+            )
+        ]
+        found = self._find(
+            'releva', dbus.Array([], signature='i'),
+            dbus.Array([], signature='i'), 0,
+            100, const.ORDER_RELEVANCE, -1,
+        )
+        self.assertEqual(
+            [note.id for note in found],
+            [notes[1].id, notes[2].id, notes[0].id],
+        )
+        # without words recently updated first
+        ordered = self._find(
+            '', dbus.Array([], signature='i'),
+            dbus.Array([], signature='i'), 0,
+            100, const.ORDER_RELEVANCE, -1,
+        )
+        self.assertEqual(
+            [note.id for note in ordered],
+            [note.id for note in self._find(
+                '', dbus.Array([], signature='i'),
+                dbus.Array([], signature='i'), 0,
+                100, const.ORDER_UPDATED_DESC, -1,
+            )],
+        )
+
+    def test_find_note_summaries(self):
+        """Test summaries match found notes without content"""
+        summaries = btype.NoteSummary.list << self.service.find_note_summaries(
+            'note', dbus.Array([], signature='i'),
+            dbus.Array([], signature='i'), 0,
+            100, const.ORDER_TITLE, -1,
+        )
+        self.assertEqual(
+            [summary.id for summary in summaries],
+            [self.notes[0].id, self.notes[1].id],
+        )
+        summary = summaries[0]
+        self.assertEqual(summary.title, 'New note')
+        self.assertEqual(summary.notebook, self.notebook.id)
+        self.assertEqual(summary.snippet, 'New note content')
+        self.assertFalse(hasattr(summary, 'content'))
+
+    def test_find_note_summaries_pinnded(self):
+        """Test summaries filtered by pinnded status"""
+        summaries = btype.NoteSummary.list << self.service.find_note_summaries(
+            '', dbus.Array([], signature='i'),
+            dbus.Array([], signature='i'), 0,
+            100, const.ORDER_UPDATED_DESC, 1,
+        )
+        self.assertEqual(len(summaries), 1)
+        self.assertEqual(summaries[0].id, self.notes[2].id)
+        self.assertTrue(summaries[0].pinnded)
+
+    def _find_pages(self, order, limit):
+        """Find all notes page by page"""
+        ids = []
+        token = ''
+        while True:
+            summaries, token = self.service.find_note_summaries_page(
+                '', dbus.Array([], signature='i'),
+                dbus.Array([], signature='i'), 0,
+                limit, order, -1, token,
+            )
+            self.assertLessEqual(len(summaries), limit)
+            ids += [summary.id for summary in
+                    btype.NoteSummary.list << summaries]
+            if not token:
+                return ids
+
+    def test_find_note_summaries_page(self):
+        """Test pages together are same as whole result"""
+        for order in (
+            const.ORDER_TITLE, const.ORDER_TITLE_DESC,
+            const.ORDER_UPDATED, const.ORDER_UPDATED_DESC,
+        ):
+            whole = self._find(
+                '', dbus.Array([], signature='i'),
+                dbus.Array([], signature='i'), 0,
+                100, order, -1,
+            )
+            self.assertEqual(self._find_pages(order, 2), [
+                note.id for note in whole
+            ])
+            self.assertEqual(self._find_pages(order, 100), [
+                note.id for note in whole
+            ])
+
+    def test_find_note_summaries_page_null_updated(self):
+        """Test pages of notes without updated time"""
+        self.service.session.query(models.Note).update({
+            'updated': None,
+        })
+        self.service.session.commit()
+        for order in (const.ORDER_UPDATED, const.ORDER_UPDATED_DESC):
+            self.assertEqual(
+                sorted(self._find_pages(order, 2)),
+                sorted(note.id for note in self.notes),
+            )
+
+    def test_find_note_summaries_page_wrong_token(self):
+        """Test wrong page token"""
+        with self.assertRaises(DBusException):
+            self.service.find_note_summaries_page(
+                '', dbus.Array([], signature='i'),
+                dbus.Array([], signature='i'), 0,
+                10, const.ORDER_TITLE, -1, 'wrong',
+            )
+
+
+class FindFts4TestCase(FindTestCase):
+    """Find notes case on sqlite without fts5"""
+
+    def setUp(self):
+        fts4 = patch.object(search, 'FTS_MODULES', search.FTS_MODULES[1:])
+        fts4.start()
+        self.addCleanup(fts4.stop)
+        super(FindFts4TestCase, self).setUp()
+
+    def test_fts_version(self):
+        """Test index created with fts4"""
+        self.assertEqual(
+            search.get_fts_version(self.service.session.connection()),
+            'fts4',
+        )
+
 
 class MethodsCase(unittest.TestCase):
     """Case for dbus shortcuts"""
@@ -209,7 +435,6 @@ class MethodsCase(unittest.TestCase):
         self.service = ProviderService()
         self.session = get_db_session()
         self.service._session = self.session
-        models.Note.session = self.session
         self.service.qobject = MagicMock()
         self.service.app = MagicMock()
         self.service.sync = MagicMock()
@@ -253,6 +478,46 @@ class MethodsCase(unittest.TestCase):
         )
         self.assertEqual(remote_notes[0].id, alternative.id)
 
+    def _find_notes_queries(self, count):
+        """Create notes with relations, get found and count of queries"""
+        notebook = factories.NotebookFactory.create(default=True)
+        place = factories.PlaceFactory.create()
+        for _ in range(count):
+            note = factories.NoteFactory.create(
+                action=const.ACTION_NONE, notebook=notebook, place=place,
+                tags=factories.TagFactory.create_batch(2),
+            )
+            self.session.flush()
+            factories.NoteFactory.create(
+                action=const.ACTION_CONFLICT, conflict_parent_id=note.id,
+            )
+        self.session.commit()
+        self.session.expunge_all()
+        del self.queries[:]
+        notes = btype.Note.list << self.service.find_notes(
+            '', dbus.Array([], signature='i'),
+            dbus.Array([], signature='i'), 0, 100, const.ORDER_TITLE, -1,
+        )
+        return notes, len(self.queries)
+
+    def test_find_notes_queries(self):
+        """Test notes relations loaded in constant number of queries"""
+        self.queries = []
+        event.listen(
+            self.session.bind, 'before_cursor_execute',
+            lambda *args: self.queries.append(args[2]),
+        )
+        notes, queries = self._find_notes_queries(3)
+        self.assertEqual(len(notes), 3)
+        for note in notes:
+            self.assertEqual(len(note.tags), 2)
+            self.assertEqual(len(note.conflict_items), 1)
+            self.assertTrue(note.place)
+            self.assertTrue(note.notebook)
+        self.assertEqual(
+            self._find_notes_queries(10)[1], queries,
+        )
+
     def test_list_notebooks(self):
         """Test list notebooks method"""
         notebooks = factories.NotebookFactory.create_batch(
@@ -513,3 +778,122 @@ class MethodsCase(unittest.TestCase):
     def test_is_first_synced(self):
         """Test is first synced"""
         self.assertFalse(self.service.is_first_synced())
+
+
+class UnitOfWorkCase(unittest.TestCase):
+    """Case for session of fresh objects"""
+
+    def setUp(self):
+        self.session = get_db_session()
+        factories.invoke_session(self.session)
+        self.notebook = factories.NotebookFactory.create(default=True)
+        self.session.commit()
+
+    def _give(self, note):
+        note_btype = btype.Note << btype.Note(
+            title='title', content='content', tags=['tag'],
+            notebook=const.NONE_ID, created=const.NONE_VAL,
+            updated=const.NONE_VAL, place='place',
+        ).struct
+        note_btype.id = None
+        note_btype.give_to_obj(note)
+
+    def test_unit_of_work(self):
+        """Test fresh note uses session of unit of work"""
+        note = models.Note(action=const.ACTION_NOEXSIST)
+        with models.unit_of_work(self.session):
+            self._give(note)
+        self.assertEqual(note.notebook, self.notebook)
+        self.assertEqual(note.tags_dbus, ['tag'])
+        self.assertEqual(note.place_dbus, 'place')
+        self.assertIn(note.tags[0], self.session)
+
+    def test_without_unit_of_work(self):
+        """Test fresh note without unit of work fails"""
+        with self.assertRaises(RuntimeError):
+            self._give(models.Note(action=const.ACTION_NOEXSIST))
+
+
+class AsyncCase(unittest.TestCase):
+    """Case for methods called by dbus with callbacks"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        db_path = os.path.join(self.path, 'everpad.db')
+        self.delivered = []
+        self.service = ProviderService()
+        self.service.app = MagicMock()
+        self.service.sync = MagicMock()
+        self.service.data_changed = MagicMock()
+        self.service._session = get_db_session(db_path)
+        factories.invoke_session(self.service._session)
+        notebook = factories.NotebookFactory.create(default=True)
+        self.service._session.commit()
+        self.notebook_id = notebook.id
+        # connection is opened again in writer thread
+        self.service._session.close()
+        self.service._readers = SessionWorkers(
+            2, get_db_readers(2, db_path), self.delivered.append,
+        )
+        self.service._writer = SessionWorkers(
+            1, lambda: self.service._session, self.delivered.append,
+        )
+
+    def tearDown(self):
+        self.service.readers.close()
+        self.service.writer.close()
+        shutil.rmtree(self.path)
+
+    def _call(self, method, *args):
+        """Call method like dbus, get reply args or error"""
+        replies = []
+        method(
+            *args,
+            reply_handler=lambda *result: replies.append(result),
+            error_handler=lambda error: replies.append(error)
+        )
+        self.service.readers.join()
+        self.service.writer.join()
+        self.assertEqual(replies, [])
+        while self.delivered:
+            self.delivered.pop(0)()
+        self.assertEqual(len(replies), 1)
+        return replies[0]
+
+    def test_write_and_read(self):
+        """Test note created by writer is found by readers"""
+        note_struct = self._call(
+            self.service.create_note, btype.Note(
+                title='title', content='content', tags=['tag'],
+                notebook=self.notebook_id, created=const.NONE_VAL,
+                updated=const.NONE_VAL, place='',
+            ).struct,
+        )[0]
+        note_btype = btype.Note << self._call(
+            self.service.update_note, note_struct,
+        )[0]
+        self.assertEqual(self.service.data_changed.call_count, 2)
+        found = btype.Note.list << self._call(
+            self.service.find_notes, 'title', dbus.Array([], signature='i'),
+            dbus.Array([], signature='i'), 0, 100, const.ORDER_TITLE, -1,
+        )[0]
+        self.assertEqual([note.id for note in found], [note_btype.id])
+        self.assertEqual(found[0].tags, ['tag'])
+        self.assertEqual(found[0].notebook, self.notebook_id)
+
+    def test_page(self):
+        """Test page reply has summaries and token"""
+        summaries, token = self._call(
+            self.service.find_note_summaries_page, '',
+            dbus.Array([], signature='i'), dbus.Array([], signature='i'),
+            0, 10, const.ORDER_TITLE, -1, '',
+        )
+        self.assertEqual((summaries, token), ([], ''))
+
+    def test_error(self):
+        """Test errors are passed to error callback"""
+        error = self._call(self.service.get_note, 100)
+        self.assertIsInstance(error, DBusException)
+        error = self._call(self.service.share_note, 100)
+        self.assertIsInstance(error, DBusException)
+        self.assertFalse(self.service.sync.called)
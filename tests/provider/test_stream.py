@@ -0,0 +1,108 @@
+from thrift.Thrift import TMessageType
+from thrift.protocol import TBinaryProtocol
+from thrift.transport import TTransport
+from evernote.edam.notestore import NoteStore
+from evernote.edam.error.ttypes import EDAMNotFoundException
+from evernote.edam.type import ttypes
+from everpad.provider import stream
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class ReplyTransport(TTransport.TMemoryBuffer):
+    """Memory transport with prepared reply"""
+
+    def __init__(self, reply):
+        TTransport.TMemoryBuffer.__init__(self, reply)
+        self.sent = ''
+
+    def write(self, buf):
+        self.sent += buf
+
+    def flush(self):
+        pass
+
+
+def create_reply(result):
+    """Serialize getResourceData reply"""
+    buf = TTransport.TMemoryBuffer()
+    protocol = TBinaryProtocol.TBinaryProtocol(buf)
+    protocol.writeMessageBegin('getResourceData', TMessageType.REPLY, 0)
+    result.write(protocol)
+    protocol.writeMessageEnd()
+    return buf.getvalue()
+
+
+class StreamCase(unittest.TestCase):
+    """Resource body streaming case"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.body = ''.join(chr(num % 256) for num in range(300000))
+        self._chunk_size = stream.DATA_CHUNK_SIZE
+        stream.DATA_CHUNK_SIZE = 4096
+
+    def tearDown(self):
+        stream.DATA_CHUNK_SIZE = self._chunk_size
+        shutil.rmtree(self.directory)
+
+    def _note_store(self, result):
+        """Create note store replying with result"""
+        transport = ReplyTransport(create_reply(result))
+        return stream.NoteStoreClient(
+            TBinaryProtocol.TBinaryProtocol(transport),
+        )
+
+    def test_file_data(self):
+        """Test FileData encoded as Data with body"""
+        path = os.path.join(self.directory, 'body')
+        with open(path, 'wb') as body:
+            body.write(self.body)
+        buf = TTransport.TMemoryBuffer()
+        ttypes.Resource(data=stream.FileData(path)).write(
+            TBinaryProtocol.TBinaryProtocol(buf),
+        )
+        resource = ttypes.Resource()
+        resource.read(TBinaryProtocol.TBinaryProtocol(
+            TTransport.TMemoryBuffer(buf.getvalue()),
+        ))
+        self.assertEqual(resource.data.body, self.body)
+
+    def test_download_resource(self):
+        """Test body downloaded to temp file"""
+        note_store = self._note_store(
+            NoteStore.getResourceData_result(success=self.body),
+        )
+        path = stream.download_resource(
+            note_store, 'token', 'guid',
+            hashlib.md5(self.body).hexdigest(), self.directory,
+        )
+        with open(path, 'rb') as body:
+            self.assertEqual(body.read(), self.body)
+        stream.remove_downloads(self.directory)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_download_resource_wrong_hash(self):
+        """Test temp file removed when body hash differs"""
+        note_store = self._note_store(
+            NoteStore.getResourceData_result(success=self.body),
+        )
+        with self.assertRaises(stream.BodyHashError):
+            stream.download_resource(
+                note_store, 'token', 'guid', 'ab' * 16, self.directory,
+            )
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_download_resource_not_found(self):
+        """Test api exception raised"""
+        note_store = self._note_store(NoteStore.getResourceData_result(
+            notFoundException=EDAMNotFoundException(identifier='guid'),
+        ))
+        with self.assertRaises(EDAMNotFoundException):
+            stream.download_resource(
+                note_store, 'token', 'guid', '', self.directory,
+            )
+        self.assertEqual(os.listdir(self.directory), [])
@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
 from .. import settings
-from everpad.provider.sync import note, notebook, tag
+from everpad.provider.sync import note, notebook, tag, chunk
+from everpad.provider.sync.base import Checkpoint
 from everpad.provider.tools import get_db_session
-from everpad.provider import models
+from everpad.provider import models, search
 from everpad import const
 from evernote.edam.type import ttypes
+from evernote.edam.notestore.ttypes import (
+    SyncChunk, NoteMetadata, NotesMetadataList,
+)
 from evernote import edam
-from mock import MagicMock
+from mock import MagicMock, patch
 from .. import factories
 import unittest
 import os
@@ -30,7 +34,7 @@ class BaseSyncCase(unittest.TestCase):
 
     def _create_db_session(self):
         """Create database session"""
-        self.session = get_db_session()
+        self.session = get_db_session(savepoints=True)
         factories.invoke_session(self.session)
 
     def _create_note_store(self):
@@ -52,6 +56,13 @@ class BaseSyncCase(unittest.TestCase):
         )
         self.sync.app = MagicMock()
 
+    def _create_checkpoint(self):
+        """Create checkpoint in sync state"""
+        sync_state = models.Sync()
+        self.session.add(sync_state)
+        self.sync.checkpoint = Checkpoint(sync_state)
+        return self.sync.checkpoint
+
 
 class PushNotebookCase(BaseSyncCase):
     """Test notebook sync"""
@@ -170,6 +181,42 @@ class PullNotebookCase(BaseSyncCase):
         self.sync.pull()
         self.assertEqual(self.session.query(models.Notebook).count(), 0)
 
+    def test_failed_notebook_rolled_back_alone(self):
+        """Test failed notebook not stops pull"""
+        notebook = factories.NotebookFactory.create(
+            service_updated=0,
+            action=const.ACTION_NONE,
+        )
+        # duplicated guid fails lookup of notebook
+        factories.NotebookFactory.create(
+            guid=notebook.guid,
+            action=const.ACTION_NONE,
+        )
+        self.note_store.listNotebooks.return_value = [
+            ttypes.Notebook(
+                name='changed', guid=notebook.guid, serviceUpdated=1,
+            ),
+            ttypes.Notebook(name='name', guid='guid'),
+        ]
+        self.sync.pull()
+        self.assertEqual(self.sync.failed, [notebook.guid])
+        self.assertEqual(self.session.query(models.Notebook).count(), 3)
+
+    def test_bug_stops_pull(self):
+        """Test not data error stops pull"""
+        notebook = factories.NotebookFactory.create(
+            service_updated=0,
+            action=const.ACTION_NONE,
+        )
+        self.note_store.listNotebooks.return_value = [
+            ttypes.Notebook(
+                name=None, guid=notebook.guid, serviceUpdated=1,
+            ),
+        ]
+        with self.assertRaises(AttributeError):
+            self.sync.pull()
+        self.assertEqual(self.sync.failed, [])
+
 
 class PushTagCase(BaseSyncCase):
     """Test tag sync"""
@@ -335,6 +382,24 @@ class PushNoteCase(BaseSyncCase):
         self.assertEqual(note.share_status, const.SHARE_SHARED)
         self.assertIsNotNone(note.share_url)
 
+    def test_created_note_kept(self):
+        """Test guid of created note kept when sharing it failed"""
+        note = factories.NoteFactory.create(
+            guid=None,
+            action=const.ACTION_CREATE,
+            share_status=const.SHARE_NEED_SHARE,
+        )
+        self.session.commit()
+        self.note_store.createNote.return_value.guid = 'guid'
+        self.note_store.shareNote.side_effect =\
+            edam.error.ttypes.EDAMSystemException
+        with self.assertRaises(edam.error.ttypes.EDAMSystemException):
+            self.sync.push()
+        self.session.expire_all()
+        self.assertEqual(note.guid, 'guid')
+        self.assertEqual(note.action, const.ACTION_NONE)
+        self.assertEqual(note.share_status, const.SHARE_NEED_SHARE)
+
     def test_push_for_stop_sharing(self):
         """Test push for stop sharing"""
         note = factories.NoteFactory.create(
@@ -386,11 +451,29 @@ class PullNoteCase(BaseSyncCase):
         search_result.totalNotes = 1
         search_result.startIndex = 0
         search_result.notes = [remote_note]
-        self.note_store.findNotes.return_value = search_result
+        self.note_store.findNotesMetadata.return_value = search_result
         self.note_store.getNote.return_value = remote_note
 
         return remote_note
 
+    def _create_remote_note_metadata(self, note):
+        """Create remote note metadata without resources list"""
+        self._create_remote_note(note.title, note.guid)
+        self.note_store.findNotesMetadata.return_value.notes = [
+            NoteMetadata(
+                guid=note.guid,
+                title=note.title,
+                updated=note.updated,
+                attributes=ttypes.NoteAttributes(),
+                largestResourceSize=10,
+            ),
+        ]
+        # only sync chunk Note lists resources
+        self.assertFalse(hasattr(
+            self.note_store.findNotesMetadata.return_value.notes[0],
+            'resources',
+        ))
+
     def test_pull_new_note(self):
         """Test pull new note"""
         note_title = 'title'
@@ -415,6 +498,102 @@ class PullNoteCase(BaseSyncCase):
         self.assertEqual(note.title, note.title)
         self.assertEqual(self.session.query(models.Resource).count(), 1)
 
+    def test_pull_changed_note_same_content(self):
+        """Test pull changed note without content download"""
+        note = factories.NoteFactory.create(
+            updated=0,
+            contentHash='ab',
+            action=const.ACTION_NONE,
+        )
+        content = note.content
+        remote_note = self._create_remote_note('title*', note.guid)
+        remote_note.content = None
+        remote_note.contentHash = '\xab'
+        self.sync.pull()
+        self.assertEqual(note.title, 'title*')
+        self.assertEqual(note.content, content)
+        self.assertFalse(self.note_store.getNoteContent.called)
+
+    def test_pull_changed_content(self):
+        """Test pull note with changed content hash"""
+        note = factories.NoteFactory.create(
+            updated=0,
+            contentHash='ab',
+            action=const.ACTION_NONE,
+        )
+        remote_note = self._create_remote_note(note.title, note.guid)
+        remote_note.content = None
+        remote_note.contentHash = '\xcd'
+        self.note_store.getNoteContent.return_value =\
+            '<en-note>changed</en-note>'
+        self.sync.pull()
+        self.assertEqual(note.content, 'changed')
+        self.assertEqual(note.contentHash, 'cd')
+
+    def test_pull_not_changed_note_with_resource(self):
+        """Test pull not changed note without downloading"""
+        note = factories.NoteFactory.create(
+            updated=1,
+            action=const.ACTION_NONE,
+        )
+        self.session.flush()
+        factories.ResourceFactory.create(
+            guid='file',
+            hash='',
+            note_id=note.id,
+        )
+        self._create_remote_note_metadata(note)
+        self.sync.pull()
+        self.assertFalse(self.note_store.getNote.called)
+        self.assertFalse(self.note_store.getResourceDataToFile.called)
+        self.assertEqual(self.session.query(models.Resource).count(), 1)
+
+    def test_pull_not_changed_note_without_resource(self):
+        """Test pull not changed note with not received resource"""
+        note = factories.NoteFactory.create(
+            updated=1,
+            action=const.ACTION_NONE,
+        )
+        self._create_remote_note_metadata(note)
+        self.sync.pull()
+        self.assertEqual(self.note_store.getNote.call_count, 1)
+        self.assertEqual(self.session.query(models.Resource).count(), 1)
+
+    def test_pull_not_changed_chunk_note_with_resource(self):
+        """Test resources of chunk note compared without downloading"""
+        note = factories.NoteFactory.create(
+            updated=1,
+            action=const.ACTION_NONE,
+        )
+        self.session.flush()
+        resource = factories.ResourceFactory.create(
+            guid='file',
+            hash='',
+            note_id=note.id,
+        )
+        self._create_remote_note(note.title, note.guid)
+        self.sync.pull()
+        self.assertFalse(self.note_store.getNote.called)
+        self.assertFalse(self.note_store.getResourceDataToFile.called)
+        self.assertEqual(
+            self.session.query(models.Resource).one().id, resource.id,
+        )
+
+    def test_pull_not_changed_chunk_note_new_resource(self):
+        """Test new resource of chunk note received without getNote"""
+        note = factories.NoteFactory.create(
+            updated=1,
+            action=const.ACTION_NONE,
+        )
+        self.session.flush()
+        self._create_remote_note(note.title, note.guid)
+        self.sync.pull()
+        self.assertFalse(self.note_store.getNote.called)
+        self.assertEqual(self.note_store.getResourceDataToFile.call_count, 1)
+        self.assertEqual(
+            self.session.query(models.Resource).one().note_id, note.id,
+        )
+
     def test_delete_after_pull(self):
         """Test delete non exists note after pull"""
         note = factories.NoteFactory.create(
@@ -424,10 +603,161 @@ class PullNoteCase(BaseSyncCase):
         search_result.totalNotes = 0
         search_result.startIndex = 0
         search_result.notes = []
-        self.note_store.findNotes.return_value = search_result
+        self.note_store.findNotesMetadata.return_value = search_result
         self.sync.pull()
         self.assertEqual(self.session.query(models.Note).count(), 0)
 
+    def test_pull_tags_and_place(self):
+        """Test tags and place of note resolved"""
+        tag = factories.TagFactory.create()
+        remote_note = self._create_remote_note('title', 'guid')
+        remote_note.tagGuids = [tag.guid, 'unknown', tag.guid]
+        remote_note.attributes.placeName = 'home'
+        self.sync.pull()
+        note = self.session.query(models.Note).one()
+        self.assertEqual(note.tags, [tag])
+        self.assertEqual(note.place.name, 'home')
+
+    def test_pull_coordinates(self):
+        """Test coordinates of note kept for geocoding"""
+        remote_note = self._create_remote_note('title', 'guid')
+        remote_note.attributes.latitude = 55.75
+        remote_note.attributes.longitude = 37.62
+        self.sync.pull()
+        note = self.session.query(models.Note).one()
+        self.assertIsNone(note.place)
+        self.assertEqual((note.latitude, note.longitude), (55.75, 37.62))
+
+    def test_pull_coordinates_not_changed_note(self):
+        """Test coordinates of not changed note kept from metadata"""
+        note = factories.NoteFactory.create(
+            updated=1,
+            action=const.ACTION_NONE,
+        )
+        self._create_remote_note_metadata(note)
+        attributes = self.note_store.findNotesMetadata.return_value\
+            .notes[0].attributes
+        attributes.latitude = 55.75
+        attributes.longitude = 37.62
+        self.sync.pull()
+        self.assertEqual((note.latitude, note.longitude), (55.75, 37.62))
+
+    def test_delete_not_received(self):
+        """Test notes of previous pull not received again removed"""
+        stale = factories.NoteFactory.create(
+            action=const.ACTION_NONE, sync_generation=1,
+        )
+        received = factories.NoteFactory.create(
+            action=const.ACTION_NONE, sync_generation=1, updated=1,
+        )
+        self._create_remote_note(received.title, received.guid)
+        self.sync.pull()
+        self.assertEqual(self.session.query(models.Note).one(), received)
+        self.assertEqual(received.sync_generation, 2)
+
+    def test_not_changed_notes_not_reindexed(self):
+        """Test pull of not changed notes keeps full text index"""
+        note = factories.NoteFactory.create(
+            updated=1,
+            notebook=self.notebook,
+            action=const.ACTION_NONE,
+        )
+        self._create_remote_note_metadata(note)
+        self.session.commit()
+        with patch.object(search, 'index_notes') as index_notes:
+            self.sync.pull()
+        self.assertEqual(note.sync_generation, self.sync.generation)
+        for call in index_notes.call_args_list:
+            self.assertFalse(call[0][1])
+
+    def test_worker_note_store(self):
+        """Test worker note store uses url of sync note store"""
+        self.note_store.url = 'https://host/shard/s1/notestore'
+        with patch.object(note.tools, 'get_note_store') as get_note_store:
+            self.sync._create_note_store()
+        get_note_store.assert_called_once_with(
+            self.TOKEN, self.note_store.url,
+        )
+
+    def test_checkpoint(self):
+        """Test offset of pulled notes saved to checkpoint"""
+        self._create_remote_note('title', 'guid')
+        checkpoint = self._create_checkpoint()
+        self.sync.pull()
+        self.assertEqual(checkpoint.offset, 1)
+        self.assertEqual(checkpoint.updated, 1)
+        self.assertEqual(checkpoint.generation, self.sync.generation)
+
+    def test_resume_pull(self):
+        """Test resumed pull starts at offset and keeps notes"""
+        note = factories.NoteFactory.create(
+            action=const.ACTION_NONE,
+        )
+        search_result = MagicMock()
+        search_result.totalNotes = 5
+        search_result.startIndex = 5
+        search_result.notes = []
+        self.note_store.findNotesMetadata.return_value = search_result
+        self.sync.pull(5)
+        self.assertEqual(
+            self.note_store.findNotesMetadata.call_args[0][2], 5,
+        )
+        self.assertEqual(self.session.query(models.Note).one(), note)
+
+    def test_delete_after_resume(self):
+        """Test resumed pull removes notes not received by
+        interrupted one"""
+        stale = factories.NoteFactory.create(
+            action=const.ACTION_NONE, sync_generation=1,
+        )
+        pulled = factories.NoteFactory.create(
+            action=const.ACTION_NONE, sync_generation=2,
+        )
+        checkpoint = self._create_checkpoint()
+        checkpoint.start(const.CHECKPOINT_NOTES, 0)
+        checkpoint.progress(offset=5, generation=2)
+        search_result = MagicMock()
+        search_result.totalNotes = 5
+        search_result.startIndex = 5
+        search_result.notes = []
+        self.note_store.findNotesMetadata.return_value = search_result
+        self.sync.pull(5)
+        self.assertEqual(self.sync.generation, 2)
+        self.assertEqual(self.session.query(models.Note).one(), pulled)
+
+    def test_resume_pull_after_expunge(self):
+        """Test resumed pull doesn't skip notes when notes before
+        checkpoint were expunged"""
+        remote_notes = []
+        for updated in range(120, 0, -1):
+            note = factories.NoteFactory.create(
+                updated=updated,
+                action=const.ACTION_NONE,
+            )
+            remote_notes.append(NoteMetadata(
+                guid=note.guid,
+                title=note.title,
+                updated=updated,
+                attributes=ttypes.NoteAttributes(),
+            ))
+        # pulled till note updated at 21, then 60 notes pulled before it
+        # were expunged, so the rest moved to lower offsets
+        remote_notes = remote_notes[:20] + remote_notes[80:]
+
+        def find_notes(token, note_filter, offset, max_notes, spec):
+            return NotesMetadataList(
+                startIndex=offset,
+                totalNotes=len(remote_notes),
+                notes=remote_notes[offset:offset + max_notes],
+            )
+
+        self.note_store.findNotesMetadata.side_effect = find_notes
+        self.sync.pull(100 - const.CHECKPOINT_OVERLAP, 21)
+        pulled = self.session.query(models.Note).filter(
+            models.Note.sync_generation == self.sync.generation,
+        ).count()
+        self.assertEqual(pulled, len(remote_notes))
+
     def test_pull_with_conflict(self):
         """Test pull with conflict"""
         note = factories.NoteFactory.create(
@@ -480,3 +810,120 @@ class PullNoteCase(BaseSyncCase):
         local_note = self.session.query(models.Note).one()
 
         self.assertEqual(local_note.share_status, const.SHARE_NONE)
+
+
+class IdentityCacheCase(unittest.TestCase):
+    """Notebooks, tags and places cache case"""
+
+    def setUp(self):
+        self.session = get_db_session(savepoints=True)
+        factories.invoke_session(self.session)
+        self.identities = models.IdentityCache(self.session)
+
+    def test_loaded(self):
+        """Test loaded items returned without queries"""
+        notebook = factories.NotebookFactory.create()
+        tag = factories.TagFactory.create()
+        place = factories.PlaceFactory.create()
+        self.session.flush()
+        self.identities.load()
+        self.session.query = MagicMock()
+        self.assertEqual(self.identities.notebook(notebook.guid), notebook)
+        self.assertEqual(self.identities.tags([tag.guid]), [tag])
+        self.assertEqual(self.identities.place(place.name), place)
+        self.assertFalse(self.session.query.called)
+
+    def test_created_after_load(self):
+        """Test items created after load found"""
+        self.identities.load()
+        notebook = factories.NotebookFactory.create()
+        self.session.flush()
+        self.assertEqual(self.identities.notebook(notebook.guid), notebook)
+        place = self.identities.place('new')
+        self.assertEqual(self.identities.place('new'), place)
+        self.assertEqual(self.session.query(models.Place).count(), 1)
+
+    def test_rolled_back(self):
+        """Test item rolled back with savepoint not returned"""
+        self.session.begin_nested()
+        place = self.identities.place('new')
+        self.session.rollback()
+        self.assertNotEqual(self.identities.place('new'), place)
+
+
+class PullChunksCase(BaseSyncCase):
+    """Pull sync chunks case"""
+    sync_cls = chunk.PullChunks
+
+    def setUp(self):
+        super(PullChunksCase, self).setUp()
+        for child in (
+            self.sync._notebooks, self.sync._tags, self.sync._notes,
+        ):
+            child.app = self.sync.app
+
+    def _set_chunks(self, *chunks):
+        """Set chunks returned by server"""
+        self.note_store.getFilteredSyncChunk.side_effect = chunks
+
+    def test_pull_after_usn(self):
+        """Test pull only changes after usn"""
+        self._set_chunks(SyncChunk(
+            chunkHighUSN=12, updateCount=12,
+            tags=[ttypes.Tag(name='name', guid='guid')],
+        ))
+        self.assertEqual(self.sync.pull(10), 12)
+        self.assertEqual(
+            self.note_store.getFilteredSyncChunk.call_args_list[0][0][1], 10,
+        )
+        self.assertEqual(self.session.query(models.Tag).one().guid, 'guid')
+
+    def test_pull_all_chunks(self):
+        """Test pull until last chunk"""
+        self._set_chunks(
+            SyncChunk(chunkHighUSN=5, updateCount=8, notebooks=[
+                ttypes.Notebook(name='first', guid='first'),
+            ]),
+            SyncChunk(chunkHighUSN=8, updateCount=8, notebooks=[
+                ttypes.Notebook(name='second', guid='second'),
+            ]),
+        )
+        self.assertEqual(self.sync.pull(1), 8)
+        self.assertEqual(
+            self.note_store.getFilteredSyncChunk.call_args_list[1][0][1], 5,
+        )
+        self.assertEqual(self.session.query(models.Notebook).count(), 2)
+
+    def test_checkpoint(self):
+        """Test usn of applied chunks saved to checkpoint"""
+        checkpoint = self._create_checkpoint()
+        self._set_chunks(
+            SyncChunk(chunkHighUSN=5, updateCount=8),
+            SyncChunk(chunkHighUSN=8, updateCount=8),
+        )
+        self.sync.pull(1)
+        self.assertEqual(checkpoint.usn, 8)
+
+    def test_empty_chunk(self):
+        """Test nothing changed on server"""
+        self._set_chunks(SyncChunk(updateCount=3))
+        self.assertEqual(self.sync.pull(3), 3)
+
+    def test_expunged(self):
+        """Test remove expunged and trashed"""
+        expunged = factories.NoteFactory.create(action=const.ACTION_NONE)
+        trashed = factories.NoteFactory.create(action=const.ACTION_NONE)
+        changed = factories.NoteFactory.create(action=const.ACTION_CHANGE)
+        tag = factories.TagFactory.create(action=const.ACTION_NONE)
+        self.session.commit()
+        self._set_chunks(SyncChunk(
+            chunkHighUSN=2, updateCount=2,
+            notes=[ttypes.Note(guid=trashed.guid, title='', active=False)],
+            expungedNotes=[expunged.guid, changed.guid],
+            expungedTags=[tag.guid],
+        ))
+        self.sync.pull(1)
+        self.assertItemsEqual(
+            self.session.query(models.Note).all(), [changed],
+        )
+        self.assertEqual(self.session.query(models.Tag).count(), 0)
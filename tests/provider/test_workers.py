@@ -0,0 +1,71 @@
+from .. import settings
+
+from everpad.provider.workers import SessionWorkers
+from everpad.provider.tools import get_db_readers
+from everpad.provider import models
+from everpad import const
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+
+class SessionWorkersCase(unittest.TestCase):
+    """Service workers case"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.delivered = []
+        self.results = []
+        self.errors = []
+        self.workers = SessionWorkers(
+            2, get_db_readers(2, os.path.join(self.path, 'test.db')),
+            self.delivered.append,
+        )
+
+    def tearDown(self):
+        self.workers.close()
+        shutil.rmtree(self.path)
+
+    def _deliver(self):
+        """Wait for jobs and call callbacks like main loop"""
+        self.workers.join()
+        for callback in self.delivered:
+            callback()
+
+    def test_result(self):
+        """Test jobs run in workers with own sessions"""
+        def job(session):
+            return (
+                threading.current_thread().name,
+                session.query(models.Note).count(),
+            )
+
+        for _ in range(4):
+            self.workers.submit(job, self.results.append, self.errors.append)
+        self.workers.join()
+        self.assertEqual(self.results, [])
+        self._deliver()
+        self.assertEqual(len(self.results), 4)
+        self.assertEqual(self.errors, [])
+        for name, count in self.results:
+            self.assertNotEqual(name, threading.current_thread().name)
+            self.assertEqual(count, 0)
+
+    def test_error(self):
+        """Test job exception goes to errback and worker keeps running"""
+        def fail(session):
+            session.add(models.Tag(name='tag', action=const.ACTION_CREATE))
+            session.flush()
+            raise ValueError('failed')
+
+        self.workers.submit(fail, self.results.append, self.errors.append)
+        self.workers.submit(
+            lambda session: session.query(models.Tag).count(),
+            self.results.append, self.errors.append,
+        )
+        self._deliver()
+        self.assertEqual(len(self.errors), 1)
+        self.assertIsInstance(self.errors[0], ValueError)
+        self.assertEqual(self.results, [0])
@@ -0,0 +1,5 @@
+HOST = 'sandbox.evernote.com'
+CONSUMER_KEY = ''
+CONSUMER_SECRET = ''
+DB_PATH = ':memory:'
+TOKEN = ''
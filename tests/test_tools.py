@@ -0,0 +1,21 @@
+from everpad.tools import sanitize
+import unittest
+
+
+class SanitizeCase(unittest.TestCase):
+    """Content sanitizer case"""
+
+    def test_sanitize(self):
+        """Test not allowed tags and attributes removed"""
+        self.assertEqual(sanitize(
+            html=u'<div class="c" id="i" style="s">a<custom>b</custom>'
+                 u'<a href="javascript:go()" onclick="go()">c</a>'
+                 u'<a href="https://everpad.org" rel="x">d</a></div>\x01',
+        ), u'<div style="s">ab<a>c</a><a href="https://everpad.org">d</a></div>')
+
+    def test_sanitize_top_level(self):
+        """Test all top level nodes kept"""
+        self.assertEqual(
+            sanitize(html=u'<b>a</b> b <i>c</i><!-- d -->' * 3),
+            u'<b>a</b> b <i>c</i><!-- d -->' * 3,
+        )
@@ -17,18 +17,214 @@
 # under the License.
 #
 
-from TTransport import TTransportBase
+from TTransport import TTransportBase, CReadableTransport
 from cStringIO import StringIO
 
 import urlparse
 import httplib
 import warnings
 import socket
+import errno
+import tempfile
+import threading
+import zlib
 
 
-class THttpClient(TTransportBase):
+class THttpConnectionPool(object):
 
-    """Http implementation of TTransport base."""
+    """Keep-alive connections shared by THttpClient instances.
+
+    Idle connections are kept per (scheme, host, port), at most size of
+    them, a connection is used by one client at a time so the pool can
+    be shared between threads."""
+
+    def __init__(self, size=4):
+        self.size = size
+        self.handshakes = 0
+        self.requests = 0
+        self.reconnects = 0
+        self.bytes_in = 0
+        self.bytes_in_comp = 0
+        self.__idle = {}
+        self.__lock = threading.Lock()
+
+    def acquire(self, scheme, host, port):
+        """Get idle connection or new not connected one"""
+        with self.__lock:
+            self.requests += 1
+            idle = self.__idle.get((scheme, host, port))
+            if idle:
+                return idle.pop()
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host, port)
+        return httplib.HTTPConnection(host, port)
+
+    def release(self, scheme, host, port, connection):
+        """Return connection with fully read response to pool"""
+        with self.__lock:
+            idle = self.__idle.setdefault((scheme, host, port), [])
+            if len(idle) < self.size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def connected(self):
+        """Count new connection"""
+        with self.__lock:
+            self.handshakes += 1
+
+    def dropped(self):
+        """Count idle connection closed by server"""
+        with self.__lock:
+            self.reconnects += 1
+
+    def received(self, size, compressed_size):
+        """Count compressed response body"""
+        with self.__lock:
+            self.bytes_in += size
+            self.bytes_in_comp += compressed_size
+
+    def clear(self):
+        """Close idle connections"""
+        with self.__lock:
+            idle, self.__idle = self.__idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def stats(self):
+        """Get counters of handshakes, requests, reconnects and sizes
+        of compressed responses before and after decompression"""
+        with self.__lock:
+            return {
+                'handshakes': self.handshakes,
+                'requests': self.requests,
+                'reconnects': self.reconnects,
+                'bytes_in': self.bytes_in,
+                'bytes_in_comp': self.bytes_in_comp,
+            }
+
+
+class TCountingSocket(object):
+
+    """Socket of pooled connection counting bytes of the current request.
+
+    sent counts bytes the kernel accepted, received bytes read from the
+    response, so a failed request can tell whether the server could get
+    any of it."""
+
+    def __init__(self, sock):
+        self.__sock = sock
+        self.sent = 0
+        self.received = 0
+
+    def sendall(self, data):
+        view = memoryview(data)
+        while view:
+            sent = self.__sock.send(view)
+            self.sent += sent
+            view = view[sent:]
+
+    def makefile(self, mode='r', bufsize=-1):
+        return TCountingFile(self.__sock.makefile(mode, bufsize), self)
+
+    def __getattr__(self, name):
+        return getattr(self.__sock, name)
+
+
+class TCountingFile(object):
+
+    """Response file adding bytes read to its socket received counter"""
+
+    def __init__(self, fileobj, sock):
+        self.__file = fileobj
+        self.__sock = sock
+
+    def read(self, *args):
+        data = self.__file.read(*args)
+        self.__sock.received += len(data)
+        return data
+
+    def readline(self, *args):
+        line = self.__file.readline(*args)
+        self.__sock.received += len(line)
+        return line
+
+    def __getattr__(self, name):
+        return getattr(self.__file, name)
+
+
+class TDecompressingFile(object):
+
+    """Response body with gzip or deflate content encoding.
+
+    Reads return decompressed data, at most sz bytes, so large replies
+    are never decompressed whole. Sizes are passed to on_close once the
+    response is done with, the wrapped file is closed by its owner."""
+
+    def __init__(self, fileobj, encoding, chunk_size, on_close=None):
+        self.__file = fileobj
+        self.__chunk_size = chunk_size
+        self.__onClose = on_close
+        self.__tryRaw = encoding == 'deflate'
+        if encoding == 'gzip':
+            self.__zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self.__zlib = zlib.decompressobj(zlib.MAX_WBITS)
+        self.bytes_in = 0
+        self.bytes_in_comp = 0
+
+    def __decompress(self, data, sz):
+        try:
+            return self.__zlib.decompress(data, sz)
+        except zlib.error:
+            # some servers send deflate without zlib header
+            if not self.__tryRaw or self.bytes_in:
+                raise
+            self.__tryRaw = False
+            self.__zlib = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self.__zlib.decompress(data, sz)
+
+    def read(self, sz):
+        while True:
+            data = self.__zlib.unconsumed_tail
+            if not data:
+                data = self.__file.read(self.__chunk_size)
+                if not data:
+                    return ''
+                self.bytes_in_comp += len(data)
+            ret = self.__decompress(data, sz)
+            if ret:
+                self.bytes_in += len(ret)
+                return ret
+
+    def close(self):
+        on_close, self.__onClose = self.__onClose, None
+        if on_close is not None:
+            on_close(self.bytes_in, self.bytes_in_comp)
+
+
+class THttpClient(TTransportBase, CReadableTransport):
+
+    """Http implementation of TTransport base.
+
+    Responses are read in rbuf_size chunks, the client is readable from C,
+    so fastbinary decodes replies of TBinaryProtocolAccelerated.
+
+    With pool connections are kept alive between calls and clients,
+    without it every call opens new connection.
+
+    With compress gzip and deflate responses are accepted and
+    transparently decompressed.
+
+    Requests larger than SPOOL_SIZE (resource uploads) are buffered in
+    temporary file and sent from it.
+
+    bytes_in and bytes_in_comp count compressed responses after and
+    before decompression, they are added to pool stats too."""
+
+    DEFAULT_BUFFER = 65536
+    SPOOL_SIZE = 1024 * 1024
 
     def __init__(
         self,
@@ -36,7 +232,10 @@ class THttpClient(TTransportBase):
         port=None,
         path=None,
         proxy_host=None,
-        proxy_port=None
+        proxy_port=None,
+        rbuf_size=DEFAULT_BUFFER,
+        pool=None,
+        compress=False
     ):
         """THttpClient supports two different types constructor parameters.
 
@@ -88,19 +287,34 @@ class THttpClient(TTransportBase):
             self.endpoint_port = self.port
 
         self.__wbuf = StringIO()
+        self.__rbuf = StringIO('')
+        self.__rbuf_size = rbuf_size
         self.__http = None
+        self.__pool = pool
+        self.__compress = compress
+        self.__connection = None
+        self.__response = None
+        self.__file = None
         self.__timeout = None
         self.__headers = {}
+        self.bytes_in = 0
+        self.bytes_in_comp = 0
 
     def open(self):
         protocol = httplib.HTTP if self.scheme == 'http' else httplib.HTTPS
         self.__http = protocol(self.endpoint_host, self.endpoint_port)
 
     def close(self):
+        if self.__pool is not None:
+            self.__releaseConnection()
+            return
+        self.__closeFile()
         self.__http.close()
         self.__http = None
 
     def isOpen(self):
+        if self.__pool is not None:
+            return self.__connection is not None
         return self.__http is not None
 
     def setTimeout(self, ms):
@@ -113,39 +327,114 @@ class THttpClient(TTransportBase):
             self.__timeout = ms / 1000.0
 
     def read(self, sz):
-        return self.__http.file.read(sz)
+        ret = self.__rbuf.read(sz)
+        if len(ret) != 0:
+            return ret
+
+        self.__rbuf = StringIO(self.__file.read(
+            max(sz, self.__rbuf_size)))
+        return self.__rbuf.read(sz)
+
+    def readAll(self, sz):
+        ret = self.__rbuf.read(sz)
+        if len(ret) == sz:
+            return ret
+
+        chunks = [ret]
+        have = len(ret)
+        while have < sz:
+            if sz - have < self.__rbuf_size:
+                # small reads are served from refilled buffer
+                chunk = self.read(sz - have)
+            else:
+                # large ones (resource bodies) are read from response
+                # at once, without copying through buffer
+                chunk = self.__file.read(sz - have)
+            if not chunk:
+                raise EOFError()
+            chunks.append(chunk)
+            have += len(chunk)
+        return ''.join(chunks)
+
+    # Implement the CReadableTransport interface.
+    @property
+    def cstringio_buf(self):
+        return self.__rbuf
+
+    def cstringio_refill(self, partialread, reqlen):
+        chunks = [partialread]
+        have = len(partialread)
+        if reqlen < self.__rbuf_size:
+            # try to make a read of as much as we can.
+            chunks.append(self.__file.read(self.__rbuf_size))
+            have += len(chunks[-1])
+
+        # but make sure we do read reqlen bytes.
+        while have < reqlen:
+            chunk = self.__file.read(reqlen - have)
+            if not chunk:
+                raise EOFError()
+            chunks.append(chunk)
+            have += len(chunk)
+
+        self.__rbuf = StringIO(''.join(chunks))
+        return self.__rbuf
 
     def write(self, buf):
         self.__wbuf.write(buf)
+        if self.__wbuf.tell() > self.SPOOL_SIZE and \
+                not isinstance(self.__wbuf, file):
+            spool = tempfile.TemporaryFile()
+            spool.write(self.__wbuf.getvalue())
+            self.__wbuf = spool
+
+    def __pullData(self):
+        """Get request body and its length, file for large ones"""
+        wbuf = self.__wbuf
+        self.__wbuf = StringIO()
+        if isinstance(wbuf, file):
+            length = wbuf.tell()
+            wbuf.seek(0)
+            return wbuf, length
+        data = wbuf.getvalue()
+        return data, len(data)
 
     def __withTimeout(f):
         def _f(*args, **kwargs):
             orig_timeout = socket.getdefaulttimeout()
             socket.setdefaulttimeout(args[0].__timeout)
-            result = f(*args, **kwargs)
-            socket.setdefaulttimeout(orig_timeout)
-            return result
+            try:
+                return f(*args, **kwargs)
+            finally:
+                socket.setdefaulttimeout(orig_timeout)
         return _f
 
     def addHeaders(self, **kwargs):
         self.__headers.update(kwargs)
 
     def flush(self):
+        # Pull data out of buffer
+        data, length = self.__pullData()
+        self.__rbuf = StringIO('')
+
+        if self.__pool is not None:
+            self.__flushPooled(data, length)
+            return
+
         if self.isOpen():
             self.close()
         self.open()
 
-        # Pull data out of buffer
-        data = self.__wbuf.getvalue()
-        self.__wbuf = StringIO()
-
         # HTTP request
-        self.__http.putrequest('POST', self.path)
+        self.__http.putrequest(
+            'POST', self.path, skip_accept_encoding=self.__compress)
 
         # Write headers
         self.__http.putheader('Host', self.host)
         self.__http.putheader('Content-Type', 'application/x-thrift')
-        self.__http.putheader('Content-Length', str(len(data)))
+        self.__http.putheader('Content-Length', str(length))
+        if self.__compress:
+            self.__http.putheader('Accept-Encoding', 'gzip, deflate')
         for key, value in self.__headers.iteritems():
             self.__http.putheader(key, value)
         self.__http.endheaders()
@@ -155,6 +444,99 @@ class THttpClient(TTransportBase):
 
         # Get reply to flush the request
         self.code, self.message, self.headers = self.__http.getreply()
+        self.__file = self.__decodedFile(self.__http.file)
+
+    def __flushPooled(self, data, length):
+        self.__releaseConnection()
+        headers = {
+            'Host': self.host,
+            'Content-Type': 'application/x-thrift',
+            'Content-Length': str(length),
+        }
+        if self.__compress:
+            headers['Accept-Encoding'] = 'gzip, deflate'
+        headers.update(self.__headers)
+
+        while True:
+            connection = self.__pool.acquire(
+                self.scheme, self.endpoint_host, self.endpoint_port)
+            reused = connection.sock is not None
+            try:
+                if not reused:
+                    connection.connect()
+                    connection.sock = TCountingSocket(connection.sock)
+                    self.__pool.connected()
+                sock = connection.sock
+                sock.sent = sock.received = 0
+                if isinstance(data, file):
+                    data.seek(0)
+                connection.request('POST', self.path, data, headers)
+                response = connection.getresponse()
+                break
+            except (httplib.HTTPException, socket.error) as e:
+                connection.close()
+                # calls aren't idempotent, so the request is sent again
+                # only when server dropped idle keep-alive connection
+                # and couldn't handle it
+                if not (reused and self.__wasDropped(sock, e)):
+                    raise
+                self.__pool.dropped()
+
+        self.__connection = connection
+        self.__response = response
+        self.code = response.status
+        self.message = response.reason
+        self.headers = response.msg
+        self.__file = self.__decodedFile(response)
+
+    def __wasDropped(self, sock, error):
+        """Check request failed on connection closed by server before
+        any byte was sent or without any byte of response"""
+        if isinstance(error, socket.timeout):
+            return False
+        if not sock.sent:
+            return True
+        if sock.received:
+            return False
+        if isinstance(error, httplib.BadStatusLine):
+            return True
+        return isinstance(error, socket.error) and \
+            error.errno == errno.ECONNRESET
+
+    def __decodedFile(self, fileobj):
+        if not self.__compress:
+            return fileobj
+        encoding = self.headers.getheader('Content-Encoding', '')
+        encoding = encoding.strip().lower()
+        if encoding in ('gzip', 'deflate'):
+            return TDecompressingFile(
+                fileobj, encoding, self.__rbuf_size, self.__received)
+        return fileobj
+
+    def __received(self, size, compressed_size):
+        self.bytes_in += size
+        self.bytes_in_comp += compressed_size
+        if self.__pool is not None:
+            self.__pool.received(size, compressed_size)
+
+    def __closeFile(self):
+        if isinstance(self.__file, TDecompressingFile):
+            self.__file.close()
+        self.__file = None
+
+    def __releaseConnection(self):
+        connection, response = self.__connection, self.__response
+        if connection is None:
+            return
+        self.__closeFile()
+        self.__connection = self.__response = None
+        # response closes itself when body is read till the end
+        if response.isclosed() and not response.will_close:
+            self.__pool.release(
+                self.scheme, self.endpoint_host, self.endpoint_port,
+                connection)
+        else:
+            connection.close()
 
     # Decorate if we know how to timeout
     if hasattr(socket, 'getdefaulttimeout'):